@@ -1,9 +1,10 @@
 # app.py
 
-from flask import Flask, jsonify
+from flask import Flask, jsonify, Response, request
 from flask_jwt_extended import JWTManager
 from twilio.base.exceptions import TwilioRestException
 import os
+from datetime import timedelta
 from dotenv import load_dotenv
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -11,15 +12,30 @@ from flask_limiter.util import get_remote_address
 from blueprints.auth.routes import auth_bp
 from blueprints.api.routes import api_bp
 from blueprints.frontend.routes import frontend_bp
+from blueprints.webhooks.routes import webhooks_bp
 from models import db # Import the db instance
+import auth_tokens
+import inbound
+import instrumentation
+import metrics
+import rate_limits
+import tenant_cache
+from db import reset_round_trips, get_round_trips
 
 load_dotenv()
 
+REVOKED_TOKEN = {"error": "Token revocado", "reason": "Renueva el token con /auth/refresh o inicia sesión de nuevo"}
+
 def create_app():
     app = Flask(__name__)
     app.config["JWT_SECRET_KEY"] = os.environ.get('FLASK_SECRET_KEY')
+    # Access tokens carry the tenant's claims; keep them short-lived and renew them with the refresh token.
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=int(os.environ.get('JWT_ACCESS_TOKEN_MINUTES', 15)))
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=int(os.environ.get('JWT_REFRESH_TOKEN_DAYS', 30)))
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get('DIRECT_URL')
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False # Suppress a warning
+    # RATELIMIT_ENABLED=false turns the default limits off, e.g. for the benchmarks in bench/
+    app.config["RATELIMIT_ENABLED"] = os.environ.get('RATELIMIT_ENABLED', 'true').lower() != 'false'
 
     # Initialize extensions
     jwt = JWTManager(app)
@@ -34,6 +50,39 @@ def create_app():
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(frontend_bp, url_prefix='/')
+    app.register_blueprint(webhooks_bp, url_prefix='/webhook')
+    # Twilio retries on 429 and bursts follow user traffic, not a single client.
+    limiter.exempt(webhooks_bp)
+    # The API is limited per tenant (rate_limits.py), shared by every worker.
+    limiter.exempt(api_bp)
+
+    metrics.describe('db_round_trips_per_request', 'Database round trips made while serving a request')
+
+    @app.before_request
+    def start_round_trip_count():
+        reset_round_trips()
+
+    @app.after_request
+    def report_round_trips(response):
+        round_trips = get_round_trips()
+        response.headers['X-DB-Round-Trips'] = str(round_trips)
+        metrics.observe('db_round_trips_per_request', round_trips,
+                        buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21), endpoint=request.endpoint or 'unknown')
+        return response
+
+    if instrumentation.ENABLED:
+        instrumentation.init_app(app, tenant_lookup=tenant_cache.get_by_id)
+    rate_limits.init_app(app, {api_bp.name}, tenant_cache.get_by_id, tenant_cache.get_default)
+
+    @app.route('/metrics')
+    @limiter.exempt
+    def metrics_endpoint():
+        # The inbound consumers run in their own process; refresh the dead-event gauge here too.
+        try:
+            inbound.count_dead()
+        except Exception:
+            app.logger.exception('Could not count dead inbound events')
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
     # ==============================================================================
     # == Manejo de Errores
@@ -59,6 +108,14 @@ def create_app():
     def invalid_token_callback(error):
         return jsonify({"error": "Token inválido", "details": str(error)}), 422
 
+    @jwt.token_in_blocklist_loader
+    def token_revoked(jwt_header, jwt_payload):
+        return auth_tokens.is_revoked(jwt_payload)
+
+    @jwt.revoked_token_loader
+    def revoked_token_callback(jwt_header, jwt_payload):
+        return jsonify(REVOKED_TOKEN), 401
+
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,312 @@
+# asgi.py
+
+"""
+ASGI entry point for the async serving mode::
+
+    uvicorn asgi:app --workers 4
+
+The hot paths (sending, the Twilio webhooks and the message history) are
+served natively on asyncio, with psycopg 3 for Postgres and aiohttp for
+Twilio, so a process keeps thousands of sends in flight instead of one per
+thread. Every other route falls through to the regular Flask app. The async
+handlers reuse the blueprints' validation helpers and response models, so
+both modes accept and return exactly the same thing.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import decode_token
+from jwt import ExpiredSignatureError
+from psycopg import sql as psycopg_sql
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from flask_restx import marshal
+from twilio.base.exceptions import TwilioRestException
+from werkzeug.datastructures import ImmutableMultiDict
+
+import async_db
+import auth_tokens
+import inbound
+import message_history
+import metrics
+import rate_limits
+import status_updates
+import tenant_cache
+import twilio_clients
+from app import REVOKED_TOKEN, create_app
+from blueprints.api.routes import (
+    history_model, lookup_tenant, missing_twilio_credentials, parse_history_args, parse_send_request,
+    throttled_response,
+)
+from blueprints.webhooks.routes import EMPTY_TWIML, signature_is_valid, unknown_tenant_twiml
+from db import count_round_trip, get_round_trips, reset_round_trips
+from message_store import record_statement
+import send_queue
+
+logger = logging.getLogger(__name__)
+
+flask_app = create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+
+NDJSON_CHUNK_ROWS = 200
+
+metrics.describe('asgi_request_seconds', 'Time spent serving natively async requests')
+
+
+class Request:
+    """The parts of an ASGI HTTP request the async handlers need."""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.body = body
+        self.args = ImmutableMultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+
+    @property
+    def full_path(self):
+        return self.path + ('?' + self.query_string if self.query_string else '')
+
+    @property
+    def url(self):
+        host = self.headers.get('host') or '%s:%s' % tuple(self.scope['server'])
+        return f"{self.scope.get('scheme', 'http')}://{host}{self.full_path}"
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            return None
+
+    def form(self):
+        return ImmutableMultiDict(parse_qsl(self.body.decode('utf-8'), keep_blank_values=True))
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _start(send, status, content_type, headers=None):
+    raw = [(b'content-type', content_type.encode()), (b'x-db-round-trips', str(get_round_trips()).encode())]
+    raw += [(k.lower().encode(), str(v).encode()) for k, v in (headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw})
+
+
+async def respond_json(send, body, status=200, headers=None):
+    await _start(send, status, 'application/json', headers)
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+    return status
+
+
+async def respond_twiml(send, body=EMPTY_TWIML, status=200):
+    await _start(send, status, 'application/xml')
+    await send({'type': 'http.response.body', 'body': body.encode()})
+    return status
+
+
+def jwt_claims(request):
+    """Returns (claims, None) for a valid access token, or (None, (error, status)) like the sync app."""
+    auth = request.headers.get('authorization', '')
+    if not auth.startswith('Bearer '):
+        return None, ({"error": "Acceso no autorizado", "reason": "Missing Authorization Header"}, 401)
+    with flask_app.app_context():
+        try:
+            decoded = decode_token(auth[len('Bearer '):])
+        except ExpiredSignatureError:
+            return None, ({"msg": "Token has expired"}, 401)
+        except Exception as e:
+            return None, ({"error": "Token inválido", "details": str(e)}, 422)
+    if decoded.get('type') != 'access':
+        return None, ({"error": "Token inválido", "details": "Only non-refresh tokens are allowed"}, 422)
+    if auth_tokens.is_revoked(decoded):
+        return None, (REVOKED_TOKEN, 401)
+    return decoded, None
+
+
+async def over_limit(send, tenant):
+    """Applies the tenant's API quota like rate_limits.init_app; returns the 429 status when over it."""
+    if not tenant or not flask_app.config['RATELIMIT_ENABLED']:
+        return None
+    decision = await asyncio.to_thread(rate_limits.check_tenant, tenant)
+    if decision.allowed:
+        return None
+    return await respond_json(send, rate_limits.LIMIT_EXCEEDED, 429, rate_limits.limit_headers(decision))
+
+
+async def send_message(request, send):
+    tenant, error = await asyncio.to_thread(lookup_tenant, request.headers.get('x-tenant-id'))
+    if error:
+        return await respond_json(send, *error)
+    if await over_limit(send, tenant):
+        return 429
+
+    data = request.json() or {}
+    parsed, error = parse_send_request(data)
+    if error:
+        return await respond_json(send, *error)
+    to_number, message_body = parsed
+
+    if missing_twilio_credentials(tenant):
+        return await respond_json(send, {"error": "Credenciales de Twilio no configuradas para este tenant."}, 500)
+
+    whatsapp_user_id = to_number.replace('whatsapp:', '')
+    try:
+        if data.get('enqueue'):
+            async with async_db.connection() as conn:
+                cur = await async_db.execute(conn, *record_statement(
+                    tenant['id'], whatsapp_user_id, 'bot', message_body, to_number,
+                    status='queued', enqueue=True, max_attempts=send_queue.MAX_ATTEMPTS
+                ))
+                message_id, _ = await cur.fetchone()
+            return await respond_json(send, {"success": True, "message_id": str(message_id), "status": "queued"}, 202)
+
+        client = twilio_clients.get_async_client(tenant['id'], tenant['twilio_account_sid'], tenant['twilio_auth_token'])
+        message = await twilio_clients.send_message_async(
+            client, tenant['twilio_whatsapp_number'], to_number, message_body, send_rate=rate_limits.send_rate(tenant)
+        )
+
+        async with async_db.connection() as conn:
+            await async_db.execute(conn, *record_statement(
+                tenant['id'], whatsapp_user_id, 'bot', message_body, to_number, message_sid=message.sid
+            ))
+        return await respond_json(send, {"success": True, "message_sid": message.sid}, 200)
+
+    except rate_limits.SendThrottled as e:
+        return await respond_json(send, *throttled_response(e))
+    except TwilioRestException as e:
+        return await respond_json(send, {"error": f"Error de Twilio: {e.msg}"}, 500)
+    except Exception as e:
+        logger.exception('Async send failed')
+        return await respond_json(send, {"error": f"Error interno del servidor: {str(e)}"}, 500)
+
+
+async def message_history_page(request, send):
+    claims, error = jwt_claims(request)
+    if error:
+        return await respond_json(send, *error)
+    tenant_id = claims['sub']
+    tenant = auth_tokens.tenant_from_claims(claims) or await asyncio.to_thread(tenant_cache.get_by_id, tenant_id)
+    if await over_limit(send, tenant):
+        return 429
+
+    parsed, error = parse_history_args(request.args)
+    if error:
+        return await respond_json(send, *error)
+    filters, limit = parsed
+
+    if request.args.get('format') == 'ndjson':
+        return await _stream_history(send, tenant_id, filters)
+
+    query, args = message_history.build_query(tenant_id, limit=limit + 1, sql=psycopg_sql, **filters)
+    async with async_db.connection() as conn:
+        cur = await async_db.execute(conn, query, args, row_factory=dict_row)
+        rows = await cur.fetchall()
+    rows, next_cursor = message_history.split_page(rows, limit)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    return await respond_json(send, marshal(rows, history_model(filters['columns'])), 200, headers)
+
+
+async def _stream_history(send, tenant_id, filters):
+    columns = filters['columns']
+    query, args = message_history.build_query(tenant_id, sql=psycopg_sql, **filters)
+    async with async_db.connection() as conn:
+        async with conn.cursor(name='message_history_stream', row_factory=dict_row) as cur:
+            cur.itersize = message_history.STREAM_BATCH_SIZE
+            count_round_trip()
+            await cur.execute(query, args)
+            await _start(send, 200, 'application/x-ndjson')
+            lines = []
+            async for row in cur:
+                lines.append(message_history.to_ndjson(row, columns))
+                if len(lines) >= NDJSON_CHUNK_ROWS:
+                    await send({'type': 'http.response.body', 'body': ''.join(lines).encode(), 'more_body': True})
+                    lines = []
+            await send({'type': 'http.response.body', 'body': ''.join(lines).encode()})
+    return 200
+
+
+async def twilio_webhook(request, send):
+    form = request.form()
+    tenant = await asyncio.to_thread(tenant_cache.get_by_whatsapp_number, form.get('To', ''))
+    if not tenant:
+        return await respond_twiml(send, unknown_tenant_twiml())
+
+    if not signature_is_valid(tenant, request.url, request.full_path, form, request.headers.get('x-twilio-signature', '')):
+        return await respond_twiml(send, status=403)
+
+    payload = form.to_dict()
+    async with async_db.connection() as conn:
+        await async_db.execute(conn, inbound.STAGE_SQL, (tenant['id'], payload.get('MessageSid') or None, Jsonb(payload)))
+    metrics.inc('inbound_events_staged_total')
+    return await respond_twiml(send)
+
+
+async def twilio_status_callback(request, send):
+    form = request.form()
+    tenant = await asyncio.to_thread(tenant_cache.get_by_whatsapp_number, form.get('From', ''))
+    if not tenant:
+        return await respond_twiml(send, status=404)
+
+    if not signature_is_valid(tenant, request.url, request.full_path, form, request.headers.get('x-twilio-signature', '')):
+        return await respond_twiml(send, status=403)
+
+    status_updates.coalescer.add(form.get('MessageSid'), form.get('MessageStatus'))
+    return await respond_twiml(send)
+
+
+ROUTES = {
+    ('POST', '/api/api/whatsapp/send'): ('asgi.send', send_message),
+    ('GET', '/api/api/messages/'): ('asgi.messages', message_history_page),
+    ('POST', '/webhook/twilio'): ('asgi.webhook', twilio_webhook),
+    ('POST', '/webhook/twilio/status'): ('asgi.status_callback', twilio_status_callback),
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await async_db.open_pool()
+                # Token checks on the event loop then never wait for the database.
+                await asyncio.to_thread(auth_tokens.load)
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await twilio_clients.close_async_http_client()
+            await async_db.close_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    route = ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if route is None:
+        return await wsgi_app(scope, receive, send)
+
+    endpoint, handler = route
+    reset_round_trips()
+    body = await _read_body(receive)
+    started = time.monotonic()
+    await handler(Request(scope, body), send)
+    metrics.observe('db_round_trips_per_request', get_round_trips(),
+                    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21), endpoint=endpoint)
+    metrics.observe('asgi_request_seconds', time.monotonic() - started, endpoint=endpoint)
+
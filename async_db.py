@@ -0,0 +1,59 @@
+# async_db.py
+
+"""
+Async counterpart of db.py for the ASGI app (asgi.py), on psycopg 3.
+
+The pool is opened and closed by the ASGI lifespan. Statements go through
+``execute`` so they count towards ``X-DB-Round-Trips`` like the sync driver.
+"""
+
+import os
+from contextlib import asynccontextmanager
+
+from psycopg import pq
+from psycopg_pool import AsyncConnectionPool
+
+from db import count_round_trip
+
+_pool = None
+
+
+async def open_pool():
+    global _pool
+    if _pool is None:
+        _pool = AsyncConnectionPool(
+            os.getenv('DIRECT_URL'),
+            min_size=int(os.getenv('ASYNC_DB_POOL_MIN', 2)),
+            max_size=int(os.getenv('ASYNC_DB_POOL_MAX', 20)),
+            max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            open=False,
+        )
+        await _pool.open()
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@asynccontextmanager
+async def connection():
+    """Borrows a connection; commits on success and rolls back on error, like db_connection."""
+    pool = await open_pool()
+    async with pool.connection() as conn:
+        yield conn
+        if conn.info.transaction_status != pq.TransactionStatus.IDLE:
+            # The pool commits when the block exits.
+            count_round_trip()
+
+
+async def execute(conn, query, params=None, **kwargs):
+    """Runs one statement on a new cursor and returns the cursor."""
+    count_round_trip()
+    cur = conn.cursor(**kwargs)
+    await cur.execute(query, params)
+    return cur
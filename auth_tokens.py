@@ -0,0 +1,205 @@
+# auth_tokens.py
+
+"""
+Tenant claims carried in access tokens, and the token revocation list.
+
+Access tokens embed the tenant's routing claims (WhatsApp number, tier and
+quotas), so authorized requests can be routed and rate limited without
+loading the tenant. Twilio credentials never go in a token. Clients renew
+access tokens with a refresh token instead of logging in again.
+
+Revocations live in ``token_revocations``, keyed by a token's ``jti`` or by
+``tenant:<id>``. A tenant key rejects the tenant's access tokens issued
+before it, so changing the claims of a tenant makes its clients refresh.
+Every process keeps the list in memory: it is loaded once and then kept
+current through ``LISTEN/NOTIFY`` (a reconnect reloads it, like
+tenant_cache). Checking a token never touches the database.
+"""
+
+import logging
+import os
+import select
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from flask import current_app
+from psycopg2 import extensions
+
+import metrics
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+LISTEN = os.getenv('AUTH_TOKENS_LISTEN', '1') == '1'
+CHANNEL = 'token_revocations'
+CLAIMS = ('twilio_whatsapp_number', 'tier', 'requests_per_minute', 'messages_per_second')
+
+metrics.describe('auth_tokens_issued_total', 'JWTs issued by type')
+metrics.describe('auth_token_revocations_total', 'Token revocations received by source')
+
+_revoked = {}  # jti or 'tenant:<id>' -> (revoked_at, expires_at), epoch seconds
+_loaded = False
+_lock = threading.Lock()
+_listener = None
+
+
+def tenant_claims(tenant):
+    """Additional claims for an access token of ``tenant``."""
+    return {name: tenant.get(name) for name in CLAIMS}
+
+
+def tenant_from_claims(claims):
+    """
+    A tenant dict with the id and routing claims of a decoded access token,
+    or None for tokens issued without them.
+    """
+    if not claims or claims.get('type') != 'access' or 'twilio_whatsapp_number' not in claims:
+        return None
+    tenant = {name: claims.get(name) for name in CLAIMS}
+    tenant['id'] = claims['sub']
+    return tenant
+
+
+def _epoch(value):
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def _add(key, revoked_at, expires_at):
+    with _lock:
+        _revoked[key] = (revoked_at, expires_at)
+        now = time.time()
+        for stale in [k for k, (_, expires) in _revoked.items() if expires < now]:
+            del _revoked[stale]
+
+
+def load():
+    """(Re)loads the unexpired revocations into this process."""
+    global _loaded
+    _ensure_listener()
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT key, revoked_at, expires_at FROM token_revocations WHERE expires_at > NOW()')
+            rows = cur.fetchall()
+        conn.commit()
+    with _lock:
+        _revoked.clear()
+        for key, revoked_at, expires_at in rows:
+            _revoked[key] = (_epoch(revoked_at), _epoch(expires_at))
+        _loaded = True
+
+
+def is_revoked(jwt_payload):
+    """True if the decoded token was revoked, by ``jti`` or tenant-wide."""
+    if not _loaded:
+        load()
+    if jwt_payload.get('jti') in _revoked:
+        return True
+    if jwt_payload.get('type') == 'access':
+        entry = _revoked.get(f"tenant:{jwt_payload.get('sub')}")
+        # iat has whole-second precision; a token issued in the same second is kept.
+        return entry is not None and jwt_payload.get('iat', 0) < int(entry[0])
+    return False
+
+
+def _revoke(cur, key, expires_at):
+    cur.execute(
+        """
+        INSERT INTO token_revocations (key, expires_at) VALUES (%s, %s)
+        ON CONFLICT (key) DO UPDATE SET revoked_at = NOW(), expires_at = GREATEST(token_revocations.expires_at, EXCLUDED.expires_at)
+        RETURNING revoked_at, expires_at
+        """,
+        (key, expires_at)
+    )
+    revoked_at, expires_at = (_epoch(v) for v in cur.fetchone())
+    cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, f'{key} {revoked_at} {expires_at}'))
+    cur.execute('DELETE FROM token_revocations WHERE expires_at < NOW()')
+    return revoked_at, expires_at
+
+
+def revoke_token(jwt_payload):
+    """Revokes one decoded token until it expires."""
+    key = jwt_payload['jti']
+    expires_at = datetime.fromtimestamp(jwt_payload['exp'], timezone.utc)
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            entry = _revoke(cur, key, expires_at)
+        conn.commit()
+    _add(key, *entry)
+    metrics.inc('auth_token_revocations_total', source='local')
+
+
+def revoke_tenant(cur, tenant_id):
+    """
+    Revokes the access tokens issued so far to ``tenant_id``, on the caller's
+    transaction; other processes learn about it when the transaction commits.
+    """
+    lifetime = current_app.config['JWT_ACCESS_TOKEN_EXPIRES'] or timedelta(0)
+    expires_at = datetime.now(timezone.utc) + lifetime
+    return _revoke(cur, f'tenant:{tenant_id}', expires_at)
+
+
+def remember_tenant_revocation(tenant_id, entry):
+    """Applies a committed ``revoke_tenant`` to this process without waiting for the notification."""
+    _add(f'tenant:{tenant_id}', *entry)
+    metrics.inc('auth_token_revocations_total', source='local')
+
+
+class _Listener(threading.Thread):
+    """Daemon thread holding a dedicated LISTEN connection outside the pool."""
+
+    def __init__(self, dsn):
+        super().__init__(name='token-revocation-listener', daemon=True)
+        self.dsn = dsn
+        self.delay = 1
+
+    def _listen(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {CHANNEL}')
+        self.delay = 1
+        # Anything sent before LISTEN took effect was missed.
+        load()
+        try:
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    key, revoked_at, expires_at = conn.notifies.pop(0).payload.split(' ')
+                    _add(key, float(revoked_at), float(expires_at))
+                    metrics.inc('auth_token_revocations_total', source='notify')
+        finally:
+            conn.close()
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Token revocation listener disconnected, retrying in %ss', self.delay)
+                time.sleep(self.delay)
+                self.delay = min(self.delay * 2, 60)
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is None and LISTEN:
+        with _lock:
+            if _listener is None:
+                _listener = _Listener(os.getenv('DIRECT_URL'))
+                _listener.start()
+
+
+def _after_fork():
+    # The listener thread does not survive fork; the child reloads on first use.
+    global _listener, _loaded
+    _listener = None
+    _loaded = False
+    _revoked.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
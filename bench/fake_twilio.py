@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Servidor HTTP local que imita la API de mensajes de Twilio para benchmarks.
+
+Uso:
+    python3 bench/fake_twilio.py --port 8099 --latency 0.05 --error-rate 0.01
+    TWILIO_API_BASE_URL=http://127.0.0.1:8099 gunicorn 'app:create_app()'
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like api.twilio.com
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        server = self.server
+
+        if server.latency:
+            time.sleep(random.uniform(0, 2 * server.latency))
+
+        with server.lock:
+            server.requests += 1
+
+        if not self.path.endswith('/Messages.json'):
+            return self._reply(404, {'code': 20404, 'message': 'Not found', 'status': 404})
+        if random.random() < server.error_rate:
+            return self._reply(503, {'code': 20500, 'message': 'Simulated failure', 'status': 503})
+
+        account_sid = self.path.split('/')[3]
+        self._reply(201, {
+            'sid': 'SM' + uuid.uuid4().hex,
+            'account_sid': account_sid,
+            'from': form.get('From'),
+            'to': form.get('To'),
+            'body': form.get('Body'),
+            'status': 'queued',
+            'num_segments': '1',
+            'direction': 'outbound-api',
+        })
+
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, error_rate=0.0):
+    """Creates (but does not start) a stand-in server; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), FakeTwilioHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia media por petición, en segundos')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fracción de peticiones que responden 503')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.error_rate)
+    print(f'Twilio simulado en http://{args.host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproducible de la API contra un Postgres desechable y el Twilio simulado.
+
+Uso:
+    python3 bench/harness.py --output bench-results/$(git rev-parse --short HEAD).json
+    python3 bench/harness.py --scenarios send,history --requests 2000 --concurrency 50
+    python3 bench/harness.py --compare bench-results/abc123.json bench-results/def456.json
+
+Crea un clúster temporal de Postgres (con pgserver si está instalado, si no con
+initdb/pg_ctl del PATH o de PG_BIN), crea el esquema con create_db.py, arranca
+create_app() con gunicorn (o asgi.py con --mode async) y sustituye
+api.twilio.com por bench/fake_twilio.py. Con --dsn se usa una base existente,
+que se BORRA y se vuelve a crear.
+
+Escenarios: send, broadcast, webhook, history y tenants. Para cada uno guarda
+rendimiento, latencias p50/p95/p99, idas y vueltas a la base por petición
+(cabecera X-DB-Round-Trips) y la memoria residente (RSS) del servidor.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import aiohttp
+import psycopg2
+from twilio.request_validator import RequestValidator
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_twilio import make_server  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('send', 'broadcast', 'webhook', 'history', 'tenants')
+COMPARED = ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'db_round_trips_mean', 'rss_mb_peak',
+            'dispatch_rps', 'ingest_lag_seconds')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(address, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('El servidor terminó al arrancar')
+        try:
+            with socket.create_connection(address, timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('El servidor no respondió a tiempo')
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# --- Postgres desechable ---------------------------------------------------
+
+@contextlib.contextmanager
+def throwaway_postgres():
+    """Yields the DSN of a temporary cluster that is removed on exit."""
+    workdir = tempfile.mkdtemp(prefix='bench-pg-')
+    try:
+        try:
+            import pgserver
+        except ImportError:
+            pgserver = None
+
+        if pgserver is not None:
+            server = pgserver.get_server(os.path.join(workdir, 'data'), cleanup_mode='delete')
+            try:
+                yield server.get_uri()
+            finally:
+                server.cleanup()
+            return
+
+        bin_dir = os.getenv('PG_BIN', '')
+        initdb, pg_ctl = (os.path.join(bin_dir, name) if bin_dir else shutil.which(name) for name in ('initdb', 'pg_ctl'))
+        if not initdb or not pg_ctl:
+            raise RuntimeError('Instala pgserver o pon initdb/pg_ctl en el PATH (o en PG_BIN)')
+        data = os.path.join(workdir, 'data')
+        subprocess.run([initdb, '-D', data, '-U', 'postgres', '-A', 'trust', '--no-sync'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, '-D', data, '-w', '-l', os.path.join(workdir, 'postgres.log'),
+                        '-o', f"-k {workdir} -c listen_addresses='' -c fsync=off", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield f'postgresql://postgres@/postgres?host={workdir}'
+        finally:
+            subprocess.run([pg_ctl, '-D', data, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def prepare_database(dsn, history_rows):
+    """Recreates the schema and seeds ``history_rows`` messages; returns the default tenant."""
+    subprocess.run([sys.executable, 'create_db.py'], cwd=ROOT, env=dict(os.environ, DIRECT_URL=dsn),
+                   check=True, stdout=subprocess.DEVNULL)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, twilio_auth_token, twilio_whatsapp_number FROM tenants
+                ORDER BY created_at, id LIMIT 1
+            """)
+            tenant_id, auth_token, number = cur.fetchone()
+            cur.execute("""
+                INSERT INTO conversations (tenant_id, whatsapp_user_id, status)
+                VALUES (%s, '+15550000000', 'active') RETURNING id
+            """, (tenant_id,))
+            conversation_id = cur.fetchone()[0]
+            cur.execute("""
+                INSERT INTO messages (conversation_id, tenant_id, message_sid, sender_type, body, to_number, status, timestamp)
+                SELECT %s, %s, 'SMseed' || i, 'user', 'mensaje de prueba ' || i, %s, 'received',
+                       NOW() - i * INTERVAL '1 second'
+                FROM generate_series(1, %s) AS i
+            """, (conversation_id, tenant_id, number, history_rows))
+        conn.commit()
+    finally:
+        conn.close()
+    return {'id': str(tenant_id), 'auth_token': auth_token, 'number': number}
+
+
+def tenant_id_for(dsn, number):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT id FROM tenants WHERE twilio_whatsapp_number = %s', (number,))
+            row = cur.fetchone()
+            return str(row[0]) if row else None
+    finally:
+        conn.close()
+
+
+def pending_inbound(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT count(*) FROM inbound_events')
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+# --- Servidor --------------------------------------------------------------
+
+def process_tree_rss(pid):
+    """Resident memory of ``pid`` and its descendants, in bytes (Linux /proc)."""
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                stack.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Tracks the peak RSS of a process tree while a scenario runs."""
+
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = process_tree_rss(pid)
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+def server_command(mode, port, workers, threads):
+    if mode == 'sync':
+        return [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+                '-b', f'127.0.0.1:{port}', 'app:create_app()']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers', str(workers),
+            '--port', str(port), '--log-level', 'warning', '--no-access-log']
+
+
+@contextlib.contextmanager
+def running(command, env, port=None, quiet=True):
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL if quiet else None)
+    try:
+        if port:
+            wait_ready(('127.0.0.1', port), process)
+        yield process
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# --- Carga -----------------------------------------------------------------
+
+class Recorder:
+    """Latencies, statuses and round trips of every request in a scenario."""
+
+    def __init__(self):
+        self.latencies = []
+        self.round_trips = []
+        self.statuses = {}
+
+    async def request(self, session, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                status = response.status
+                headers = response.headers
+        except aiohttp.ClientError:
+            body, status, headers = b'', 'error', {}
+        self.latencies.append(time.perf_counter() - started)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if 'X-DB-Round-Trips' in headers:
+            self.round_trips.append(int(headers['X-DB-Round-Trips']))
+        return status, headers, body
+
+    def summary(self, elapsed):
+        def ms(p):
+            value = percentile(self.latencies, p)
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            'requests': len(self.latencies),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(len(self.latencies) / elapsed, 1) if elapsed else None,
+            'p50_ms': ms(50),
+            'p95_ms': ms(95),
+            'p99_ms': ms(99),
+            'db_round_trips_mean': (round(sum(self.round_trips) / len(self.round_trips), 2)
+                                    if self.round_trips else None),
+            'db_round_trips_max': max(self.round_trips, default=None),
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items(), key=str)},
+        }
+
+
+async def run_concurrently(total, concurrency, task):
+    """Runs ``task(i)`` for i in range(total) with at most ``concurrency`` in flight."""
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            await task(i)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+
+
+async def scenario_send(ctx, session, rec):
+    async def send(i):
+        await rec.request(session, 'POST', f"{ctx['base_url']}/api/api/whatsapp/send",
+                          json={'to_number': f'+1555{i % 1000:07d}', 'message_body': f'bench {i}'})
+
+    await run_concurrently(ctx['requests'], ctx['concurrency'], send)
+
+
+async def scenario_broadcast(ctx, session, rec):
+    size = ctx['broadcast_size']
+    broadcast_ids = []
+
+    async def create(i):
+        recipients = [{'to_number': f'+1556{i:03d}{n:04d}'} for n in range(size)]
+        status, _, body = await rec.request(session, 'POST', f"{ctx['base_url']}/api/api/whatsapp/broadcast",
+                                            json={'message_body': 'Hola {name}', 'recipients': recipients})
+        if status == 202:
+            broadcast_ids.append(json.loads(body)['id'])
+
+    await run_concurrently(ctx['broadcasts'], ctx['concurrency'], create)
+
+    # Dispatch runs in the server's background threads; wait for it to drain.
+    started = time.perf_counter()
+    for broadcast_id in broadcast_ids:
+        while True:
+            async with session.get(f"{ctx['base_url']}/api/api/whatsapp/broadcast/{broadcast_id}") as response:
+                progress = await response.json()
+            if progress.get('status') == 'done':
+                break
+            await asyncio.sleep(0.1)
+    drained = time.perf_counter() - started
+    return {
+        'recipients': size * len(broadcast_ids),
+        'dispatch_seconds': round(drained, 3),
+        'dispatch_rps': round(size * len(broadcast_ids) / drained, 1) if drained else None,
+    }
+
+
+async def scenario_webhook(ctx, session, rec):
+    url = f"{ctx['base_url']}/webhook/twilio"
+    validator = RequestValidator(ctx['tenant']['auth_token'])
+
+    async def deliver(i):
+        form = {
+            'MessageSid': 'SMbench' + uuid.uuid4().hex, 'To': ctx['tenant']['number'],
+            'From': f'whatsapp:+1557{i % 500:07d}', 'Body': 'hola' if i % 2 else 'precio', 'NumMedia': '0',
+        }
+        await rec.request(session, 'POST', url, data=form,
+                          headers={'X-Twilio-Signature': validator.compute_signature(url, form)})
+
+    await run_concurrently(ctx['requests'], ctx['concurrency'], deliver)
+
+    # The consumer runs out of process; measure how long it takes to catch up.
+    started = time.perf_counter()
+    while await asyncio.to_thread(pending_inbound, ctx['dsn']):
+        await asyncio.sleep(0.05)
+    drained = time.perf_counter() - started
+    return {'ingest_lag_seconds': round(drained, 3)}
+
+
+async def scenario_history(ctx, session, rec):
+    async with session.post(f"{ctx['base_url']}/auth/login",
+                            json={'username': 'admin', 'password': 'password'}) as response:
+        token = (await response.json())['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    # Every worker walks the history from the newest page, as deep as the request budget allows.
+    pages_per_walk = max(1, min(ctx['history_rows'] // ctx['page_size'], ctx['requests'] // ctx['concurrency']))
+
+    async def walk(i):
+        cursor = None
+        for _ in range(pages_per_walk):
+            params = {'limit': ctx['page_size']}
+            if cursor:
+                params['cursor'] = cursor
+            _, response_headers, _ = await rec.request(session, 'GET', f"{ctx['base_url']}/api/api/messages/",
+                                                       params=params, headers=headers)
+            cursor = response_headers.get('X-Next-Cursor')
+            if not cursor:
+                return
+
+    await run_concurrently(max(1, ctx['requests'] // pages_per_walk), ctx['concurrency'], walk)
+
+
+async def scenario_tenants(ctx, session, rec):
+    base = f"{ctx['base_url']}/api/api/tenants/"
+
+    async def crud(i):
+        number = f'whatsapp:+1558{i:07d}'
+        status, _, _ = await rec.request(session, 'POST', base, json={
+            'name': f'Bench {i}', 'twilio_account_sid': f'ACbench{i}', 'twilio_auth_token': 'token',
+            'twilio_whatsapp_number': number,
+        })
+        # The create response is marshalled through stacked models and comes back without the ID.
+        tenant_id = await asyncio.to_thread(tenant_id_for, ctx['dsn'], number) if status == 201 else None
+        if not tenant_id:
+            return
+        await rec.request(session, 'GET', base + tenant_id)
+        await rec.request(session, 'PUT', base + tenant_id, json={'name': f'Bench {i} editado'})
+        await rec.request(session, 'DELETE', base + tenant_id)
+
+    await run_concurrently(max(1, ctx['requests'] // 4), ctx['concurrency'], crud)
+
+
+async def run_scenario(name, ctx, server_pid):
+    rec = Recorder()
+    connector = aiohttp.TCPConnector(limit=ctx['concurrency'])
+    rss_start = process_tree_rss(server_pid)
+    sampler = RssSampler(server_pid)
+    sampler.start()
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        extra = await globals()[f'scenario_{name}'](ctx, session, rec)
+        elapsed = time.perf_counter() - started
+    peak = sampler.stop()
+    result = rec.summary(elapsed)
+    result.update(extra or {})
+    result['rss_mb_start'] = round(rss_start / 2 ** 20, 1)
+    result['rss_mb_peak'] = round(peak / 2 ** 20, 1)
+    return result
+
+
+# --- Informe ---------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(results):
+    for name, r in results['scenarios'].items():
+        print(f"{name:>10}: {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  "
+              f"p99 {r['p99_ms']} ms  round trips {r['db_round_trips_mean']}  RSS {r['rss_mb_peak']} MB  "
+              f"{r['statuses']}")
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{(before.get('commit') or '?')[:10]} -> {(after.get('commit') or '?')[:10]}")
+    for name in after['scenarios']:
+        if name not in before['scenarios']:
+            continue
+        print(f'{name}:')
+        for metric in COMPARED:
+            old, new = before['scenarios'][name].get(metric), after['scenarios'][name].get(metric)
+            if old is None or new is None:
+                continue
+            change = f'{(new - old) / old * 100:+.1f}%' if old else ''
+            print(f'  {metric:<22} {old:>10} -> {new:<10} {change}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=1000, help='Peticiones por escenario')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--mode', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--workers', type=int, default=2, help='Procesos del servidor')
+    parser.add_argument('--threads', type=int, default=8, help='Hilos por worker de gunicorn')
+    parser.add_argument('--latency', type=float, default=0.05, help='Latencia media del Twilio simulado, en segundos')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fracción de envíos que Twilio rechaza con 503')
+    parser.add_argument('--broadcasts', type=int, default=5)
+    parser.add_argument('--broadcast-size', type=int, default=200)
+    parser.add_argument('--history-rows', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--dsn', help='Usa esta base (se borra) en lugar de un Postgres desechable')
+    parser.add_argument('--output', help='Guarda los resultados en este archivo JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('ANTES', 'DESPUES'), help='Compara dos resultados')
+    parser.add_argument('--verbose', action='store_true', help='Muestra la salida del servidor')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    twilio = make_server(latency=args.latency, error_rate=args.error_rate)
+    threading.Thread(target=twilio.serve_forever, daemon=True).start()
+
+    with contextlib.ExitStack() as stack:
+        dsn = args.dsn or stack.enter_context(throwaway_postgres())
+        tenant = prepare_database(dsn, args.history_rows)
+
+        port = free_port()
+        env = dict(os.environ, DIRECT_URL=dsn, RATELIMIT_ENABLED='false', TENANT_CACHE_LISTEN='1',
+                   TWILIO_API_BASE_URL=f'http://127.0.0.1:{twilio.server_port}')
+        env.setdefault('FLASK_SECRET_KEY', 'bench-secret-key-' + uuid.uuid4().hex)
+        # Every send comes from one number; per-number pacing would cap the scenarios at its rate.
+        env.setdefault('SEND_RATE_PER_NUMBER', '0')
+        env.pop('TWILIO_WEBHOOK_BASE_URL', None)
+        env.pop('TWILIO_STATUS_CALLBACK_URL', None)
+        server = stack.enter_context(running(
+            server_command(args.mode, port, args.workers, args.threads), env, port, quiet=not args.verbose
+        ))
+        if 'webhook' in scenarios:
+            stack.enter_context(running([sys.executable, 'inbound.py'], env, quiet=not args.verbose))
+
+        ctx = dict(vars(args), dsn=dsn, tenant=tenant, base_url=f'http://127.0.0.1:{port}')
+        results = {
+            'commit': git_commit(),
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'config': {k: v for k, v in vars(args).items() if k not in ('dsn', 'compare', 'output', 'verbose')},
+            'scenarios': {},
+        }
+        for name in scenarios:
+            results['scenarios'][name] = asyncio.run(run_scenario(name, ctx, server.pid))
+
+    twilio.shutdown()
+    print_summary(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del QueryBuilder de models_prisma: construye las mismas consultas
+con la caché de plantillas (models_prisma._builder.query_cache) y sin ella, que
+es el comportamiento anterior (renderizar el árbol de nodos en cada llamada).
+
+Uso:
+    python3 bench/prisma_builder.py --iterations 20000
+
+Cada escenario cambia los valores de los argumentos en cada llamada, así que
+solo se reutiliza la forma de la consulta. No necesita base de datos ni el
+motor de Prisma.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models_prisma import _builder  # noqa: E402
+from models_prisma.metadata import PRISMA_MODELS, RELATIONAL_FIELD_MAPPINGS  # noqa: E402
+from models_prisma.models import Tenant, WhatsappMessage  # noqa: E402
+
+
+def find_unique(i):
+    return dict(method='find_unique', model=Tenant, arguments={'where': {'id': f'tenant-{i}'}})
+
+
+def find_many_include(i):
+    return dict(
+        method='find_many',
+        model=Tenant,
+        arguments={
+            'where': {'name': {'contains': f'cliente {i}'}},
+            'take': 50,
+            'skip': i % 7,
+            'order_by': [{'name': 'asc'}],
+            'include': {
+                'whatsappMessages': {
+                    'where': {'status': {'in': ['sent', 'delivered']}, 'createdAt': {'gt': datetime.datetime(2024, 1, 1)}},
+                    'take': 20,
+                    'include': {'tenant': True},
+                },
+            },
+        },
+    )
+
+
+def create_many(i):
+    return dict(
+        method='create_many',
+        model=WhatsappMessage,
+        arguments={
+            'data': [
+                {
+                    'tenantId': f'tenant-{i}',
+                    'fromNumber': '+17869461491',
+                    'toNumber': f'+1555{n:07d}',
+                    'contentSid': 'HX123',
+                    'status': 'sent',
+                }
+                for n in range(100)
+            ],
+            'skipDuplicates': True,
+        },
+    )
+
+
+SCENARIOS = {'find_unique': find_unique, 'find_many_include': find_many_include, 'create_many': create_many}
+
+
+def run(make, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        _builder.QueryBuilder(
+            prisma_models=PRISMA_MODELS, relational_field_mappings=RELATIONAL_FIELD_MAPPINGS, **make(i)
+        ).build()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara el QueryBuilder con y sin caché de plantillas')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    args = parser.parse_args()
+
+    cache = _builder.query_cache
+    maxsize = cache.maxsize or _builder.QUERY_CACHE_SIZE
+    print(f"{'escenario':<20}{'sin caché (µs)':>16}{'con caché (µs)':>16}{'mejora':>9}")
+    for name in args.scenarios.split(','):
+        make = SCENARIOS[name]
+        iterations = max(1, args.iterations // 10) if name == 'create_many' else args.iterations
+        cache.maxsize = 0
+        uncached = run(make, iterations)
+        cache.maxsize = maxsize
+        cache.clear()
+        cached = run(make, iterations)
+        info = cache.info()
+        print(f'{name:<20}{uncached * 1e6:>16.1f}{cached * 1e6:>16.1f}{uncached / cached:>8.1f}x'
+              f'   aciertos {info.hit_rate:.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark de los backends JSON de models_prisma (models_prisma._serializer):
+serializa un create_many grande con el QueryBuilder y decodifica una respuesta
+de find_many como la que devuelve el motor de Prisma, con cada backend
+instalado (json, orjson, msgspec).
+
+Uso:
+    python3 bench/prisma_serialization.py --rows 1000 --iterations 200
+
+No necesita base de datos ni el motor de Prisma. La caché de plantillas del
+QueryBuilder se desactiva para medir la serialización completa.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models_prisma import _builder, _serializer  # noqa: E402
+from models_prisma.metadata import PRISMA_MODELS, RELATIONAL_FIELD_MAPPINGS  # noqa: E402
+from models_prisma.models import WhatsappMessage  # noqa: E402
+
+
+def create_many(rows):
+    created = datetime.datetime(2024, 1, 1, 12, 30, 15, 123456)
+    return dict(
+        method='create_many',
+        model=WhatsappMessage,
+        arguments={
+            'data': [
+                {
+                    'tenantId': 'tenant-1',
+                    'fromNumber': '+17869461491',
+                    'toNumber': f'+1555{n:07d}',
+                    'contentSid': 'HX123',
+                    'status': 'sent',
+                    'createdAt': created + datetime.timedelta(seconds=n),
+                }
+                for n in range(rows)
+            ],
+            'skipDuplicates': True,
+        },
+    )
+
+
+def find_many_response(rows):
+    return json.dumps({
+        'data': {
+            'result': [
+                {
+                    'id': f'message-{n}',
+                    'tenantId': 'tenant-1',
+                    'fromNumber': '+17869461491',
+                    'toNumber': f'+1555{n:07d}',
+                    'contentSid': 'HX123',
+                    'status': 'delivered',
+                    'createdAt': '2024-01-01T12:30:15.123+00:00',
+                    'updatedAt': '2024-01-01T12:31:02.456+00:00',
+                }
+                for n in range(rows)
+            ]
+        }
+    }, ensure_ascii=False).encode()
+
+
+def timed(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara los backends JSON del cliente Prisma')
+    parser.add_argument('--rows', type=int, default=1000, help='Filas del create_many y de la respuesta')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    query = create_many(args.rows)
+    response = find_many_response(args.rows)
+    _builder.query_cache.maxsize = 0
+    backends = [name for name in _serializer.BACKENDS if name == 'json' or getattr(_serializer, name) is not None]
+
+    results = {}
+    for name in backends:
+        _serializer.set_backend(name)
+        build = timed(lambda: _builder.QueryBuilder(
+            prisma_models=PRISMA_MODELS, relational_field_mappings=RELATIONAL_FIELD_MAPPINGS, **query
+        ).build(), args.iterations)
+        parse = timed(lambda: _serializer.loads(response), args.iterations)
+        results[name] = (build, parse)
+
+    base_build, base_parse = results['json']
+    print(f'{args.rows} filas, respuesta de {len(response) / 1024:.0f} KiB')
+    print(f"{'backend':<10}{'create_many (ms)':>18}{'mejora':>9}{'find_many (ms)':>16}{'mejora':>9}")
+    for name, (build, parse) in results.items():
+        print(f'{name:<10}{build * 1e3:>18.2f}{base_build / build:>8.1f}x{parse * 1e3:>16.2f}{base_parse / parse:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
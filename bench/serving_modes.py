@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Compara el modo síncrono (gunicorn + Flask) con el asíncrono (uvicorn + asgi.py)
+enviando mensajes contra el servidor de Twilio simulado.
+
+Uso:
+    DIRECT_URL=postgresql://... python3 bench/serving_modes.py --requests 2000 --concurrency 200 --latency 0.2
+
+Necesita una base de datos creada con create_db.py (usa el tenant por defecto).
+Arranca un servidor por modo, lanza las mismas peticiones y muestra el
+rendimiento y los percentiles de latencia de cada uno.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_twilio import make_server  # noqa: E402
+from harness import free_port, percentile, server_command, wait_ready  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _drive(base_url, total, concurrency, enqueue):
+    latencies, statuses = [], {}
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker(session):
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = {'to_number': f'+1555{i % 1000:07d}', 'message_body': f'bench {i}', 'enqueue': enqueue}
+            started = time.perf_counter()
+            try:
+                async with session.post(f'{base_url}/api/api/whatsapp/send', json=payload) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError:
+                status = 'error'
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'requests': total,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'statuses': {str(k): v for k, v in sorted(statuses.items(), key=str)},
+    }
+
+
+def run_mode(mode, args, twilio_url):
+    port = free_port()
+    env = dict(os.environ, TWILIO_API_BASE_URL=twilio_url, RATELIMIT_ENABLED='false')
+    env.setdefault('SEND_RATE_PER_NUMBER', '0')
+    process = subprocess.Popen(
+        server_command(mode, port, args.workers, args.threads), cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE if args.quiet else None,
+    )
+    try:
+        wait_ready(('127.0.0.1', port), process)
+        base_url = f'http://127.0.0.1:{port}'
+        # Calentamiento: conexiones a Postgres, clientes de Twilio y caché de tenants.
+        asyncio.run(_drive(base_url, min(args.concurrency, args.requests), args.concurrency, args.enqueue))
+        return asyncio.run(_drive(base_url, args.requests, args.concurrency, args.enqueue))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.1, help='Latencia media del Twilio simulado, en segundos')
+    parser.add_argument('--workers', type=int, default=2, help='Procesos por servidor')
+    parser.add_argument('--threads', type=int, default=8, help='Hilos por worker de gunicorn (modo síncrono)')
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--enqueue', action='store_true', help='Encolar en vez de enviar en la petición')
+    parser.add_argument('--output', help='Guarda los resultados en este archivo JSON')
+    parser.add_argument('--quiet', action='store_true', help='Oculta la salida de los servidores')
+    args = parser.parse_args()
+
+    if not os.getenv('DIRECT_URL'):
+        parser.error('DIRECT_URL no está definida')
+
+    twilio = make_server(latency=args.latency)
+    threading.Thread(target=twilio.serve_forever, daemon=True).start()
+    twilio_url = f'http://127.0.0.1:{twilio.server_port}'
+
+    results = {'config': vars(args), 'modes': {}}
+    for mode in args.modes.split(','):
+        results['modes'][mode] = run_mode(mode, args, twilio_url)
+        r = results['modes'][mode]
+        print(f"{mode:>5}: {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']} ms  "
+              f"p95 {r['p95_ms']} ms  p99 {r['p99_ms']} ms  {r['statuses']}")
+    twilio.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
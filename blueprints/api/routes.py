@@ -1,14 +1,32 @@
 # blueprints/api/routes.py
 
-from flask import Blueprint, request
+from flask import Blueprint, request, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from twilio.rest import Client
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
 from twilio.base.exceptions import TwilioRestException
-from flask_restx import Api, Resource, fields, Namespace
+from flask_restx import Api, Resource, fields, Namespace, marshal as restx_marshal
+from flask_restx.representations import output_json
+import itertools
 import re
 import uuid
 import psycopg2
-from db import query_db, get_db_connection
+from datetime import datetime
+from db import query_db, db_connection
+import auth_tokens
+import broadcast
+import conversations
+import instrumentation
+import message_history
+import message_search
+import rate_limits
+import send_queue
+import tenant_export
+import tenant_provisioning
+from message_store import record_message
+import tenant_cache
+import twilio_clients
+from pagination import InvalidCursor, decode_cursor, decode_ranked_cursor
 
 api_bp = Blueprint('api_bp', __name__)
 
@@ -25,10 +43,29 @@ api = Api(api_bp,
 whatsapp_ns = Namespace('whatsapp', description='Operaciones de WhatsApp')
 tenants_ns = Namespace('tenants', description='Gestión de inquilinos')
 messages_ns = Namespace('messages', description='Historial de mensajes')
+conversations_ns = Namespace('conversations', description='Conversaciones con el último mensaje')
+export_ns = Namespace('export', description='Exportación completa de los datos del tenant')
 
 api.add_namespace(whatsapp_ns)
 api.add_namespace(tenants_ns)
 api.add_namespace(messages_ns)
+api.add_namespace(conversations_ns)
+api.add_namespace(export_ns)
+
+@api.representation('application/json')
+def timed_output_json(data, code, headers=None):
+    with instrumentation.span('serialize'):
+        return output_json(data, code, headers)
+
+@api.errorhandler(JWTExtendedException)
+@api.errorhandler(PyJWTError)
+def jwt_error(error):
+    """Hands JWT errors back to Flask, whose JWT loaders answer 401/422 instead of a restx 500."""
+    raise error
+
+def marshal(data, model):
+    with instrumentation.span('marshal'):
+        return restx_marshal(data, model)
 
 def is_valid_uuid(uuid_string):
     try:
@@ -37,17 +74,122 @@ def is_valid_uuid(uuid_string):
     except ValueError:
         return False
 
+def lookup_tenant(tenant_id):
+    """
+    Returns (tenant, None) for the given tenant id, or the first tenant when
+    it is missing; (None, (error, status)) otherwise.
+    """
+    if tenant_id and is_valid_uuid(tenant_id):
+        tenant = tenant_cache.get_by_id(tenant_id)
+        if not tenant:
+            return None, ({"error": "Tenant no encontrado"}, 404)
+    else:
+        tenant = tenant_cache.get_default()
+        if not tenant:
+            return None, ({"error": "No hay tenants configurados. Por favor, cree uno primero."}, 400)
+    return tenant, None
+
+def resolve_tenant():
+    """lookup_tenant for the X-Tenant-ID header of the current request."""
+    tenant, error = lookup_tenant(request.headers.get('X-Tenant-ID'))
+    instrumentation.tag_tenant(tenant)
+    return tenant, error
+
+def missing_twilio_credentials(tenant):
+    return not tenant['twilio_account_sid'] or not tenant['twilio_auth_token'] or not tenant['twilio_whatsapp_number']
+
+def throttled_response(error):
+    """429 for a send over the number's rate; clients can retry or use 'enqueue'."""
+    return (
+        {"error": "El número de WhatsApp alcanzó su límite de envío. Reintenta o usa 'enqueue'."},
+        429,
+        {'Retry-After': str(max(1, round(error.retry_after)))}
+    )
+
+def parse_send_request(data):
+    """
+    Validates a send request body. Returns ((to_number, message_body), None),
+    with to_number carrying the 'whatsapp:' prefix, or (None, (error, status)).
+    """
+    data = data or {}
+    to_number = data.get('to_number')
+    message_body = data.get('message_body')
+
+    if not to_number or not message_body:
+        return None, ({"error": "Faltan los campos 'to_number' o 'message_body'"}, 400)
+
+    if not re.match(r'^\+?[1-9]\d{1,14}$', to_number):
+        return None, ({"error": "Formato de número de teléfono inválido. Debe estar en formato E.164."}, 400)
+
+    if not to_number.startswith('whatsapp:'):
+        to_number = 'whatsapp:' + to_number
+    return (to_number, message_body), None
+
+def parse_history_args(args):
+    """
+    Validates the message history query string. Returns ((filters, limit), None)
+    or (None, (error, status)); filters are keyword arguments for message_history.
+    """
+    columns = message_history.COLUMNS
+    if args.get('fields'):
+        columns = tuple(dict.fromkeys(f.strip() for f in args['fields'].split(',') if f.strip()))
+        unknown = [c for c in columns if c not in message_history.COLUMNS]
+        if unknown or not columns:
+            return None, ({"error": f"Campos desconocidos: {', '.join(unknown)}"}, 400)
+
+    filters = {'columns': columns}
+    try:
+        for name in ('since', 'until'):
+            if args.get(name):
+                filters[name] = datetime.fromisoformat(args[name])
+    except ValueError:
+        return None, ({"error": "Las fechas 'since' y 'until' deben estar en formato ISO 8601"}, 400)
+
+    conversation_id = args.get('conversation_id')
+    if conversation_id:
+        if not is_valid_uuid(conversation_id):
+            return None, ({"error": "ID de conversación inválido"}, 400)
+        filters['conversation_id'] = conversation_id
+
+    sender_type = args.get('sender_type')
+    if sender_type:
+        if sender_type not in ('user', 'bot'):
+            return None, ({"error": "sender_type debe ser 'user' o 'bot'"}, 400)
+        filters['sender_type'] = sender_type
+
+    if args.get('cursor'):
+        try:
+            decode_cursor(args['cursor'])
+        except InvalidCursor:
+            return None, ({"error": "Cursor inválido"}, 400)
+        filters['cursor'] = args['cursor']
+
+    try:
+        limit = int(args.get('limit', message_history.DEFAULT_LIMIT))
+    except ValueError:
+        return None, ({"error": "El parámetro 'limit' debe ser un número entero"}, 400)
+    limit = max(1, min(limit, message_history.MAX_LIMIT))
+
+    return (filters, limit), None
+
+def history_model(columns):
+    return {column: message_model[column] for column in columns}
+
 # Swagger Models
 whatsapp_message_model = api.model('WhatsAppMessage', {
     'to_number': fields.String(required=True, description='Número de teléfono destino en formato E.164', example='+50763116918'),
-    'message_body': fields.String(required=True, description='Contenido del mensaje', example='Hola, este es un mensaje de prueba')
+    'message_body': fields.String(required=True, description='Contenido del mensaje', example='Hola, este es un mensaje de prueba'),
+    'enqueue': fields.Boolean(required=False, description='Encola el envío y responde 202 sin esperar a Twilio', example=False)
 })
 
 tenant_model = api.model('Tenant', {
     'name': fields.String(required=True, description='Nombre del inquilino', example='Mi Empresa'),
     'twilio_account_sid': fields.String(required=True, description='Account SID de Twilio', example='ACxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'),
     'twilio_auth_token': fields.String(required=True, description='Token de autenticación de Twilio'),
-    'twilio_whatsapp_number': fields.String(required=True, description='Número de WhatsApp de Twilio', example='whatsapp:+17869461491')
+    'twilio_whatsapp_number': fields.String(required=True, description='Número de WhatsApp de Twilio', example='whatsapp:+17869461491'),
+    'tier': fields.String(required=False, description='Plan del inquilino; etiqueta sus métricas (por defecto standard)', example='standard'),
+    'requests_per_minute': fields.Integer(required=False, description='Cuota de peticiones a la API por minuto, mayor que 0 (vacío: valor por defecto)'),
+    'messages_per_second': fields.Float(required=False, description='Envíos por segundo del número de WhatsApp, mayor que 0 (vacío: 80)')
 })
 
 tenant_response_model = api.model('TenantResponse', {
@@ -57,6 +199,9 @@ tenant_response_model = api.model('TenantResponse', {
     'twilio_auth_token': fields.String(description='Token de autenticación de Twilio'),
     'twilio_whatsapp_number': fields.String(description='Número de WhatsApp de Twilio'),
     'api_key': fields.String(description='Clave API (igual al ID del inquilino)'),
+    'tier': fields.String(description='Plan del inquilino'),
+    'requests_per_minute': fields.Integer(description='Cuota de peticiones a la API por minuto'),
+    'messages_per_second': fields.Float(description='Envíos por segundo del número de WhatsApp'),
     'created_at': fields.DateTime(description='Fecha de creación'),
     'updated_at': fields.DateTime(description='Fecha de última actualización')
 })
@@ -68,11 +213,66 @@ tenant_create_response_model = api.model('TenantCreateResponse', {
     'api_key': fields.String(description='Clave API generada')
 })
 
+tenant_bulk_request_model = api.model('TenantBulkRequest', {
+    'tenants': fields.List(fields.Raw, required=True, description='Tenants con los campos de POST /tenants; opcionales: username, password, retention_days', example=[{'name': 'Cliente 1', 'twilio_account_sid': 'ACxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx', 'twilio_auth_token': 'token', 'twilio_whatsapp_number': 'whatsapp:+17865550101', 'username': 'cliente1', 'password': 'secreto'}])
+})
+
+tenant_bulk_result_model = api.model('TenantBulkResult', {
+    'index': fields.Integer(description='Posición de la fila en la entrada (desde 0)'),
+    'status': fields.String(description='Resultado (created/conflict/invalid/failed)'),
+    'tenant_id': fields.String(description='ID del inquilino creado'),
+    'api_key': fields.String(description='Clave API generada'),
+    'error': fields.String(description='Motivo si no se creó')
+})
+
+tenant_bulk_response_model = api.model('TenantBulkResponse', {
+    'total': fields.Integer(description='Filas recibidas'),
+    'created': fields.Integer(description='Tenants creados'),
+    'conflict': fields.Integer(description='Filas con número o usuario ya existente'),
+    'invalid': fields.Integer(description='Filas con datos inválidos'),
+    'failed': fields.Integer(description='Filas no creadas por un error de base de datos'),
+    'results': fields.List(fields.Nested(tenant_bulk_result_model), description='Resultado de cada fila, en orden')
+})
+
 message_response_model = api.model('MessageResponse', {
     'success': fields.Boolean(description='Indica si el mensaje fue enviado exitosamente'),
     'message_sid': fields.String(description='SID del mensaje de Twilio')
 })
 
+message_queued_model = api.model('MessageQueued', {
+    'success': fields.Boolean(description='Indica si el mensaje fue encolado'),
+    'message_id': fields.String(description='ID del mensaje encolado'),
+    'status': fields.String(description='Estado del envío', example='queued')
+})
+
+send_status_model = api.model('SendStatus', {
+    'id': fields.String(description='ID del mensaje'),
+    'status': fields.String(description='Estado del mensaje (queued/sent/failed)'),
+    'message_sid': fields.String(description='SID del mensaje de Twilio, cuando ya fue enviado'),
+    'job_status': fields.String(description='Estado del trabajo en cola (pending/processing/done/failed)'),
+    'attempts': fields.Integer(description='Intentos de envío realizados'),
+    'last_error': fields.String(description='Último error de envío'),
+    'next_attempt_at': fields.DateTime(description='Fecha del próximo intento')
+})
+
+broadcast_request_model = api.model('BroadcastRequest', {
+    'message_body': fields.String(required=True, description='Plantilla del mensaje; admite campos del destinatario como {nombre}', example='Hola {nombre}, tu pedido está listo'),
+    'recipients': fields.List(fields.Raw, required=True, description='Números E.164 u objetos con to_number y campos de la plantilla', example=[{'to_number': '+50763116918', 'nombre': 'Ana'}])
+})
+
+broadcast_status_model = api.model('BroadcastStatus', {
+    'id': fields.String(description='ID del envío masivo'),
+    'status': fields.String(description='Estado (loading/sending/done)'),
+    'total': fields.Integer(description='Destinatarios válidos encolados'),
+    'rejected': fields.Integer(description='Destinatarios descartados por formato inválido'),
+    'pending': fields.Integer(description='Mensajes pendientes de envío'),
+    'processing': fields.Integer(description='Mensajes enviándose'),
+    'sent': fields.Integer(description='Mensajes enviados'),
+    'failed': fields.Integer(description='Mensajes fallidos'),
+    'created_at': fields.DateTime(description='Fecha de creación'),
+    'updated_at': fields.DateTime(description='Fecha de actualización')
+})
+
 message_model = api.model('Message', {
     'id': fields.String(description='ID del mensaje'),
     'conversation_id': fields.String(description='ID de la conversación'),
@@ -82,7 +282,33 @@ message_model = api.model('Message', {
     'body': fields.String(description='Contenido del mensaje'),
     'to_number': fields.String(description='Número de teléfono destino'),
     'media_url': fields.String(description='URL de medios adjuntos'),
+    'status': fields.String(description='Estado del mensaje (queued/sent/failed)'),
+    'timestamp': fields.DateTime(description='Fecha y hora del mensaje'),
+    'created_at': fields.DateTime(description='Fecha de creación'),
+    'updated_at': fields.DateTime(description='Fecha de actualización')
+})
+
+search_result_model = api.model('MessageSearchResult', {
+    'id': fields.String(description='ID del mensaje'),
+    'conversation_id': fields.String(description='ID de la conversación'),
+    'whatsapp_user_id': fields.String(description='Número de WhatsApp del usuario'),
+    'sender_type': fields.String(description='Tipo de remitente (user/bot)'),
+    'body': fields.String(description='Contenido del mensaje'),
+    'headline': fields.String(description='Fragmento del mensaje con los términos buscados resaltados'),
+    'status': fields.String(description='Estado del mensaje'),
     'timestamp': fields.DateTime(description='Fecha y hora del mensaje'),
+    'rank': fields.Float(description='Relevancia (0 si solo se busca por número)')
+})
+
+conversation_model = api.model('Conversation', {
+    'id': fields.String(description='ID de la conversación'),
+    'tenant_id': fields.String(description='ID del inquilino'),
+    'whatsapp_user_id': fields.String(description='Número de WhatsApp del usuario'),
+    'status': fields.String(description='Estado de la conversación'),
+    'last_message_at': fields.DateTime(description='Fecha del último mensaje'),
+    'last_message_body': fields.String(description='Extracto del último mensaje'),
+    'last_message_sender': fields.String(description='Remitente del último mensaje (user/bot)'),
+    'unread_count': fields.Integer(description='Mensajes del usuario sin leer'),
     'created_at': fields.DateTime(description='Fecha de creación'),
     'updated_at': fields.DateTime(description='Fecha de actualización')
 })
@@ -98,121 +324,186 @@ success_model = api.model('Success', {
 
 @whatsapp_ns.route('/send')
 class SendWhatsAppMessage(Resource):
+    # X-Tenant-ID (or the default tenant) is this route's credential; rate_limits charges it
+    tenant_header_auth = True
+
     @whatsapp_ns.doc('send_whatsapp_message')
     @whatsapp_ns.expect(whatsapp_message_model)
-    @whatsapp_ns.marshal_with(message_response_model, code=200)
-    @whatsapp_ns.marshal_with(error_model, code=400)
-    @whatsapp_ns.marshal_with(error_model, code=404)
-    @whatsapp_ns.marshal_with(error_model, code=500)
-    @whatsapp_ns.response(200, 'Mensaje enviado exitosamente')
-    @whatsapp_ns.response(400, 'Datos inválidos o tenant no encontrado')
-    @whatsapp_ns.response(404, 'Tenant no encontrado')
-    @whatsapp_ns.response(500, 'Error interno del servidor')
+    @whatsapp_ns.response(200, 'Mensaje enviado exitosamente', message_response_model)
+    @whatsapp_ns.response(202, 'Mensaje encolado para envío', message_queued_model)
+    @whatsapp_ns.response(400, 'Datos inválidos o tenant no encontrado', error_model)
+    @whatsapp_ns.response(404, 'Tenant no encontrado', error_model)
+    @whatsapp_ns.response(429, 'Límite de peticiones del tenant o de envío del número alcanzado', error_model)
+    @whatsapp_ns.response(500, 'Error interno del servidor', error_model)
     @whatsapp_ns.header('X-Tenant-ID', 'ID del tenant (opcional, usa el primero si no se proporciona)', required=False)
     def post(self):
         """
         Envía un mensaje de WhatsApp usando las credenciales del tenant.
         
         Utiliza el header X-Tenant-ID para especificar el tenant, o usa el primero disponible.
+        Con 'enqueue' el mensaje se guarda como pendiente y lo envía el worker de send_queue.py.
         """
-        tenant_id_from_header = request.headers.get('X-Tenant-ID')
-        current_tenant_id = None
+        tenant, error = resolve_tenant()
+        if error:
+            return error
+        current_tenant_id = tenant['id']
 
-        if tenant_id_from_header and is_valid_uuid(tenant_id_from_header):
-            current_tenant_id = tenant_id_from_header
-        else:
-            first_tenant = query_db('SELECT id FROM tenants LIMIT 1', one=True)
-            if first_tenant:
-                current_tenant_id = first_tenant['id']
-            else:
-                return {"error": "No hay tenants configurados. Por favor, cree uno primero."}, 400
-
-        tenant = query_db('SELECT * FROM tenants WHERE id = %s', [current_tenant_id], one=True)
-        if not tenant:
-            return {"error": "Tenant no encontrado"}, 404
-
-        data = request.get_json()
-        to_number = data.get('to_number')
-        message_body = data.get('message_body')
-
-        if not to_number or not message_body:
-            return {"error": "Faltan los campos 'to_number' o 'message_body'"}, 400
-
-        if not re.match(r'^\+?[1-9]\d{1,14}$', to_number):
-            return {"error": "Formato de número de teléfono inválido. Debe estar en formato E.164."}, 400
+        data = request.get_json() or {}
+        parsed, error = parse_send_request(data)
+        if error:
+            return error
+        to_number, message_body = parsed
 
         try:
             account_sid = tenant['twilio_account_sid']
             auth_token = tenant['twilio_auth_token']
             twilio_whatsapp_number = tenant['twilio_whatsapp_number']
 
-            if not account_sid or not auth_token or not twilio_whatsapp_number:
+            if missing_twilio_credentials(tenant):
                 return {"error": "Credenciales de Twilio no configuradas para este tenant."}, 500
 
-            client = Client(account_sid, auth_token)
-            
-            if not to_number.startswith('whatsapp:'):
-                to_number = 'whatsapp:' + to_number
+            whatsapp_user_id_clean = to_number.replace('whatsapp:', '')
+
+            if data.get('enqueue'):
+                with db_connection() as conn:
+                    cur = conn.cursor()
+                    message_id, _ = record_message(
+                        cur, current_tenant_id, whatsapp_user_id_clean, 'bot', message_body, to_number,
+                        status='queued', enqueue=True, max_attempts=send_queue.MAX_ATTEMPTS
+                    )
+                    conn.commit()
+                    cur.close()
 
-            message = client.messages.create(
-                from_=twilio_whatsapp_number,
-                to=to_number,
-                body=message_body
-            )
+                return {"success": True, "message_id": message_id, "status": "queued"}, 202
 
-            conn = get_db_connection()
-            cur = conn.cursor()
+            client = twilio_clients.get_client(current_tenant_id, account_sid, auth_token)
 
-            whatsapp_user_id_clean = to_number.replace('whatsapp:', '')
-            
-            cur.execute(
-                """
-                SELECT id FROM conversations
-                WHERE tenant_id = %s AND whatsapp_user_id = %s
-                """,
-                (current_tenant_id, whatsapp_user_id_clean)
+            message = twilio_clients.send_message(
+                client, twilio_whatsapp_number, to_number, message_body, send_rate=rate_limits.send_rate(tenant)
             )
-            conversation = cur.fetchone()
 
-            conversation_id = None
-            if conversation:
-                conversation_id = conversation[0]
-                cur.execute(
-                    """
-                    UPDATE conversations
-                    SET last_message_at = NOW(), updated_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (conversation_id,)
-                )
-            else:
-                conversation_id = str(uuid.uuid4())
-                cur.execute(
-                    """
-                    INSERT INTO conversations (id, tenant_id, whatsapp_user_id, last_message_at, status)
-                    VALUES (%s, %s, %s, NOW(), 'active')
-                    """,
-                    (conversation_id, current_tenant_id, whatsapp_user_id_clean)
+            with db_connection() as conn:
+                cur = conn.cursor()
+                record_message(
+                    cur, current_tenant_id, whatsapp_user_id_clean, 'bot', message_body, to_number,
+                    message_sid=message.sid
                 )
-            
-            cur.execute(
-                """
-                INSERT INTO messages (id, conversation_id, tenant_id, message_sid, sender_type, body, to_number, timestamp)
-                VALUES (%s, %s, %s, %s, 'bot', %s, %s, NOW())
-                """,
-                (str(uuid.uuid4()), conversation_id, current_tenant_id, message.sid, message_body, to_number)
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
+                conn.commit()
+                cur.close()
 
             return {"success": True, "message_sid": message.sid}, 200
 
+        except rate_limits.SendThrottled as e:
+            return throttled_response(e)
         except TwilioRestException as e:
             return {"error": f"Error de Twilio: {e.msg}"}, 500
         except Exception as e:
             return {"error": f"Error interno del servidor: {str(e)}"}, 500
 
+@whatsapp_ns.route('/send/<string:message_id>')
+class SendStatus(Resource):
+    # X-Tenant-ID (or the default tenant) is this route's credential; rate_limits charges it
+    tenant_header_auth = True
+
+    @whatsapp_ns.doc('get_send_status')
+    @whatsapp_ns.response(200, 'Estado del envío', send_status_model)
+    @whatsapp_ns.response(400, 'ID de mensaje inválido', error_model)
+    @whatsapp_ns.response(404, 'Mensaje o tenant no encontrado', error_model)
+    @whatsapp_ns.header('X-Tenant-ID', 'ID del tenant (opcional, usa el primero si no se proporciona)', required=False)
+    def get(self, message_id):
+        """
+        Obtiene el estado de un mensaje enviado o encolado por el tenant.
+        """
+        if not is_valid_uuid(message_id):
+            return {"error": "ID de mensaje inválido"}, 400
+
+        tenant, error = resolve_tenant()
+        if error:
+            return error
+
+        status = send_queue.get_status(message_id, tenant['id'])
+        if not status:
+            return {"error": "Mensaje no encontrado"}, 404
+
+        return marshal(status, send_status_model), 200
+
+@whatsapp_ns.route('/broadcast')
+class Broadcast(Resource):
+    # X-Tenant-ID (or the default tenant) is this route's credential; rate_limits charges it
+    tenant_header_auth = True
+
+    @whatsapp_ns.doc('create_broadcast', params={'message_body': 'Plantilla del mensaje (solo para cargas NDJSON/CSV)'})
+    @whatsapp_ns.expect(broadcast_request_model)
+    @whatsapp_ns.response(202, 'Envío masivo encolado', broadcast_status_model)
+    @whatsapp_ns.response(400, 'Datos inválidos o tenant no encontrado', error_model)
+    @whatsapp_ns.response(404, 'Tenant no encontrado', error_model)
+    @whatsapp_ns.response(500, 'Error interno del servidor', error_model)
+    @whatsapp_ns.header('X-Tenant-ID', 'ID del tenant (opcional, usa el primero si no se proporciona)', required=False)
+    def post(self):
+        """
+        Envía la misma plantilla a una lista de destinatarios.
+
+        Acepta JSON con 'recipients', o una carga en streaming con Content-Type
+        application/x-ndjson o text/csv (columna to_number) y la plantilla en ?message_body=.
+        Responde 202 con el ID del envío; el progreso se consulta en /broadcast/<id>.
+        """
+        tenant, error = resolve_tenant()
+        if error:
+            return error
+
+        if request.mimetype == 'application/x-ndjson':
+            message_body = request.args.get('message_body')
+            recipients = broadcast.recipients_from_ndjson(request.stream)
+        elif request.mimetype == 'text/csv':
+            message_body = request.args.get('message_body')
+            recipients = broadcast.recipients_from_csv(request.stream)
+        else:
+            data = request.get_json() or {}
+            message_body = data.get('message_body')
+            recipients = broadcast.recipients_from_json(data.get('recipients') or [])
+
+        if not message_body:
+            return {"error": "Falta el campo 'message_body'"}, 400
+
+        if missing_twilio_credentials(tenant):
+            return {"error": "Credenciales de Twilio no configuradas para este tenant."}, 500
+
+        try:
+            result = broadcast.create_broadcast(tenant['id'], message_body, recipients)
+        except Exception as e:
+            return {"error": f"Error interno del servidor: {str(e)}"}, 500
+
+        broadcast.start_dispatch(result['broadcast_id'])
+        progress = broadcast.get_progress(result['broadcast_id'], tenant['id'])
+        return marshal(progress, broadcast_status_model), 202
+
+@whatsapp_ns.route('/broadcast/<string:broadcast_id>')
+class BroadcastDetail(Resource):
+    # X-Tenant-ID (or the default tenant) is this route's credential; rate_limits charges it
+    tenant_header_auth = True
+
+    @whatsapp_ns.doc('get_broadcast')
+    @whatsapp_ns.response(200, 'Progreso del envío masivo', broadcast_status_model)
+    @whatsapp_ns.response(400, 'ID de envío inválido', error_model)
+    @whatsapp_ns.response(404, 'Envío o tenant no encontrado', error_model)
+    @whatsapp_ns.header('X-Tenant-ID', 'ID del tenant (opcional, usa el primero si no se proporciona)', required=False)
+    def get(self, broadcast_id):
+        """
+        Obtiene los contadores de progreso de un envío masivo del tenant.
+        """
+        if not is_valid_uuid(broadcast_id):
+            return {"error": "ID de envío inválido"}, 400
+
+        tenant, error = resolve_tenant()
+        if error:
+            return error
+
+        progress = broadcast.get_progress(broadcast_id, tenant['id'])
+        if not progress:
+            return {"error": "Envío no encontrado"}, 404
+
+        return marshal(progress, broadcast_status_model), 200
+
 @tenants_ns.route('/')
 class TenantList(Resource):
     @tenants_ns.doc('create_tenant')
@@ -236,39 +527,44 @@ class TenantList(Resource):
         twilio_account_sid = data.get('twilio_account_sid')
         twilio_auth_token = data.get('twilio_auth_token')
         twilio_whatsapp_number = data.get('twilio_whatsapp_number')
+        tier = data.get('tier') or instrumentation.DEFAULT_TIER
+        try:
+            requests_per_minute = tenant_provisioning.positive_number(
+                data.get('requests_per_minute'), int, 'requests_per_minute')
+            messages_per_second = tenant_provisioning.positive_number(
+                data.get('messages_per_second'), float, 'messages_per_second')
+        except ValueError as e:
+            return {"error": str(e)}, 400
 
         if not all([name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number]):
             return {"error": "Faltan campos obligatorios: name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number"}, 400
 
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            tenant_id = str(uuid.uuid4())
-            api_key = tenant_id
-            
-            cur.execute(
-                """
-                INSERT INTO tenants (id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """,
-                (tenant_id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key)
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
+            with db_connection() as conn:
+                cur = conn.cursor()
+                tenant_id = str(uuid.uuid4())
+                api_key = tenant_id
+
+                cur.execute(
+                    """
+                    INSERT INTO tenants (id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key, tier,
+                                         requests_per_minute, messages_per_second)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (tenant_id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key, tier,
+                     requests_per_minute, messages_per_second)
+                )
+                tenant_cache.notify_invalidation(cur, tenant_id)
+                conn.commit()
+                cur.close()
+
+            tenant_cache.invalidate(tenant_id)
             return {"success": True, "message": "Tenant creado exitosamente", "tenant_id": tenant_id, "api_key": api_key}, 201
         except psycopg2.IntegrityError as e:
-            if conn:
-                conn.rollback()
-                conn.close()
             if "duplicate key value violates unique constraint" in str(e):
                 return {"error": "El número de WhatsApp o API key ya existe."}, 409
             return {"error": f"Error de base de datos: {str(e)}"}, 500
         except Exception as e:
-            if conn:
-                conn.rollback()
-                conn.close()
             return {"error": f"Error interno del servidor: {str(e)}"}, 500
 
     @tenants_ns.doc('get_tenants')
@@ -278,9 +574,50 @@ class TenantList(Resource):
         """
         Obtiene la lista de todos los inquilinos registrados.
         """
-        tenants = query_db('SELECT id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key, created_at, updated_at FROM tenants ORDER BY created_at DESC')
+        tenants = query_db('SELECT id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key, tier, requests_per_minute, messages_per_second, created_at, updated_at FROM tenants ORDER BY created_at DESC')
         return tenants
 
+@tenants_ns.route('/bulk')
+class TenantBulk(Resource):
+    @tenants_ns.doc('create_tenants_bulk')
+    @tenants_ns.expect(tenant_bulk_request_model)
+    @tenants_ns.response(200, 'Resultado de cada fila', tenant_bulk_response_model)
+    @tenants_ns.response(400, 'Datos inválidos', error_model)
+    @tenants_ns.response(413, 'Demasiadas filas', error_model)
+    @tenants_ns.response(500, 'Error interno del servidor', error_model)
+    @jwt_required()
+    def post(self):
+        """
+        Crea muchos inquilinos en una sola petición (requiere JWT).
+
+        Acepta JSON con 'tenants', o una carga en streaming con Content-Type
+        application/x-ndjson o text/csv (una fila por tenant). Las filas se validan
+        y se insertan por bloques, cada uno en su propia transacción; la respuesta
+        indica, para cada fila, si se creó (con su ID y API key), si el número o el
+        usuario ya existía, o por qué es inválida. Admite como mucho
+        PROVISION_MAX_ROWS filas; si hay más, no se crea ninguna.
+        """
+        if request.mimetype == 'application/x-ndjson':
+            rows = tenant_provisioning.rows_from_ndjson(request.stream)
+        elif request.mimetype == 'text/csv':
+            rows = tenant_provisioning.rows_from_csv(request.stream)
+        else:
+            data = request.get_json(silent=True) or {}
+            if not isinstance(data.get('tenants'), list):
+                return {"error": "Falta la lista 'tenants'"}, 400
+            rows = tenant_provisioning.rows_from_json(data['tenants'])
+
+        # Reads one row past the limit, so an oversized upload is rejected before anything is created.
+        rows = list(itertools.islice(rows, tenant_provisioning.MAX_ROWS + 1))
+        if len(rows) > tenant_provisioning.MAX_ROWS:
+            return {"error": f"Demasiadas filas; el máximo por petición es {tenant_provisioning.MAX_ROWS}"}, 413
+
+        try:
+            summary = tenant_provisioning.provision(rows)
+        except Exception as e:
+            return {"error": f"Error interno del servidor: {str(e)}"}, 500
+        return marshal(summary, tenant_bulk_response_model), 200
+
 @tenants_ns.route('/<string:tenant_id>')
 class TenantDetail(Resource):
     @tenants_ns.doc('get_tenant')
@@ -297,7 +634,7 @@ class TenantDetail(Resource):
         if not is_valid_uuid(tenant_id):
             return {"error": "ID de tenant inválido"}, 400
         
-        tenant = query_db('SELECT id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key, created_at, updated_at FROM tenants WHERE id = %s', [tenant_id], one=True)
+        tenant = query_db('SELECT id, name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, api_key, tier, requests_per_minute, messages_per_second, created_at, updated_at FROM tenants WHERE id = %s', [tenant_id], one=True)
         if not tenant:
             return {"error": "Tenant no encontrado"}, 404
         
@@ -329,56 +666,76 @@ class TenantDetail(Resource):
         twilio_account_sid = data.get('twilio_account_sid')
         twilio_auth_token = data.get('twilio_auth_token')
         twilio_whatsapp_number = data.get('twilio_whatsapp_number')
-
-        if not any([name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number]):
+        tier = data.get('tier')
+        try:
+            requests_per_minute = tenant_provisioning.positive_number(
+                data.get('requests_per_minute'), int, 'requests_per_minute')
+            messages_per_second = tenant_provisioning.positive_number(
+                data.get('messages_per_second'), float, 'messages_per_second')
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        if not any([name, twilio_account_sid, twilio_auth_token, twilio_whatsapp_number, tier,
+                    requests_per_minute, messages_per_second]):
             return {"error": "Debe proporcionar al menos un campo para actualizar"}, 400
 
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute('SELECT id FROM tenants WHERE id = %s', (tenant_id,))
-            if not cur.fetchone():
-                return {"error": "Tenant no encontrado"}, 404
-            
-            update_fields = []
-            update_values = []
-            
-            if name:
-                update_fields.append("name = %s")
-                update_values.append(name)
-            if twilio_account_sid:
-                update_fields.append("twilio_account_sid = %s")
-                update_values.append(twilio_account_sid)
-            if twilio_auth_token:
-                update_fields.append("twilio_auth_token = %s")
-                update_values.append(twilio_auth_token)
-            if twilio_whatsapp_number:
-                update_fields.append("twilio_whatsapp_number = %s")
-                update_values.append(twilio_whatsapp_number)
-            
-            update_fields.append("updated_at = NOW()")
-            update_values.append(tenant_id)
-            
-            query = f"UPDATE tenants SET {', '.join(update_fields)} WHERE id = %s"
-            cur.execute(query, update_values)
-            conn.commit()
-            cur.close()
-            conn.close()
-            
+            with db_connection() as conn:
+                cur = conn.cursor()
+
+                cur.execute('SELECT id FROM tenants WHERE id = %s', (tenant_id,))
+                if not cur.fetchone():
+                    return {"error": "Tenant no encontrado"}, 404
+
+                update_fields = []
+                update_values = []
+
+                if name:
+                    update_fields.append("name = %s")
+                    update_values.append(name)
+                if twilio_account_sid:
+                    update_fields.append("twilio_account_sid = %s")
+                    update_values.append(twilio_account_sid)
+                if twilio_auth_token:
+                    update_fields.append("twilio_auth_token = %s")
+                    update_values.append(twilio_auth_token)
+                if twilio_whatsapp_number:
+                    update_fields.append("twilio_whatsapp_number = %s")
+                    update_values.append(twilio_whatsapp_number)
+                if tier:
+                    update_fields.append("tier = %s")
+                    update_values.append(tier)
+                if requests_per_minute:
+                    update_fields.append("requests_per_minute = %s")
+                    update_values.append(requests_per_minute)
+                if messages_per_second:
+                    update_fields.append("messages_per_second = %s")
+                    update_values.append(messages_per_second)
+
+                update_fields.append("updated_at = NOW()")
+                update_values.append(tenant_id)
+
+                query = f"UPDATE tenants SET {', '.join(update_fields)} WHERE id = %s"
+                cur.execute(query, update_values)
+                tenant_cache.notify_invalidation(cur, tenant_id)
+                # Access tokens carry these fields; clients get fresh ones from /auth/refresh.
+                revocation = None
+                if any([twilio_whatsapp_number, tier, requests_per_minute, messages_per_second]):
+                    revocation = auth_tokens.revoke_tenant(cur, tenant_id)
+                conn.commit()
+                cur.close()
+
+            # Also drops the tenant's cached Twilio clients.
+            tenant_cache.invalidate(tenant_id)
+            if revocation:
+                auth_tokens.remember_tenant_revocation(tenant_id, revocation)
+
             return {"success": True, "message": "Tenant actualizado exitosamente"}, 200
         except psycopg2.IntegrityError as e:
-            if conn:
-                conn.rollback()
-                conn.close()
             if "duplicate key value violates unique constraint" in str(e):
                 return {"error": "El número de WhatsApp o API key ya existe."}, 409
             return {"error": f"Error de base de datos: {str(e)}"}, 500
         except Exception as e:
-            if conn:
-                conn.rollback()
-                conn.close()
             return {"error": f"Error interno del servidor: {str(e)}"}, 500
 
     @tenants_ns.doc('delete_tenant')
@@ -399,39 +756,220 @@ class TenantDetail(Resource):
         if not is_valid_uuid(tenant_id):
             return {"error": "ID de tenant inválido"}, 400
         
-        conn = None
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute('SELECT id FROM tenants WHERE id = %s', (tenant_id,))
-            if not cur.fetchone():
-                return {"error": "Tenant no encontrado"}, 404
-            
-            cur.execute('DELETE FROM tenants WHERE id = %s', (tenant_id,))
-            conn.commit()
-            cur.close()
-            conn.close()
-            
+            with db_connection() as conn:
+                cur = conn.cursor()
+
+                cur.execute('SELECT id FROM tenants WHERE id = %s', (tenant_id,))
+                if not cur.fetchone():
+                    return {"error": "Tenant no encontrado"}, 404
+
+                cur.execute('DELETE FROM tenants WHERE id = %s', (tenant_id,))
+                tenant_cache.notify_invalidation(cur, tenant_id)
+                revocation = auth_tokens.revoke_tenant(cur, tenant_id)
+                conn.commit()
+                cur.close()
+
+            tenant_cache.invalidate(tenant_id)
+            auth_tokens.remember_tenant_revocation(tenant_id, revocation)
+
             return {"success": True, "message": "Tenant eliminado exitosamente"}, 200
         except Exception as e:
-            if conn:
-                conn.rollback()
-                conn.close()
             return {"error": f"Error interno del servidor: {str(e)}"}, 500
 
+@messages_ns.route('/search')
+class MessageSearch(Resource):
+    @messages_ns.doc('search_messages', params={
+        'q': 'Texto a buscar en los mensajes (admite "frases entre comillas", or y -exclusión)',
+        'number': f'Parte del número de WhatsApp del contacto (mínimo {message_search.MIN_NUMBER_DIGITS} dígitos)',
+        'limit': f'Resultados por página (por defecto {message_search.DEFAULT_LIMIT}, máximo {message_search.MAX_LIMIT})',
+        'cursor': 'Cursor opaco devuelto en la cabecera X-Next-Cursor de la página anterior',
+    })
+    @messages_ns.response(200, 'Resultados de la búsqueda', [search_result_model])
+    @messages_ns.response(400, 'Parámetros inválidos', error_model)
+    @jwt_required()
+    def get(self):
+        """
+        Busca mensajes del tenant autenticado por texto y/o número parcial del contacto.
+
+        Los resultados se ordenan por relevancia y después por fecha. Si hay más
+        páginas, la cabecera X-Next-Cursor trae el cursor de la siguiente.
+        """
+        current_tenant_id = get_jwt_identity()
+
+        text = (request.args.get('q') or '').strip()
+        number = request.args.get('number')
+        if not text and not number:
+            return {"error": "Indica 'q' o 'number'"}, 400
+        if number and not message_search.number_pattern(number):
+            return {"error": f"El parámetro 'number' debe tener al menos {message_search.MIN_NUMBER_DIGITS} dígitos"}, 400
+
+        try:
+            limit = int(request.args.get('limit', message_search.DEFAULT_LIMIT))
+        except ValueError:
+            return {"error": "El parámetro 'limit' debe ser un número entero"}, 400
+        limit = max(1, min(limit, message_search.MAX_LIMIT))
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                decode_ranked_cursor(cursor)
+            except InvalidCursor:
+                return {"error": "Cursor inválido"}, 400
+
+        rows, next_cursor = message_search.search(
+            current_tenant_id, text=text or None, number=number, limit=limit, cursor=cursor
+        )
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return marshal(rows, search_result_model), 200, headers
+
+@conversations_ns.route('/')
+class ConversationList(Resource):
+    @conversations_ns.doc('get_conversations', params={
+        'limit': f'Conversaciones por página (por defecto {conversations.DEFAULT_LIMIT}, máximo {conversations.MAX_LIMIT})',
+        'cursor': 'Cursor opaco devuelto en la cabecera X-Next-Cursor de la página anterior',
+        'status': 'Filtra por estado de la conversación',
+        'unread': "'true' para devolver solo conversaciones con mensajes sin leer",
+    })
+    @conversations_ns.response(200, 'Conversaciones obtenidas exitosamente', [conversation_model])
+    @conversations_ns.response(400, 'Parámetros inválidos', error_model)
+    @jwt_required()
+    def get(self):
+        """
+        Lista las conversaciones del tenant autenticado, de la más reciente a la más antigua.
+
+        Cada conversación incluye el extracto y remitente del último mensaje y los mensajes sin leer.
+        Si hay más páginas, la cabecera X-Next-Cursor trae el cursor de la siguiente.
+        """
+        current_tenant_id = get_jwt_identity()
+
+        try:
+            limit = int(request.args.get('limit', conversations.DEFAULT_LIMIT))
+        except ValueError:
+            return {"error": "El parámetro 'limit' debe ser un número entero"}, 400
+        limit = max(1, min(limit, conversations.MAX_LIMIT))
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except InvalidCursor:
+                return {"error": "Cursor inválido"}, 400
+
+        rows, next_cursor = conversations.fetch_page(
+            current_tenant_id, limit=limit, cursor=cursor,
+            status=request.args.get('status'), unread_only=request.args.get('unread') == 'true'
+        )
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return marshal(rows, conversation_model), 200, headers
+
+@conversations_ns.route('/<string:conversation_id>/read')
+class ConversationRead(Resource):
+    @conversations_ns.doc('mark_conversation_read')
+    @conversations_ns.response(200, 'Conversación marcada como leída', success_model)
+    @conversations_ns.response(400, 'ID de conversación inválido', error_model)
+    @conversations_ns.response(404, 'Conversación no encontrada', error_model)
+    @jwt_required()
+    def post(self, conversation_id):
+        """
+        Marca como leídos todos los mensajes de una conversación.
+        """
+        if not is_valid_uuid(conversation_id):
+            return {"error": "ID de conversación inválido"}, 400
+
+        if not conversations.mark_read(get_jwt_identity(), conversation_id):
+            return {"error": "Conversación no encontrada"}, 404
+
+        return {"success": True, "message": "Conversación marcada como leída"}, 200
+
 @messages_ns.route('/')
 class MessageList(Resource):
-    @messages_ns.doc('get_messages')
-    @messages_ns.marshal_list_with(message_model)
-    @messages_ns.response(200, 'Historial de mensajes obtenido exitosamente')
+    @messages_ns.doc('get_messages', params={
+        'limit': f'Mensajes por página (por defecto {message_history.DEFAULT_LIMIT}, máximo {message_history.MAX_LIMIT})',
+        'cursor': 'Cursor opaco devuelto en la cabecera X-Next-Cursor de la página anterior',
+        'fields': 'Columnas a devolver, separadas por comas (por defecto todas)',
+        'since': 'Solo mensajes desde esta fecha (ISO 8601, inclusive)',
+        'until': 'Solo mensajes hasta esta fecha (ISO 8601, exclusiva)',
+        'conversation_id': 'Filtra por conversación',
+        'sender_type': 'Filtra por remitente (user/bot)',
+        'format': "'ndjson' para recibir todo el historial filtrado en streaming, una línea JSON por mensaje",
+    })
+    @messages_ns.response(200, 'Historial de mensajes obtenido exitosamente', [message_model])
+    @messages_ns.response(400, 'Parámetros inválidos', error_model)
     @jwt_required()
     def get(self):
         """
         Obtiene el historial de mensajes para el tenant autenticado.
         
-        Requiere autenticación JWT.
+        Requiere autenticación JWT. Los resultados se paginan por (timestamp, id);
+        si hay más páginas, la cabecera X-Next-Cursor trae el cursor de la siguiente.
         """
         current_tenant_id = get_jwt_identity()
-        messages = query_db('SELECT * FROM messages WHERE tenant_id = %s ORDER BY timestamp DESC', [current_tenant_id])
-        return messages
\ No newline at end of file
+
+        parsed, error = parse_history_args(request.args)
+        if error:
+            return error
+        filters, limit = parsed
+
+        if request.args.get('format') == 'ndjson':
+            return Response(message_history.stream_ndjson(current_tenant_id, **filters), mimetype='application/x-ndjson')
+
+        messages, next_cursor = message_history.fetch_page(current_tenant_id, limit=limit, **filters)
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return marshal(messages, history_model(filters['columns'])), 200, headers
+
+@export_ns.route('/<string:resource>')
+class TenantExport(Resource):
+    @export_ns.doc('export_tenant_data', params={
+        'resource': "'messages' o 'conversations'",
+        'format': "'ndjson' (por defecto) o 'csv'",
+        'since': 'Desde esta fecha (ISO 8601, inclusive)',
+        'until': 'Hasta esta fecha (ISO 8601, exclusiva)',
+        'after': 'Reanuda después del último registro recibido: su timestamp (created_at en conversaciones)',
+        'after_id': 'ID del último registro recibido (junto con after)',
+    })
+    @export_ns.response(200, 'Exportación comprimida con gzip, enviada en streaming')
+    @export_ns.response(400, 'Parámetros inválidos', error_model)
+    @export_ns.response(503, 'Demasiadas exportaciones en curso', error_model)
+    @jwt_required()
+    def get(self, resource):
+        """
+        Exporta todos los mensajes o conversaciones del tenant autenticado.
+
+        La respuesta es NDJSON o CSV comprimido con gzip, ordenado por fecha e ID y
+        enviado por bloques sin cargar la exportación en memoria. Si la descarga se
+        corta, se reanuda con 'after' y 'after_id' del último registro recibido.
+        """
+        current_tenant_id = get_jwt_identity()
+
+        if resource not in tenant_export.RESOURCES:
+            return {"error": "Recurso desconocido; usa 'messages' o 'conversations'"}, 400
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in tenant_export.FORMATS:
+            return {"error": "Formato desconocido; usa 'ndjson' o 'csv'"}, 400
+
+        bounds = {}
+        try:
+            for name in ('since', 'until', 'after'):
+                if request.args.get(name):
+                    bounds[name] = datetime.fromisoformat(request.args[name])
+        except ValueError:
+            return {"error": "Las fechas 'since', 'until' y 'after' deben estar en formato ISO 8601"}, 400
+        after_id = request.args.get('after_id')
+        if after_id:
+            if not bounds.get('after') or not is_valid_uuid(after_id):
+                return {"error": "'after_id' debe ser un ID válido y acompañar a 'after'"}, 400
+            bounds['after_id'] = after_id
+
+        if not tenant_export.acquire_slot():
+            return {"error": "Demasiadas exportaciones en curso. Intenta de nuevo más tarde."}, 503
+
+        filename = f'{resource}-{current_tenant_id}.{fmt}.gz'
+        response = Response(
+            tenant_export.stream(current_tenant_id, resource, fmt, **bounds),
+            mimetype='application/gzip',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+        # Runs when the server closes the response, even if the download never started.
+        response.call_on_close(tenant_export.release_slot)
+        return response
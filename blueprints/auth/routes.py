@@ -1,16 +1,22 @@
 # blueprints/auth/routes.py
 
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, get_jwt, jwt_required
 from werkzeug.security import check_password_hash
 from db import query_db
+import auth_tokens
+import metrics
 
 auth_bp = Blueprint('auth_bp', __name__)
 
+def issue_access_token(tenant):
+    metrics.inc('auth_tokens_issued_total', type='access')
+    return create_access_token(identity=str(tenant['id']), additional_claims=auth_tokens.tenant_claims(tenant))
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
     """
-    Autentica a un tenant y devuelve un token JWT.
+    Autentica a un tenant y devuelve un token de acceso y uno de refresco.
     """
     data = request.get_json()
     username = data.get('username', None)
@@ -25,5 +31,43 @@ def login():
         return jsonify({"error": "Nombre de usuario o contraseña incorrectos"}), 401
 
     # El 'identity' del token será el UUID del tenant
-    access_token = create_access_token(identity=str(tenant['id']))
-    return jsonify(access_token=access_token)
+    access_token = issue_access_token(tenant)
+    metrics.inc('auth_tokens_issued_total', type='refresh')
+    refresh_token = create_refresh_token(identity=str(tenant['id']))
+    return jsonify(access_token=access_token, refresh_token=refresh_token)
+
+@auth_bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    """
+    Devuelve un token de acceso nuevo, con los datos actuales del tenant,
+    a partir del token de refresco (sin volver a enviar la contraseña).
+    Lee el tenant de la base de datos y no de tenant_cache, que puede tener
+    todavía la fila anterior a un cambio.
+    """
+    tenant = query_db('SELECT * FROM tenants WHERE id = %s', [get_jwt()['sub']], one=True)
+    if not tenant:
+        return jsonify({"error": "Tenant no encontrado"}), 401
+    return jsonify(access_token=issue_access_token(tenant))
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+def logout():
+    """
+    Revoca el token enviado y, si se incluye en el cuerpo, también el
+    'refresh_token', que debe ser del mismo tenant.
+    """
+    claims = get_jwt()
+    refresh_token = (request.get_json(silent=True) or {}).get('refresh_token')
+    refresh_claims = None
+    if refresh_token:
+        try:
+            refresh_claims = decode_token(refresh_token)
+        except Exception as e:
+            return jsonify({"error": "Token de refresco inválido", "details": str(e)}), 422
+        if refresh_claims.get('sub') != claims['sub']:
+            return jsonify({"error": "El token de refresco pertenece a otro tenant"}), 403
+    auth_tokens.revoke_token(claims)
+    if refresh_claims:
+        auth_tokens.revoke_token(refresh_claims)
+    return jsonify({"success": True})
@@ -1,32 +1,25 @@
 # blueprints/frontend/routes.py
 
 from flask import Blueprint, render_template
-from models import Tenant, Conversation, Message
-from sqlalchemy import func
-from datetime import datetime, timedelta
+import conversations as conversation_store
+import stats as dashboard_stats
 
 frontend_bp = Blueprint('frontend_bp', __name__)
 
 @frontend_bp.route('/')
 @frontend_bp.route('/dashboard')
 def dashboard():
-    total_tenants = Tenant.query.count()
-    active_conversations = Conversation.query.filter_by(status='active').count()
-    
-    today = datetime.utcnow().date()
-    messages_today = Message.query.filter(func.date(Message.timestamp) == today).count()
-    total_messages = Message.query.count()
-
-    recent_conversations = Conversation.query.order_by(Conversation.last_message_at.desc()).limit(5).all()
-
-    stats = {
-        'total_tenants': total_tenants,
-        'active_conversations': active_conversations,
-        'messages_today': messages_today,
-        'total_messages': total_messages
-    }
+    stats = dashboard_stats.get_overview()
+
+    recent_conversations = conversation_store.recent(5)
+
     return render_template('dashboard.html', stats=stats, recent_conversations=recent_conversations)
 
+@frontend_bp.route('/stats')
+def stats_page():
+    return render_template('stats.html', tenant_stats=dashboard_stats.get_tenant_stats(),
+                           stats=dashboard_stats.get_overview())
+
 @frontend_bp.route('/conversations')
 def conversations():
     return render_template('conversations.html')
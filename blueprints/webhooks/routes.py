@@ -0,0 +1,73 @@
+# blueprints/webhooks/routes.py
+
+import os
+from flask import Blueprint, request, Response
+from twilio.request_validator import RequestValidator
+from twilio.twiml.messaging_response import MessagingResponse
+import inbound
+import status_updates
+import tenant_cache
+
+webhooks_bp = Blueprint('webhooks_bp', __name__)
+
+# Public URL Twilio posts to, when the app sits behind a proxy that rewrites it.
+WEBHOOK_BASE_URL = os.getenv('TWILIO_WEBHOOK_BASE_URL')
+VALIDATE_SIGNATURE = os.getenv('TWILIO_WEBHOOK_VALIDATE', '1') == '1'
+
+EMPTY_TWIML = str(MessagingResponse())
+
+def twiml(body=EMPTY_TWIML, status=200):
+    return Response(body, status=status, mimetype='application/xml')
+
+def unknown_tenant_twiml():
+    resp = MessagingResponse()
+    resp.message("Lo sentimos, no pudimos identificar a qué servicio pertenece su mensaje. Por favor, revise el número.")
+    return str(resp)
+
+def signature_is_valid(tenant, url, full_path, form, signature):
+    """Checks X-Twilio-Signature against the URL Twilio called (see TWILIO_WEBHOOK_BASE_URL)."""
+    if not VALIDATE_SIGNATURE:
+        return True
+    if WEBHOOK_BASE_URL:
+        url = WEBHOOK_BASE_URL.rstrip('/') + full_path
+    return RequestValidator(tenant['twilio_auth_token']).validate(url, form, signature)
+
+def valid_signature(tenant):
+    return signature_is_valid(tenant, request.url, request.full_path.rstrip('?'), request.form,
+                              request.headers.get('X-Twilio-Signature', ''))
+
+@webhooks_bp.route('/twilio', methods=['POST'])
+def twilio_webhook():
+    """
+    Recibe los mensajes entrantes de WhatsApp desde Twilio.
+
+    Solo valida la firma y guarda el payload en inbound_events; la conversación,
+    el mensaje y la respuesta del bot los procesa inbound.InboundConsumer.
+    """
+    tenant = tenant_cache.get_by_whatsapp_number(request.form.get('To', ''))
+    if not tenant:
+        return twiml(unknown_tenant_twiml())
+
+    if not valid_signature(tenant):
+        return twiml(status=403)
+
+    inbound.stage(tenant['id'], request.form.to_dict())
+    return twiml()
+
+@webhooks_bp.route('/twilio/status', methods=['POST'])
+def twilio_status_callback():
+    """
+    Recibe los cambios de estado (sent, delivered, read, failed...) de los mensajes salientes.
+
+    Los estados se acumulan en memoria y se aplican en lote; un estado nunca
+    retrocede (un "sent" tardío no sobrescribe "read").
+    """
+    tenant = tenant_cache.get_by_whatsapp_number(request.form.get('From', ''))
+    if not tenant:
+        return twiml(status=404)
+
+    if not valid_signature(tenant):
+        return twiml(status=403)
+
+    status_updates.coalescer.add(request.form.get('MessageSid'), request.form.get('MessageStatus'))
+    return twiml()
@@ -0,0 +1,260 @@
+# broadcast.py
+
+"""
+Bulk sends of one message template to many recipients.
+
+Recipients are persisted in chunks with multi-row statements (one
+conversation upsert, one message insert and one job insert per chunk) and
+then dispatched through the ``send_jobs`` queue. Dispatch is bounded per
+process, however many broadcasts are running: at most
+``BROADCAST_MAX_DISPATCHES`` broadcasts dispatch at a time (later ones wait
+their turn) and their sends share one pool of ``BROADCAST_CONCURRENCY``
+threads. Jobs left behind by a crashed process are picked up by the regular
+send_queue workers.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+import metrics
+import send_queue
+from db import db_connection
+from message_store import CONVERSATION_SNAPSHOT_UPDATE, SNAPSHOT_LENGTH
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 1000))
+CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 8))
+MAX_DISPATCHES = int(os.getenv('BROADCAST_MAX_DISPATCHES', 2))
+
+E164_RE = re.compile(r'^\+?[1-9]\d{1,14}$')
+
+metrics.describe('broadcast_recipients_total', 'Broadcast recipients by outcome at load time')
+
+
+class _Placeholders(dict):
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+def render(template, fields):
+    """Fills ``{campo}`` placeholders from the recipient's fields; unknown ones are left as-is."""
+    try:
+        return template.format_map(_Placeholders(fields))
+    except (ValueError, IndexError, AttributeError):
+        return template
+
+
+def recipients_from_json(items):
+    for item in items:
+        yield item if isinstance(item, dict) else {'to_number': item}
+
+
+def recipients_from_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        yield item if isinstance(item, dict) else {'to_number': item}
+
+
+def recipients_from_csv(stream):
+    yield from csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+
+
+def _persist_chunk(cur, tenant_id, broadcast_id, chunk):
+    conversations = execute_values(
+        cur,
+        """
+        INSERT INTO conversations (tenant_id, whatsapp_user_id, last_message_at, status,
+                                   last_message_body, last_message_sender, unread_count)
+        VALUES %s
+        ON CONFLICT (tenant_id, whatsapp_user_id) DO UPDATE SET""" + CONVERSATION_SNAPSHOT_UPDATE + """
+        RETURNING whatsapp_user_id, id
+        """,
+        [(tenant_id, user_id, body[:SNAPSHOT_LENGTH]) for user_id, body in chunk],
+        template="(%s, %s, NOW(), 'active', %s, 'bot', 0)",
+        page_size=len(chunk),
+        fetch=True
+    )
+    conversation_ids = dict(conversations)
+
+    message_ids = [str(uuid.uuid4()) for _ in chunk]
+    execute_values(
+        cur,
+        """
+        INSERT INTO messages (id, conversation_id, tenant_id, sender_type, body, to_number, status, timestamp)
+        VALUES %s
+        """,
+        [
+            (message_id, conversation_ids[user_id], tenant_id, body, 'whatsapp:' + user_id)
+            for message_id, (user_id, body) in zip(message_ids, chunk)
+        ],
+        template="(%s, %s, %s, 'bot', %s, %s, 'queued', NOW())",
+        page_size=len(chunk)
+    )
+    execute_values(
+        cur,
+        "INSERT INTO send_jobs (message_id, tenant_id, broadcast_id, max_attempts) VALUES %s",
+        [(message_id, tenant_id, broadcast_id, send_queue.MAX_ATTEMPTS) for message_id in message_ids],
+        page_size=len(chunk)
+    )
+
+
+def create_broadcast(tenant_id, body_template, recipients, chunk_size=CHUNK_SIZE):
+    """
+    Persists a broadcast and one queued message per distinct valid recipient.
+
+    Each chunk is committed on its own so memory stays bounded and sending
+    can start while a large upload is still being read.
+    """
+    broadcast_id = str(uuid.uuid4())
+    total = rejected = 0
+    seen = set()
+    chunk = []
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO broadcasts (id, tenant_id, body_template) VALUES (%s, %s, %s)",
+            (broadcast_id, tenant_id, body_template)
+        )
+        conn.commit()
+
+        for recipient in recipients:
+            number = str((recipient or {}).get('to_number') or '').strip().replace('whatsapp:', '')
+            if not E164_RE.match(number):
+                rejected += 1
+                continue
+            if number in seen:
+                continue
+            seen.add(number)
+            chunk.append((number, render(body_template, recipient)))
+
+            if len(chunk) >= chunk_size:
+                _persist_chunk(cur, tenant_id, broadcast_id, chunk)
+                conn.commit()
+                total += len(chunk)
+                chunk = []
+
+        if chunk:
+            _persist_chunk(cur, tenant_id, broadcast_id, chunk)
+            total += len(chunk)
+
+        cur.execute(
+            "UPDATE broadcasts SET total = %s, rejected = %s, status = 'sending' WHERE id = %s",
+            (total, rejected, broadcast_id)
+        )
+        conn.commit()
+        cur.close()
+
+    metrics.inc('broadcast_recipients_total', total, outcome='queued')
+    metrics.inc('broadcast_recipients_total', rejected, outcome='rejected')
+    return {'broadcast_id': broadcast_id, 'total': total, 'rejected': rejected}
+
+
+def _has_remaining(broadcast_id):
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM send_jobs
+                    WHERE broadcast_id = %s AND status IN ('pending', 'processing')
+                )
+                """,
+                (broadcast_id,)
+            )
+            remaining = cur.fetchone()[0]
+        conn.commit()
+    return remaining
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(name, workers):
+    """A process-wide executor, created on first use (and again in a forked child)."""
+    with _executors_lock:
+        pid, executor = _executors.get(name, (None, None))
+        if pid != os.getpid():
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+            _executors[name] = (os.getpid(), executor)
+        return executor
+
+
+def dispatch(broadcast_id, concurrency=CONCURRENCY):
+    """
+    Sends every job of the broadcast with at most ``concurrency`` of its
+    Twilio calls in flight, on the shared sender threads.
+    """
+    senders = _executor('broadcast-send', CONCURRENCY)
+    in_flight = set()
+    while True:
+        jobs = []
+        if len(in_flight) < concurrency:
+            with db_connection() as conn:
+                jobs = send_queue.claim_broadcast_jobs(conn, broadcast_id, concurrency - len(in_flight))
+            for job in jobs:
+                in_flight.add(senders.submit(send_queue.process_job, job))
+
+        if in_flight:
+            _, in_flight = wait(in_flight, timeout=send_queue.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        elif not jobs:
+            if not _has_remaining(broadcast_id):
+                break
+            # Only jobs waiting out a retry backoff (or owned by another worker) are left.
+            time.sleep(send_queue.POLL_INTERVAL)
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE broadcasts SET status = 'done' WHERE id = %s", (broadcast_id,))
+        conn.commit()
+
+
+def start_dispatch(broadcast_id):
+    """Queues ``dispatch`` on the shared dispatcher threads; returns its future."""
+    def run():
+        try:
+            dispatch(broadcast_id)
+        except Exception:
+            logger.exception('Broadcast %s dispatch failed', broadcast_id)
+
+    return _executor('broadcast-dispatch', MAX_DISPATCHES).submit(run)
+
+
+def get_progress(broadcast_id, tenant_id):
+    """Returns one of the tenant's broadcasts with per-status job counters, or None if unknown."""
+    query = """
+        SELECT b.id, b.status, b.total, b.rejected, b.created_at, b.updated_at,
+               count(j.id) FILTER (WHERE j.status = 'pending') AS pending,
+               count(j.id) FILTER (WHERE j.status = 'processing') AS processing,
+               count(j.id) FILTER (WHERE j.status = 'done') AS sent,
+               count(j.id) FILTER (WHERE j.status = 'failed') AS failed
+        FROM broadcasts b LEFT JOIN send_jobs j ON j.broadcast_id = b.id
+        WHERE b.id = %s AND b.tenant_id = %s
+        GROUP BY b.id
+    """
+
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, (broadcast_id, tenant_id))
+            row = cur.fetchone()
+        conn.commit()
+    return row
@@ -0,0 +1,80 @@
+# conversations.py
+
+"""
+Conversation listing backed by the denormalized last-message snapshot.
+
+Pages are one indexed scan of ``conversations`` ordered by
+``(last_message_at, id)`` descending; ``messages`` is never touched.
+"""
+
+from psycopg2.extras import RealDictCursor
+
+from db import db_connection
+from pagination import decode_cursor, encode_cursor
+
+COLUMNS = (
+    'id', 'tenant_id', 'whatsapp_user_id', 'status', 'last_message_at',
+    'last_message_body', 'last_message_sender', 'unread_count', 'created_at', 'updated_at',
+)
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def fetch_page(tenant_id, limit=DEFAULT_LIMIT, cursor=None, status=None, unread_only=False):
+    """Returns ``(rows, next_cursor)``; ``next_cursor`` is None on the last page."""
+    query = f"SELECT {', '.join(COLUMNS)} FROM conversations WHERE tenant_id = %s"
+    args = [tenant_id]
+    if cursor:
+        query += ' AND (last_message_at, id) < (%s, %s)'
+        args.extend(decode_cursor(cursor))
+    if status:
+        query += ' AND status = %s'
+        args.append(status)
+    if unread_only:
+        query += ' AND unread_count > 0'
+    query += ' ORDER BY last_message_at DESC, id DESC LIMIT %s'
+    args.append(limit + 1)
+
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, args)
+            rows = cur.fetchall()
+        conn.commit()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['last_message_at'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def mark_read(tenant_id, conversation_id):
+    """Resets the unread counter; returns False if the conversation does not exist."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE conversations SET unread_count = 0 WHERE id = %s AND tenant_id = %s",
+                (conversation_id, tenant_id)
+            )
+            updated = cur.rowcount
+        conn.commit()
+    return updated > 0
+
+
+def recent(limit=5):
+    """Most recently active conversations across tenants, with the tenant name joined in."""
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT c.id, c.whatsapp_user_id, c.last_message_at, c.last_message_body,
+                       c.unread_count, t.name AS tenant_name
+                FROM conversations c JOIN tenants t ON t.id = c.tenant_id
+                ORDER BY c.last_message_at DESC
+                LIMIT %s
+                """,
+                (limit,)
+            )
+            rows = cur.fetchall()
+        conn.commit()
+    return rows
@@ -37,6 +37,13 @@ def create_database_tables():
         # Eliminar tablas existentes
         print("🔄 Eliminando tablas existentes...")
         cursor.execute("""
+            DROP TABLE IF EXISTS token_revocations CASCADE;
+            DROP TABLE IF EXISTS rate_buckets CASCADE;
+            DROP TABLE IF EXISTS inbound_events CASCADE;
+            DROP TABLE IF EXISTS tenant_daily_stats CASCADE;
+            DROP TABLE IF EXISTS tenant_stats CASCADE;
+            DROP TABLE IF EXISTS send_jobs CASCADE;
+            DROP TABLE IF EXISTS broadcasts CASCADE;
             DROP TABLE IF EXISTS messages CASCADE;
             DROP TABLE IF EXISTS conversations CASCADE;
             DROP TABLE IF EXISTS tenants CASCADE;
@@ -56,6 +63,10 @@ def create_database_tables():
             twilio_auth_token VARCHAR(255) NOT NULL,
             twilio_whatsapp_number VARCHAR(30) UNIQUE NOT NULL,
             api_key VARCHAR(255) UNIQUE,
+            tier VARCHAR(20) NOT NULL DEFAULT 'standard',  -- plan del tenant, etiqueta las métricas
+            requests_per_minute INTEGER,        -- cuota de la API; NULL usa RATE_LIMIT_PER_MINUTE
+            messages_per_second REAL,           -- ritmo de envío del número; NULL usa SEND_RATE_PER_NUMBER
+            retention_days INTEGER,             -- días que se guardan sus mensajes; NULL usa MESSAGE_RETENTION_DAYS
             created_at TIMESTAMP DEFAULT NOW(),
             updated_at TIMESTAMP DEFAULT NOW()
         );
@@ -67,32 +78,144 @@ def create_database_tables():
             whatsapp_user_id VARCHAR(50) NOT NULL,
             last_message_at TIMESTAMP DEFAULT NOW(),
             status VARCHAR(50) DEFAULT 'open',
+            last_message_body TEXT,             -- snapshot del último mensaje, mantenido por message_store
+            last_message_sender VARCHAR(10),
+            unread_count INTEGER NOT NULL DEFAULT 0,
             created_at TIMESTAMP DEFAULT NOW(),
             updated_at TIMESTAMP DEFAULT NOW(),
             UNIQUE(tenant_id, whatsapp_user_id)
         );
         
-        -- Tabla de mensajes
+        -- Tabla de mensajes, particionada por mes (ver partitions.py). Las claves únicas
+        -- incluyen la columna de partición: la unicidad de id y message_sid es por partición.
         CREATE TABLE IF NOT EXISTS messages (
-            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            id UUID NOT NULL DEFAULT gen_random_uuid(),
             conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
             tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
-            message_sid VARCHAR(50) UNIQUE NOT NULL,
+            message_sid VARCHAR(50),            -- NULL mientras el mensaje está en cola
             sender_type VARCHAR(10) NOT NULL CHECK (sender_type IN ('user', 'bot')),
             body TEXT,
             to_number VARCHAR(50) NOT NULL,     -- <–– nueva columna para el número destino (aumentado a 50)
             media_url VARCHAR(500),
-            timestamp TIMESTAMP DEFAULT NOW(),
+            status VARCHAR(20) NOT NULL DEFAULT 'sent',
+            timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW(),
+            -- Índice de búsqueda (message_search.py); Postgres lo calcula en cada INSERT/UPDATE del cuerpo
+            body_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('spanish', COALESCE(body, ''))) STORED,
+            PRIMARY KEY (id, timestamp),
+            UNIQUE (message_sid, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+
+        -- Crea las particiones mensuales desde p_from (por defecto el mes actual) hasta
+        -- p_months_ahead meses en el futuro; devuelve cuántas creó. No hay partición DEFAULT:
+        -- así el historial se lee partición a partición, de la más reciente hacia atrás, y se
+        -- detiene al llenar la página. Para importar mensajes antiguos, llamar con p_from.
+        CREATE OR REPLACE FUNCTION ensure_message_partitions(p_months_ahead INTEGER DEFAULT 3, p_from DATE DEFAULT NULL)
+        RETURNS INTEGER AS $$
+        DECLARE
+            month DATE := date_trunc('month', COALESCE(p_from, CURRENT_DATE))::date;
+            last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::date;
+            partition TEXT;
+            created INTEGER := 0;
+        BEGIN
+            WHILE month <= last_month LOOP
+                partition := 'messages_' || to_char(month, 'YYYY_MM');
+                IF to_regclass(partition) IS NULL THEN
+                    EXECUTE format('CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                                   partition, month, (month + INTERVAL '1 month')::date);
+                    created := created + 1;
+                END IF;
+                month := (month + INTERVAL '1 month')::date;
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        SELECT ensure_message_partitions(3, (CURRENT_DATE - INTERVAL '1 month')::date);
+
+        -- Envíos masivos (cada destinatario es un mensaje + un trabajo en send_jobs)
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+            body_template TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'loading' CHECK (status IN ('loading', 'sending', 'done')),
+            total INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
             created_at TIMESTAMP DEFAULT NOW(),
             updated_at TIMESTAMP DEFAULT NOW()
         );
         
+        -- Cola de envíos salientes (consumida con FOR UPDATE SKIP LOCKED)
+        CREATE TABLE IF NOT EXISTS send_jobs (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            message_id UUID NOT NULL,           -- messages.id; sin FK porque messages está particionada
+            tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+            broadcast_id UUID REFERENCES broadcasts(id) ON DELETE CASCADE,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processing', 'done', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+        
+        -- Webhooks entrantes pendientes de procesar (ver inbound.py)
+        CREATE TABLE IF NOT EXISTS inbound_events (
+            id BIGSERIAL PRIMARY KEY,
+            tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+            message_sid VARCHAR(50),
+            payload JSONB NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            received_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        
+        -- Estadísticas precalculadas del dashboard (mantenidas por triggers, ver stats.py)
+        CREATE TABLE IF NOT EXISTS tenant_stats (
+            tenant_id UUID PRIMARY KEY REFERENCES tenants(id) ON DELETE CASCADE,
+            total_messages BIGINT NOT NULL DEFAULT 0,
+            active_conversations INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+        
+        CREATE TABLE IF NOT EXISTS tenant_daily_stats (
+            tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            messages_in INTEGER NOT NULL DEFAULT 0,
+            messages_out INTEGER NOT NULL DEFAULT 0,
+            conversations_started INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, day)
+        );
+        
+        -- Cubetas de tokens de los límites (rate_limits.py); UNLOGGED porque se pueden perder
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_buckets (
+            key TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+        );
+        
+        -- Tokens JWT revocados (auth_tokens.py): por jti, o 'tenant:<id>' para los emitidos antes de revoked_at
+        CREATE TABLE IF NOT EXISTS token_revocations (
+            key TEXT PRIMARY KEY,
+            revoked_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        
         -- Índices para mejorar el rendimiento
         CREATE INDEX IF NOT EXISTS idx_conversations_tenant_id ON conversations(tenant_id);
         CREATE INDEX IF NOT EXISTS idx_conversations_last_message_at ON conversations(last_message_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_conversations_tenant_last_message ON conversations(tenant_id, last_message_at DESC, id DESC);
         CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
-        CREATE INDEX IF NOT EXISTS idx_messages_tenant_id ON messages(tenant_id);
         CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp DESC);
+        CREATE INDEX IF NOT EXISTS idx_messages_tenant_timestamp_id ON messages(tenant_id, timestamp DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_messages_body_tsv ON messages USING GIN (body_tsv);
+        CREATE INDEX IF NOT EXISTS idx_send_jobs_runnable ON send_jobs(run_at) WHERE status IN ('pending', 'processing');
+        CREATE INDEX IF NOT EXISTS idx_send_jobs_tenant_processing ON send_jobs(tenant_id) WHERE status = 'processing';
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_send_jobs_message_id ON send_jobs(message_id);
+        CREATE INDEX IF NOT EXISTS idx_send_jobs_broadcast_id ON send_jobs(broadcast_id, status) WHERE broadcast_id IS NOT NULL;
         
         -- Función para actualizar updated_at automáticamente
         CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -121,7 +244,183 @@ def create_database_tables():
             BEFORE UPDATE ON messages
             FOR EACH ROW
             EXECUTE FUNCTION update_updated_at_column();
+        
+        DROP TRIGGER IF EXISTS update_broadcasts_updated_at ON broadcasts;
+        CREATE TRIGGER update_broadcasts_updated_at
+            BEFORE UPDATE ON broadcasts
+            FOR EACH ROW
+            EXECUTE FUNCTION update_updated_at_column();
+        
+        DROP TRIGGER IF EXISTS update_send_jobs_updated_at ON send_jobs;
+        CREATE TRIGGER update_send_jobs_updated_at
+            BEFORE UPDATE ON send_jobs
+            FOR EACH ROW
+            EXECUTE FUNCTION update_updated_at_column();
+        
+        -- Cubeta de tokens: recarga la cubeta según el tiempo transcurrido y, si
+        -- alcanza, descuenta p_cost. Todo en una llamada, bajo el bloqueo de la fila.
+        CREATE OR REPLACE FUNCTION take_tokens(p_key TEXT, p_rate DOUBLE PRECISION, p_burst DOUBLE PRECISION,
+                                               p_cost DOUBLE PRECISION DEFAULT 1)
+        RETURNS TABLE (allowed BOOLEAN, tokens DOUBLE PRECISION, retry_after DOUBLE PRECISION) AS $$
+        DECLARE
+            available DOUBLE PRECISION;
+            last_update TIMESTAMPTZ;
+            now_ts TIMESTAMPTZ;
+        BEGIN
+            INSERT INTO rate_buckets AS b (key, tokens) VALUES (p_key, p_burst)
+            ON CONFLICT (key) DO NOTHING;
+            SELECT b.tokens, b.updated_at INTO available, last_update
+            FROM rate_buckets b WHERE b.key = p_key FOR UPDATE;
+            now_ts := clock_timestamp();
+            available := LEAST(p_burst, available + GREATEST(0, EXTRACT(EPOCH FROM now_ts - last_update)) * p_rate);
+            IF available >= p_cost THEN
+                UPDATE rate_buckets SET tokens = available - p_cost, updated_at = now_ts WHERE key = p_key;
+                RETURN QUERY SELECT TRUE, available - p_cost, 0::DOUBLE PRECISION;
+            ELSE
+                UPDATE rate_buckets SET tokens = available, updated_at = now_ts WHERE key = p_key;
+                RETURN QUERY SELECT FALSE, available, (p_cost - available) / GREATEST(p_rate, 1e-9);
+            END IF;
+        END;
+        $$ language 'plpgsql';
+        
+        -- Contadores del dashboard: triggers por sentencia, así un insert masivo
+        -- (envíos masivos) actualiza una fila por tenant y no una por mensaje.
+        CREATE OR REPLACE FUNCTION count_inserted_messages()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO tenant_daily_stats (tenant_id, day, messages_in, messages_out)
+            SELECT tenant_id, COALESCE(timestamp, NOW())::date,
+                   count(*) FILTER (WHERE sender_type = 'user'),
+                   count(*) FILTER (WHERE sender_type = 'bot')
+            FROM new_messages
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            ON CONFLICT (tenant_id, day) DO UPDATE SET
+                messages_in = tenant_daily_stats.messages_in + EXCLUDED.messages_in,
+                messages_out = tenant_daily_stats.messages_out + EXCLUDED.messages_out;
+        
+            INSERT INTO tenant_stats (tenant_id, total_messages)
+            SELECT tenant_id, count(*) FROM new_messages GROUP BY 1 ORDER BY 1
+            ON CONFLICT (tenant_id) DO UPDATE SET
+                total_messages = tenant_stats.total_messages + EXCLUDED.total_messages,
+                updated_at = NOW();
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        
+        -- Borrados (retención, conversaciones o tenants eliminados). Las particiones archivadas
+        -- se descuentan en partitions.py antes del DROP TABLE, que no dispara triggers.
+        CREATE OR REPLACE FUNCTION count_deleted_messages()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            UPDATE tenant_stats s
+            SET total_messages = s.total_messages - d.removed, updated_at = NOW()
+            FROM (SELECT tenant_id, count(*) AS removed FROM old_messages GROUP BY 1) d
+            WHERE s.tenant_id = d.tenant_id;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        
+        CREATE OR REPLACE FUNCTION count_inserted_conversations()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO tenant_daily_stats (tenant_id, day, conversations_started)
+            SELECT tenant_id, COALESCE(created_at, NOW())::date, count(*)
+            FROM new_conversations
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            ON CONFLICT (tenant_id, day) DO UPDATE SET
+                conversations_started = tenant_daily_stats.conversations_started + EXCLUDED.conversations_started;
+        
+            INSERT INTO tenant_stats (tenant_id, active_conversations)
+            SELECT tenant_id, count(*) FROM new_conversations WHERE status = 'active' GROUP BY 1 ORDER BY 1
+            ON CONFLICT (tenant_id) DO UPDATE SET
+                active_conversations = tenant_stats.active_conversations + EXCLUDED.active_conversations,
+                updated_at = NOW();
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        
+        CREATE OR REPLACE FUNCTION count_updated_conversations()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            -- Solo escribe cuando cambia el estado; los upserts de cada mensaje no tocan tenant_stats.
+            INSERT INTO tenant_stats (tenant_id, active_conversations)
+            SELECT n.tenant_id,
+                   count(*) FILTER (WHERE n.status = 'active') - count(*) FILTER (WHERE o.status = 'active')
+            FROM new_conversations n JOIN old_conversations o ON o.id = n.id
+            WHERE n.status IS DISTINCT FROM o.status
+            GROUP BY 1
+            ORDER BY 1
+            ON CONFLICT (tenant_id) DO UPDATE SET
+                active_conversations = tenant_stats.active_conversations + EXCLUDED.active_conversations,
+                updated_at = NOW();
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        
+        CREATE OR REPLACE FUNCTION count_deleted_conversations()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            UPDATE tenant_stats s
+            SET active_conversations = s.active_conversations - d.removed, updated_at = NOW()
+            FROM (
+                SELECT tenant_id, count(*) AS removed FROM old_conversations
+                WHERE status = 'active' GROUP BY 1
+            ) d
+            WHERE s.tenant_id = d.tenant_id;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql';
+        
+        DROP TRIGGER IF EXISTS count_messages_insert ON messages;
+        CREATE TRIGGER count_messages_insert
+            AFTER INSERT ON messages
+            REFERENCING NEW TABLE AS new_messages
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION count_inserted_messages();
+        
+        DROP TRIGGER IF EXISTS count_messages_delete ON messages;
+        CREATE TRIGGER count_messages_delete
+            AFTER DELETE ON messages
+            REFERENCING OLD TABLE AS old_messages
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION count_deleted_messages();
+        
+        DROP TRIGGER IF EXISTS count_conversations_insert ON conversations;
+        CREATE TRIGGER count_conversations_insert
+            AFTER INSERT ON conversations
+            REFERENCING NEW TABLE AS new_conversations
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION count_inserted_conversations();
+        
+        DROP TRIGGER IF EXISTS count_conversations_update ON conversations;
+        CREATE TRIGGER count_conversations_update
+            AFTER UPDATE ON conversations
+            REFERENCING OLD TABLE AS old_conversations NEW TABLE AS new_conversations
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION count_updated_conversations();
+        
+        DROP TRIGGER IF EXISTS count_conversations_delete ON conversations;
+        CREATE TRIGGER count_conversations_delete
+            AFTER DELETE ON conversations
+            REFERENCING OLD TABLE AS old_conversations
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION count_deleted_conversations();
         """)
+        conn.commit()
+
+        # Búsqueda por número parcial (ILIKE '%...%'); sin pg_trgm la búsqueda funciona, pero sin índice
+        try:
+            cursor.execute("""
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX IF NOT EXISTS idx_conversations_whatsapp_user_id_trgm
+                ON conversations USING GIN (whatsapp_user_id gin_trgm_ops);
+            """)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"⚠️  No se creó el índice de trigramas (pg_trgm no disponible): {e}")
         
         # Insertar inquilino de prueba si no existe
         initial_tenant_id = str(uuid.uuid4())
@@ -6,6 +6,7 @@ CREATE TABLE IF NOT EXISTS tenants (
   name TEXT NOT NULL,
   twilio_whatsapp_number VARCHAR(20) UNIQUE NOT NULL,
   api_key VARCHAR(255) UNIQUE NOT NULL,
+  retention_days INTEGER,  -- días que se guardan sus mensajes (partitions.py); NULL usa MESSAGE_RETENTION_DAYS
   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
   updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
@@ -22,27 +23,53 @@ CREATE TABLE IF NOT EXISTS conversations (
   updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
--- 3. Messages
+-- 3. Messages, particionada por mes (ver partitions.py); las claves únicas incluyen timestamp
 CREATE TABLE IF NOT EXISTS messages (
-  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  id UUID NOT NULL DEFAULT gen_random_uuid(),
   tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
   conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
-  message_sid TEXT UNIQUE NOT NULL,
+  message_sid TEXT NOT NULL,
   sender_type TEXT CHECK (sender_type IN ('user','bot')) NOT NULL,
   body TEXT,
   media_url TEXT,
   to_number TEXT,
   timestamp TIMESTAMPTZ NOT NULL DEFAULT now(),
   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
-);
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (id, timestamp),
+  UNIQUE (message_sid, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Particiones mensuales desde p_from (por defecto el mes actual) hasta p_months_ahead meses en el futuro
+CREATE OR REPLACE FUNCTION ensure_message_partitions(p_months_ahead INTEGER DEFAULT 3, p_from DATE DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    month DATE := date_trunc('month', COALESCE(p_from, CURRENT_DATE))::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::date;
+    partition TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        partition := 'messages_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(partition) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                           partition, month, (month + INTERVAL '1 month')::date);
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_message_partitions(3, (CURRENT_DATE - INTERVAL '1 month')::date);
 
 -- Índices para mejorar el rendimiento
 CREATE INDEX IF NOT EXISTS idx_conversations_tenant_id ON conversations(tenant_id);
 CREATE INDEX IF NOT EXISTS idx_conversations_last_message_at ON conversations(last_message_at DESC);
 CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
-CREATE INDEX IF NOT EXISTS idx_messages_tenant_id ON messages(tenant_id);
 CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_tenant_timestamp_id ON messages(tenant_id, timestamp DESC, id DESC);
 
 -- Función para actualizar updated_at automáticamente
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -1,23 +1,361 @@
 # db.py
 
+import logging
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
 from dotenv import load_dotenv
 
+import instrumentation
+import metrics
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+metrics.describe('db_pool_checkouts_total', 'Connections handed out by the pool')
+metrics.describe('db_pool_exhausted_total', 'Checkouts that found the pool at max size and had to wait')
+metrics.describe('db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection')
+metrics.describe('db_pool_wait_seconds', 'Time spent waiting for a pooled connection')
+metrics.describe('db_pool_connections', 'Open pooled connections by state')
+metrics.describe('db_round_trips_total', 'Statements, commits and rollbacks sent to the database')
+
+_round_trips = ContextVar('db_round_trips', default=0)
+
+
+def reset_round_trips():
+    """Starts a new round-trip count for the current request or task."""
+    _round_trips.set(0)
+
+
+def get_round_trips():
+    """Returns the round trips made since the last ``reset_round_trips``."""
+    return _round_trips.get()
+
+
+def count_round_trip():
+    """Records one round trip; also used by the async driver in async_db.py."""
+    _round_trips.set(_round_trips.get() + 1)
+    metrics.inc('db_round_trips_total')
+
+
+_counting_cursors = {}
+
+
+def _counting_cursor(factory):
+    """Returns a subclass of ``factory`` whose executes count as round trips."""
+    cls = _counting_cursors.get(factory)
+    if cls is None:
+        class CountingCursor(factory):
+            def execute(self, query, vars=None):
+                count_round_trip()
+                with instrumentation.span('db'):
+                    return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                count_round_trip()
+                with instrumentation.span('db'):
+                    return super().executemany(query, vars_list)
+
+            def copy_expert(self, sql, file, size=8192):
+                count_round_trip()
+                with instrumentation.span('db'):
+                    return super().copy_expert(sql, file, size)
+
+        cls = _counting_cursors[factory] = CountingCursor
+    return cls
+
+
+class InstrumentedConnection(extensions.connection):
+    """psycopg2 connection that counts every round trip, whatever cursor factory is used."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = _counting_cursor(factory)
+        return super().cursor(*args, **kwargs)
+
+    # Outside a transaction psycopg2 does not talk to the server at all.
+    def commit(self):
+        if self.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            count_round_trip()
+        with instrumentation.span('db'):
+            return super().commit()
+
+    def rollback(self):
+        if self.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            count_round_trip()
+        with instrumentation.span('db'):
+            return super().rollback()
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe, fork-aware pool of psycopg2 connections.
+
+    Connections are health-checked on checkout and recycled once they exceed
+    ``max_lifetime`` seconds. After a fork the child starts with an empty pool
+    and never touches the sockets inherited from the parent.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, max_lifetime=1800, timeout=10, ping_after=30):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._created = {}    # id(conn) -> created_at
+        self._in_use = 0
+        self._needs_fill = False
+
+    def _after_fork(self):
+        # Keep references to the parent's connections so they are never
+        # garbage-collected (and closed) from the child's side of the socket.
+        self._inherited = list(self._idle)
+        self._cond = threading.Condition()
+        self._reset()
+        # Runs inside fork(); the first getconn opens the minimum connections instead.
+        self._needs_fill = True
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=InstrumentedConnection)
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, created_at, last_used):
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if now - last_used > self.ping_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _update_gauges(self):
+        metrics.set_gauge('db_pool_connections', self._in_use, state='in_use')
+        metrics.set_gauge('db_pool_connections', len(self._idle), state='idle')
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting up to ``timeout`` seconds."""
+        if os.getpid() != self._pid:
+            self._after_fork()
+        if self._needs_fill:
+            self._needs_fill = False
+            self.fill()
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        exhausted = False
+        with self._cond:
+            while not self._idle and self._in_use + len(self._idle) >= self.maxconn:
+                if not exhausted:
+                    exhausted = True
+                    metrics.inc('db_pool_exhausted_total')
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.inc('db_pool_timeouts_total')
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                self._cond.wait(remaining)
+            # Reserve the slot; health checks and connects happen outside the lock.
+            entry = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            self._update_gauges()
+
+        try:
+            if entry is not None:
+                conn, created_at, last_used = entry
+                if not self._is_healthy(conn, created_at, last_used):
+                    self._discard(conn)
+                    conn = self._connect()
+            else:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._update_gauges()
+                self._cond.notify()
+            raise
+
+        metrics.inc('db_pool_checkouts_total')
+        metrics.observe('db_pool_wait_seconds', time.monotonic() - started)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        if os.getpid() != self._pid or id(conn) not in self._created:
+            return
+
+        # The rollback and close are round trips; only the bookkeeping holds the lock.
+        created_at = self._created.get(id(conn), 0)
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        keep = not (close or conn.closed or time.monotonic() - created_at > self.max_lifetime)
+        if not keep:
+            self._discard(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._update_gauges()
+            self._cond.notify()
+
+    def fill(self):
+        """
+        Opens connections until ``minconn`` are open. A failed connect is
+        logged and left to ``getconn``, so the pool still starts with the
+        database down.
+        """
+        while True:
+            with self._cond:
+                if len(self._idle) + self._in_use >= self.minconn:
+                    return
+                # Reserve the slot; the connect happens outside the lock.
+                self._in_use += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                logger.warning('Could not open the minimum pool connections: %s', e)
+                conn = None
+            with self._cond:
+                self._in_use -= 1
+                if conn is not None:
+                    self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+                self._update_gauges()
+                self._cond.notify()
+            if conn is None:
+                return
+
+    def closeall(self):
+        """Closes every idle connection."""
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+            self._update_gauges()
+
+    def stats(self):
+        with self._cond:
+            return {'in_use': self._in_use, 'idle': len(self._idle), 'max': self.maxconn}
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled connection whose ``close()`` returns it to the pool.
+
+    Lets legacy callers of ``get_db_connection`` keep their
+    ``conn.close()`` calls without leaking sockets.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.putconn(self._conn)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._conn.rollback()
+        self.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    os.getenv('DIRECT_URL'),
+                    minconn=int(os.getenv('DB_POOL_MIN', 1)),
+                    maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+                    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                    ping_after=float(os.getenv('DB_POOL_PING_AFTER', 30)),
+                )
+                pool.fill()
+                _pool = pool
+    return _pool
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: _pool is not None and _pool._after_fork())
+
+
+@contextmanager
+def db_connection():
+    """Borrows a connection from the pool; rolls back on error and always returns it."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
 def get_db_connection():
     """Establishes a database connection and returns the connection object."""
-    conn = psycopg2.connect(os.getenv('DIRECT_URL'))
-    return conn
+    pool = get_pool()
+    return PooledConnection(pool, pool.getconn())
+
 
 def query_db(query, args=(), one=False):
     """Queries the database and returns the results."""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute(query, args)
-    results = cur.fetchone() if one else cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, args)
+            results = cur.fetchone() if one else cur.fetchall()
+        conn.commit()
     return results
@@ -0,0 +1,336 @@
+# inbound.py
+
+"""
+Inbound WhatsApp messages: fast-ack staging plus a batch consumer.
+
+The webhook only validates the request and appends the raw Twilio payload
+to ``inbound_events`` with one insert. ``InboundConsumer`` threads claim
+staged events in batches (``FOR UPDATE SKIP LOCKED``, so several processes
+can consume), and per batch run one conversation upsert, one message insert
+that skips already stored ``MessageSid`` values, and one insert of the bot
+replies into the ``send_jobs`` queue. A batch that fails is retried event by
+event so one bad payload cannot block the rest.
+
+Events that fail ``INBOUND_MAX_ATTEMPTS`` times stay in the table as dead
+letters for ``INBOUND_DEAD_RETENTION_DAYS`` (0 keeps them) and are then
+purged by the first consumer thread. Their count is the
+``inbound_events_dead`` gauge.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+import metrics
+import send_queue
+from db import db_connection
+from message_store import CONVERSATION_SNAPSHOT_UPDATE, SNAPSHOT_LENGTH
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv('INBOUND_BATCH_SIZE', 500))
+POLL_INTERVAL = float(os.getenv('INBOUND_POLL_INTERVAL', 0.2))
+MAX_ATTEMPTS = int(os.getenv('INBOUND_MAX_ATTEMPTS', 5))
+DEAD_RETENTION_DAYS = int(os.getenv('INBOUND_DEAD_RETENTION_DAYS', 7))
+MAINTENANCE_INTERVAL = float(os.getenv('INBOUND_MAINTENANCE_INTERVAL', 300))
+
+metrics.describe('inbound_events_staged_total', 'Inbound webhook payloads written to the staging table')
+metrics.describe('inbound_events_total', 'Staged inbound events consumed by outcome')
+metrics.describe('inbound_batch_size', 'Events per consumed inbound batch')
+metrics.describe('inbound_events_dead', 'Staged inbound events that reached INBOUND_MAX_ATTEMPTS')
+
+
+STAGE_SQL = "INSERT INTO inbound_events (tenant_id, message_sid, payload) VALUES (%s, %s, %s)"
+
+
+def stage(tenant_id, payload):
+    """Appends one raw webhook payload to ``inbound_events``."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(STAGE_SQL, (tenant_id, payload.get('MessageSid') or None, Json(payload)))
+        conn.commit()
+    metrics.inc('inbound_events_staged_total')
+
+
+def bot_reply(tenant_name, body):
+    """Automatic reply to an inbound message, or None for no reply."""
+    text = (body or '').strip().lower()
+    if text == 'hola':
+        return f"¡Hola! Soy el bot de {tenant_name}. ¿En qué puedo ayudarte?"
+    if text == 'ayuda':
+        return "Puedes preguntar sobre nuestros servicios o productos."
+    # Aquí es donde podrías integrar con un modelo de IA, un sistema de tickets, etc.
+    return "Gracias por tu mensaje. Un agente te responderá pronto."
+
+
+def _user_id(number):
+    return (number or '').replace('whatsapp:', '').strip()
+
+
+def _ingest(cur, events):
+    """Persists a claimed batch; returns the number of new (non-duplicate) messages."""
+    sids = sorted({e['message_sid'] for e in events if e['message_sid']})
+    known = set()
+    if sids:
+        # messages is partitioned, so message_sid is only unique per partition: a
+        # transaction lock per MessageSid (taken in order, no deadlocks) makes a
+        # concurrent consumer wait and then see the stored copy.
+        cur.execute(
+            "SELECT pg_advisory_xact_lock(k) FROM (SELECT hashtextextended(sid, 0) AS k FROM unnest(%s::text[]) sid ORDER BY 1) s",
+            (sids,)
+        )
+        cur.execute("SELECT message_sid FROM messages WHERE message_sid = ANY(%s)", (sids,))
+        known = {row['message_sid'] for row in cur.fetchall()}
+
+    # Keep the first copy of every MessageSid (Twilio retries a webhook it considers failed).
+    fresh = []
+    for event in events:
+        sid = event['message_sid']
+        if sid and sid in known:
+            continue
+        if sid:
+            known.add(sid)
+        fresh.append(event)
+    if not fresh:
+        return 0
+
+    # One snapshot per conversation: unread counts every inbound message, the
+    # last message is the bot reply when there is one.
+    conversations = {}
+    for event in fresh:
+        payload = event['payload']
+        key = (str(event['tenant_id']), _user_id(payload.get('From')))
+        reply = bot_reply(event['tenant_name'], payload.get('Body'))
+        event['reply'] = reply
+        snapshot = conversations.setdefault(key, {'unread': 0})
+        snapshot['unread'] += 1
+        snapshot['body'], snapshot['sender'] = (reply, 'bot') if reply else (payload.get('Body') or '', 'user')
+
+    rows = execute_values(
+        cur,
+        """
+        INSERT INTO conversations (tenant_id, whatsapp_user_id, last_message_at, status,
+                                   last_message_body, last_message_sender, unread_count)
+        VALUES %s
+        ON CONFLICT (tenant_id, whatsapp_user_id) DO UPDATE SET""" + CONVERSATION_SNAPSHOT_UPDATE + """
+        RETURNING tenant_id, whatsapp_user_id, id
+        """,
+        [
+            (tenant_id, user_id, s['body'][:SNAPSHOT_LENGTH], s['sender'], s['unread'])
+            for (tenant_id, user_id), s in sorted(conversations.items())
+        ],
+        template="(%s, %s, NOW(), 'active', %s, %s, %s)",
+        page_size=len(conversations),
+        fetch=True
+    )
+    conversation_ids = {(str(row['tenant_id']), row['whatsapp_user_id']): row['id'] for row in rows}
+
+    messages = []
+    for event in fresh:
+        payload = event['payload']
+        media_url = payload.get('MediaUrl0') if int(payload.get('NumMedia') or 0) > 0 else None
+        key = (str(event['tenant_id']), _user_id(payload.get('From')))
+        messages.append((
+            str(uuid.uuid4()), conversation_ids[key], key[0], event['message_sid'], payload.get('Body'),
+            payload.get('To') or '', media_url, event['received_at']
+        ))
+    inserted = execute_values(
+        cur,
+        """
+        INSERT INTO messages (id, conversation_id, tenant_id, message_sid, sender_type, body, to_number, media_url, status, timestamp)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING message_sid
+        """,
+        messages,
+        template="(%s, %s, %s, %s, 'user', %s, %s, %s, 'received', %s)",
+        page_size=len(messages),
+        fetch=True
+    )
+    stored = {row['message_sid'] for row in inserted}
+
+    replies = []
+    for event, message in zip(fresh, messages):
+        if event['reply'] and (event['message_sid'] is None or event['message_sid'] in stored):
+            payload = event['payload']
+            replies.append((
+                str(uuid.uuid4()), message[1], message[2], event['reply'], 'whatsapp:' + _user_id(payload.get('From'))
+            ))
+    if replies:
+        execute_values(
+            cur,
+            """
+            INSERT INTO messages (id, conversation_id, tenant_id, sender_type, body, to_number, status, timestamp)
+            VALUES %s
+            """,
+            replies,
+            template="(%s, %s, %s, 'bot', %s, %s, 'queued', NOW())",
+            page_size=len(replies)
+        )
+        execute_values(
+            cur,
+            "INSERT INTO send_jobs (message_id, tenant_id, max_attempts) VALUES %s",
+            [(reply[0], reply[2], send_queue.MAX_ATTEMPTS) for reply in replies],
+            page_size=len(replies)
+        )
+    return len(inserted)
+
+
+_CLAIM_SQL = """
+    SELECT e.id, e.tenant_id, e.message_sid, e.payload, e.received_at, t.name AS tenant_name
+    FROM inbound_events e JOIN tenants t ON t.id = e.tenant_id
+    WHERE e.attempts < %s {condition}
+    ORDER BY e.id
+    LIMIT %s
+    FOR UPDATE OF e SKIP LOCKED
+"""
+
+
+def _consume(conn, condition='', args=(), limit=BATCH_SIZE):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(_CLAIM_SQL.format(condition=condition), (MAX_ATTEMPTS, *args, limit))
+        events = cur.fetchall()
+        if not events:
+            conn.commit()
+            return 0
+        created = _ingest(cur, events)
+        cur.execute("DELETE FROM inbound_events WHERE id = ANY(%s)", ([e['id'] for e in events],))
+    conn.commit()
+    metrics.observe('inbound_batch_size', len(events), buckets=(1, 10, 50, 100, 250, 500, 1000))
+    metrics.inc('inbound_events_total', created, outcome='stored')
+    metrics.inc('inbound_events_total', len(events) - created, outcome='duplicate')
+    return len(events)
+
+
+def _record_failure(conn, event_id, error):
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE inbound_events SET attempts = attempts + 1, last_error = %s WHERE id = %s RETURNING attempts",
+            (error, event_id)
+        )
+        row = cur.fetchone()
+    conn.commit()
+    metrics.inc('inbound_events_total', outcome='failed')
+    if row and row[0] >= MAX_ATTEMPTS:
+        metrics.inc('inbound_events_total', outcome='dead')
+        logger.error('Inbound event %s gave up after %s attempts: %s', event_id, row[0], error)
+
+
+def count_dead():
+    """Counts the dead events and sets the ``inbound_events_dead`` gauge."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM inbound_events WHERE attempts >= %s", (MAX_ATTEMPTS,))
+            dead = cur.fetchone()[0]
+        conn.commit()
+    metrics.set_gauge('inbound_events_dead', dead)
+    return dead
+
+
+def purge_dead(days=DEAD_RETENTION_DAYS):
+    """
+    Deletes dead events received more than ``days`` days ago (0 keeps them)
+    and refreshes the dead-event gauge. Returns how many were deleted.
+    """
+    purged = 0
+    if days:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM inbound_events
+                    WHERE attempts >= %s AND received_at < NOW() - make_interval(days => %s)
+                    """,
+                    (MAX_ATTEMPTS, days)
+                )
+                purged = cur.rowcount
+            conn.commit()
+    if purged:
+        metrics.inc('inbound_events_total', purged, outcome='purged')
+        logger.warning('Purged %s dead inbound events older than %s days', purged, days)
+    dead = count_dead()
+    if dead:
+        logger.warning('%s inbound events reached INBOUND_MAX_ATTEMPTS (see inbound_events.last_error)', dead)
+    return purged
+
+
+def process_batch(limit=BATCH_SIZE):
+    """Consumes up to ``limit`` staged events; returns how many were claimed."""
+    with db_connection() as conn:
+        try:
+            return _consume(conn, limit=limit)
+        except Exception:
+            conn.rollback()
+            logger.exception('Inbound batch failed, retrying event by event')
+
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id FROM inbound_events WHERE attempts < %s ORDER BY id LIMIT %s",
+                (MAX_ATTEMPTS, limit)
+            )
+            event_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+        for event_id in event_ids:
+            try:
+                _consume(conn, condition='AND e.id = %s', args=(event_id,), limit=1)
+            except Exception as e:
+                conn.rollback()
+                logger.exception('Inbound event %s failed', event_id)
+                _record_failure(conn, event_id, str(e))
+        return len(event_ids)
+
+
+class InboundConsumer:
+    """Threads that drain ``inbound_events`` until stopped."""
+
+    def __init__(self, size=None):
+        self.size = size or int(os.getenv('INBOUND_WORKERS', 1))
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _run(self, maintenance=False):
+        next_maintenance = 0
+        while not self._stop.is_set():
+            if maintenance and time.monotonic() >= next_maintenance:
+                try:
+                    purge_dead()
+                except Exception:
+                    logger.exception('Inbound dead event purge failed')
+                next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+            try:
+                claimed = process_batch()
+            except Exception:
+                logger.exception('Inbound consumer iteration failed')
+                claimed = 0
+            # A full batch means there is probably more waiting.
+            if claimed < BATCH_SIZE:
+                self._stop.wait(POLL_INTERVAL)
+
+    def start(self):
+        for i in range(self.size):
+            # The first thread also purges dead events.
+            thread = threading.Thread(target=self._run, args=(i == 0,), name=f'inbound-consumer-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    consumer = InboundConsumer().start()
+    logger.info('Inbound consumers started (%s threads)', consumer.size)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        consumer.stop()
@@ -0,0 +1,201 @@
+# instrumentation.py
+
+"""
+Opt-in request instrumentation, enabled with ``INSTRUMENTATION=1``.
+
+Every request gets a trace that accumulates time spans: ``db`` (cursor
+executes, commits and rollbacks), ``twilio`` (HTTP calls to Twilio),
+``marshal`` (flask-restx models) and ``serialize`` (JSON encoding). Spans
+are returned in a ``Server-Timing`` header and exported in ``/metrics`` as
+``request_span_seconds``, next to ``request_seconds``, both labelled by
+route and tenant tier. Streamed bodies (``format=ndjson``) are produced
+after the trace closes and only count their first query.
+
+A request can also be profiled: a sampling profiler walks the request
+thread's stack every ``PROFILE_INTERVAL`` seconds and writes the collapsed
+stacks (flamegraph.pl / speedscope format) to ``PROFILE_DIR``. Profiling is
+triggered by an ``X-Profile`` header equal to ``PROFILE_TOKEN`` (the
+header is ignored while that is unset) or at random for a
+``PROFILE_SAMPLE_RATE`` fraction of requests.
+"""
+
+import hmac
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from flask import g, request
+from flask_jwt_extended import get_jwt
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('INSTRUMENTATION', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'api-profiles'))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+DEFAULT_TIER = 'standard'
+
+metrics.describe('request_seconds', 'Request latency by route and tenant tier (INSTRUMENTATION=1)')
+metrics.describe('request_span_seconds', 'Time per request spent in each span by route and tenant tier')
+metrics.describe('request_profiles_total', 'Requests profiled by the sampling profiler by trigger')
+
+_trace = ContextVar('instrumentation_trace', default=None)
+_NOOP = nullcontext()
+
+
+class Trace:
+    """Span totals for the request being served."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = defaultdict(float)
+        self.tier = None
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.spans[self.name] += time.perf_counter() - self.started
+
+
+def span(name):
+    """Context manager adding its duration to span ``name``; a no-op outside a trace."""
+    trace = _trace.get()
+    return _NOOP if trace is None else _Span(trace, name)
+
+
+def tag_tenant(tenant):
+    """Labels the current trace with the tenant's tier."""
+    trace = _trace.get()
+    if trace is not None and tenant:
+        trace.tier = tenant.get('tier') or DEFAULT_TIER
+
+
+def _frame_name(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+class Sampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed stacks."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.stacks
+
+
+def _profile_trigger():
+    header = request.headers.get('X-Profile')
+    if PROFILE_TOKEN and header and hmac.compare_digest(header.encode(), PROFILE_TOKEN.encode()):
+        return 'header'
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+
+def _write_profile(stacks, route):
+    profile_id = uuid.uuid4().hex[:12]
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route.strip('/').replace('/', '_') or 'root'}-{profile_id}.folded"
+    with open(os.path.join(PROFILE_DIR, name), 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    return profile_id
+
+
+def init_app(app, tenant_lookup=None):
+    """
+    Registers the tracing hooks on ``app``. JWT-authenticated requests that did
+    not tag a tenant take the tier from the token's claims, or from
+    ``tenant_lookup(tenant_id)`` for tokens issued without them.
+    """
+
+    def tenant_tier(trace):
+        if trace.tier is None and tenant_lookup is not None:
+            try:
+                claims = get_jwt()
+            except RuntimeError:
+                claims = {}
+            if 'tier' in claims:
+                trace.tier = claims['tier'] or DEFAULT_TIER
+            elif claims.get('sub'):
+                tag_tenant(tenant_lookup(claims['sub']))
+        return trace.tier or 'none'
+
+    @app.before_request
+    def start_trace():
+        g.instrumentation_trace = trace = Trace()
+        _trace.set(trace)
+        trigger = _profile_trigger()
+        if trigger:
+            metrics.inc('request_profiles_total', trigger=trigger)
+            g.instrumentation_sampler = Sampler(threading.get_ident())
+            g.instrumentation_sampler.start()
+
+    @app.after_request
+    def finish_trace(response):
+        trace = g.pop('instrumentation_trace', None)
+        if trace is None:
+            return response
+        elapsed = time.perf_counter() - trace.started
+        route = request.url_rule.rule if request.url_rule else 'unknown'
+        tier = tenant_tier(trace)
+
+        metrics.observe('request_seconds', elapsed, route=route, method=request.method, tier=tier)
+        timings = []
+        for name, seconds in sorted(trace.spans.items()):
+            metrics.observe('request_span_seconds', seconds, route=route, span=name, tier=tier)
+            timings.append(f'{name};dur={seconds * 1000:.2f}')
+        timings.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+        sampler = g.pop('instrumentation_sampler', None)
+        if sampler is not None:
+            try:
+                response.headers['X-Profile-Id'] = _write_profile(sampler.stop(), route)
+            except OSError:
+                logger.exception('Could not write request profile')
+        return response
+
+    @app.teardown_request
+    def clear_trace(exc):
+        sampler = g.pop('instrumentation_sampler', None)
+        if sampler is not None:
+            sampler.stop()
+        _trace.set(None)
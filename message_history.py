@@ -0,0 +1,113 @@
+# message_history.py
+
+"""
+Keyset-paginated and streamed reads of a tenant's message history.
+
+Pages are ordered by ``(timestamp, id)`` descending and continued with an
+opaque cursor, so every page is an index range scan on
+``idx_messages_tenant_timestamp_id`` regardless of how deep the client is.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from db import db_connection
+from pagination import decode_cursor, encode_cursor
+
+COLUMNS = (
+    'id', 'conversation_id', 'tenant_id', 'message_sid', 'sender_type', 'body',
+    'to_number', 'media_url', 'status', 'timestamp', 'created_at', 'updated_at',
+)
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+STREAM_BATCH_SIZE = 1000
+
+
+def build_query(tenant_id, columns=COLUMNS, cursor=None, since=None, until=None,
+                conversation_id=None, sender_type=None, limit=None, sql=sql):
+    """
+    Returns ``(query, args)`` selecting ``columns`` plus the keyset columns.
+
+    ``sql`` is the driver's composition module (``psycopg2.sql`` or, for the
+    async app, ``psycopg.sql``); both expose the same API.
+    """
+    selected = list(dict.fromkeys(list(columns) + ['timestamp', 'id']))
+    conditions = [sql.SQL('tenant_id = %s')]
+    args = [tenant_id]
+
+    if cursor:
+        conditions.append(sql.SQL('(timestamp, id) < (%s, %s)'))
+        args.extend(decode_cursor(cursor))
+    if since:
+        conditions.append(sql.SQL('timestamp >= %s'))
+        args.append(since)
+    if until:
+        conditions.append(sql.SQL('timestamp < %s'))
+        args.append(until)
+    if conversation_id:
+        conditions.append(sql.SQL('conversation_id = %s'))
+        args.append(conversation_id)
+    if sender_type:
+        conditions.append(sql.SQL('sender_type = %s'))
+        args.append(sender_type)
+
+    query = sql.SQL('SELECT {columns} FROM messages WHERE {conditions} ORDER BY timestamp DESC, id DESC').format(
+        columns=sql.SQL(', ').join(sql.Identifier(column) for column in selected),
+        conditions=sql.SQL(' AND ').join(conditions),
+    )
+    if limit is not None:
+        query = query + sql.SQL(' LIMIT %s')
+        args.append(limit)
+    return query, args
+
+
+def fetch_page(tenant_id, limit=DEFAULT_LIMIT, **filters):
+    """Returns ``(rows, next_cursor)``; ``next_cursor`` is None on the last page."""
+    query, args = build_query(tenant_id, limit=limit + 1, **filters)
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, args)
+            rows = cur.fetchall()
+        conn.commit()
+    return split_page(rows, limit)
+
+
+def split_page(rows, limit):
+    """Trims the extra row fetched past ``limit`` and turns it into the next cursor."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_ndjson(row, columns):
+    return json.dumps({column: row[column] for column in columns}, default=json_default) + '\n'
+
+
+def stream_ndjson(tenant_id, columns=COLUMNS, **filters):
+    """
+    Yields one JSON line per message through a server-side named cursor,
+    so memory stays flat no matter how many rows match.
+    """
+    query, args = build_query(tenant_id, columns=columns, **filters)
+    with db_connection() as conn:
+        with conn.cursor(name='message_history_stream', cursor_factory=RealDictCursor) as cur:
+            cur.itersize = STREAM_BATCH_SIZE
+            cur.execute(query, args)
+            for row in cur:
+                yield to_ndjson(row, columns)
+        conn.commit()
@@ -0,0 +1,85 @@
+# message_search.py
+
+"""
+Tenant-scoped search over message bodies and contact numbers.
+
+Text is matched against ``messages.body_tsv``, a generated ``tsvector``
+(Spanish configuration) that Postgres maintains on every insert and that
+``idx_messages_body_tsv`` (GIN) indexes; queries use ``websearch_to_tsquery``
+syntax, so quoted phrases, ``or`` and ``-exclusion`` work. Numbers are
+matched as a substring of ``conversations.whatsapp_user_id``, which the
+``pg_trgm`` GIN index serves. Results are ranked with ``ts_rank_cd`` and
+continued with a ``(rank, timestamp, id)`` keyset cursor.
+"""
+
+from psycopg2.extras import RealDictCursor
+
+from db import db_connection
+from pagination import decode_ranked_cursor, encode_ranked_cursor
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Trigram indexes cannot serve patterns shorter than three characters.
+MIN_NUMBER_DIGITS = 3
+CONFIG = 'spanish'
+
+
+def number_pattern(number):
+    """The digits of a partial number as a LIKE pattern, or None if too short."""
+    digits = ''.join(ch for ch in number or '' if ch.isdigit())
+    return f'%{digits}%' if len(digits) >= MIN_NUMBER_DIGITS else None
+
+
+def search(tenant_id, text=None, number=None, limit=DEFAULT_LIMIT, cursor=None):
+    """
+    Returns ``(rows, next_cursor)`` for messages matching ``text`` and/or whose
+    contact number contains ``number``. Rows carry a ``headline`` with the
+    matched terms highlighted when searching text.
+    """
+    rank = "ts_rank_cd(m.body_tsv, q.query)" if text else "0::real"
+    query = f"""
+        SELECT m.id, m.conversation_id, c.whatsapp_user_id, m.sender_type, m.body, m.status, m.timestamp,
+               {rank} AS rank
+        FROM messages m
+        JOIN conversations c ON c.id = m.conversation_id
+    """
+    args = []
+    if text:
+        query += f", websearch_to_tsquery('{CONFIG}', %s) AS q(query)"
+        args.append(text)
+
+    query += " WHERE m.tenant_id = %s"
+    args.append(tenant_id)
+    if text:
+        query += " AND m.body_tsv @@ q.query"
+    if number:
+        query += " AND c.tenant_id = %s AND c.whatsapp_user_id LIKE %s"
+        args.extend([tenant_id, number_pattern(number)])
+    if cursor:
+        # The rank is a real; compared as a double it would never equal the cursor's.
+        query += f" AND ({rank}, m.timestamp, m.id) < (%s::real, %s, %s)"
+        args.extend(decode_ranked_cursor(cursor))
+    query += " ORDER BY rank DESC, m.timestamp DESC, m.id DESC LIMIT %s"
+    args.append(limit + 1)
+
+    if text:
+        # Headlines are costly; build them for the page only.
+        query = f"""
+            SELECT page.*, ts_headline('{CONFIG}', page.body, websearch_to_tsquery('{CONFIG}', %s)) AS headline
+            FROM ({query}) page
+            ORDER BY page.rank DESC, page.timestamp DESC, page.id DESC
+        """
+        args.insert(0, text)
+
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, args)
+            rows = cur.fetchall()
+        conn.commit()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_ranked_cursor(last['rank'], last['timestamp'], last['id'])
+    return rows, next_cursor
@@ -0,0 +1,90 @@
+# message_store.py
+
+"""
+Persistence of messages together with their conversation.
+
+``record_message`` upserts the conversation and inserts the message in a
+single statement (one data-modifying CTE), so recording a message is one
+round trip and cannot race on ``UNIQUE(tenant_id, whatsapp_user_id)``.
+
+The same upsert keeps the conversation's last-message snapshot
+(``last_message_body``, ``last_message_sender``, ``unread_count``) current,
+so listing conversations never has to look at ``messages``.
+"""
+
+import uuid
+
+SNAPSHOT_LENGTH = 280
+
+# Shared with the bulk upsert in broadcast.py.
+CONVERSATION_SNAPSHOT_UPDATE = """
+    last_message_at = EXCLUDED.last_message_at,
+    last_message_body = EXCLUDED.last_message_body,
+    last_message_sender = EXCLUDED.last_message_sender,
+    unread_count = conversations.unread_count + EXCLUDED.unread_count
+"""
+
+_UPSERT_CONVERSATION = """
+    conversation AS (
+        INSERT INTO conversations (tenant_id, whatsapp_user_id, last_message_at, status,
+                                   last_message_body, last_message_sender, unread_count)
+        VALUES (%(tenant_id)s, %(whatsapp_user_id)s, NOW(), 'active',
+                left(%(body)s, %(snapshot_length)s), %(sender_type)s::text,
+                CASE WHEN %(sender_type)s::text = 'user' THEN 1 ELSE 0 END)
+        ON CONFLICT (tenant_id, whatsapp_user_id) DO UPDATE SET""" + CONVERSATION_SNAPSHOT_UPDATE + """
+        RETURNING id
+    )
+"""
+
+_INSERT_MESSAGE = """
+    INSERT INTO messages (id, conversation_id, tenant_id, message_sid, sender_type, body, to_number, media_url, status, timestamp)
+    SELECT %(id)s, conversation.id, %(tenant_id)s, %(message_sid)s, %(sender_type)s::text, %(body)s, %(to_number)s, %(media_url)s, %(status)s, NOW()
+    FROM conversation
+    RETURNING id, conversation_id
+"""
+
+RECORD_MESSAGE_SQL = 'WITH ' + _UPSERT_CONVERSATION + _INSERT_MESSAGE
+
+RECORD_AND_ENQUEUE_SQL = (
+    'WITH ' + _UPSERT_CONVERSATION + ', message AS (' + _INSERT_MESSAGE + ')'
+    + """
+    INSERT INTO send_jobs (message_id, tenant_id, max_attempts)
+    SELECT message.id, %(tenant_id)s, %(max_attempts)s FROM message
+    RETURNING message_id, (SELECT conversation_id FROM message)
+    """
+)
+
+
+def record_statement(tenant_id, whatsapp_user_id, sender_type, body, to_number,
+                     message_sid=None, media_url=None, status='sent', enqueue=False, max_attempts=5):
+    """
+    Returns ``(query, params)`` for ``record_message``; the statement returns
+    one ``(message_id, conversation_id)`` row with either database driver.
+    """
+    params = {
+        'id': str(uuid.uuid4()),
+        'tenant_id': tenant_id,
+        'whatsapp_user_id': whatsapp_user_id,
+        'message_sid': message_sid,
+        'sender_type': sender_type,
+        'body': body,
+        'to_number': to_number,
+        'media_url': media_url,
+        'status': status,
+        'max_attempts': max_attempts,
+        'snapshot_length': SNAPSHOT_LENGTH,
+    }
+    return (RECORD_AND_ENQUEUE_SQL if enqueue else RECORD_MESSAGE_SQL), params
+
+
+def record_message(cur, *args, **kwargs):
+    """
+    Upserts the conversation and inserts the message with the caller's cursor.
+
+    Takes the arguments of ``record_statement``; with ``enqueue`` a
+    ``send_jobs`` row is chained into the same statement.
+    Returns ``(message_id, conversation_id)``; the caller commits.
+    """
+    cur.execute(*record_statement(*args, **kwargs))
+    message_id, conversation_id = cur.fetchone()
+    return message_id, conversation_id
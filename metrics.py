@@ -0,0 +1,97 @@
+# metrics.py
+
+import threading
+from collections import defaultdict
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+_help = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def describe(name, help_text):
+    """Registers the HELP text shown for a metric family."""
+    _help[name] = help_text
+
+
+def inc(name, value=1, **labels):
+    """Increments a counter."""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge to an absolute value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Records an observation in a cumulative histogram."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(hist['buckets']):
+            if value <= bound:
+                hist['counts'][i] += 1
+        hist['sum'] += value
+        hist['count'] += 1
+
+
+def snapshot():
+    """Returns a plain-dict copy of every metric, keyed by name."""
+    with _lock:
+        result = defaultdict(list)
+        for (name, labels), value in _counters.items():
+            result[name].append({'labels': dict(labels), 'value': value})
+        for (name, labels), value in _gauges.items():
+            result[name].append({'labels': dict(labels), 'value': value})
+        for (name, labels), hist in _histograms.items():
+            result[name].append({'labels': dict(labels), 'sum': hist['sum'], 'count': hist['count']})
+        return dict(result)
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def render_prometheus():
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _help:
+            lines.append(f'# HELP {name} {_help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), value in sorted(_gauges.items()):
+            header(name, 'gauge')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), hist in sorted(_histograms.items()):
+            header(name, 'histogram')
+            for bound, count in zip(hist['buckets'], hist['counts']):
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {hist["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {hist["sum"]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {hist["count"]}')
+    return '\n'.join(lines) + '\n'
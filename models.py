@@ -25,6 +25,9 @@ class Conversation(db.Model):
     whatsapp_user_id = db.Column(db.String(50), nullable=False)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50), default='open') # Optional status field
+    last_message_body = db.Column(db.Text, nullable=True) # Denormalized snapshot of the last message
+    last_message_sender = db.Column(db.String(10), nullable=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -38,10 +41,11 @@ class Message(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False)
     tenant_id = db.Column(db.String(36), db.ForeignKey('tenants.id'), nullable=False) # Denormalized
-    message_sid = db.Column(db.String(50), unique=True, nullable=False) # Twilio message SID
+    message_sid = db.Column(db.String(50), unique=True, nullable=True) # Twilio message SID (NULL while queued)
     sender_type = db.Column(db.String(10), nullable=False) # 'user' or 'bot'
     body = db.Column(db.Text, nullable=True)
     media_url = db.Column(db.String(500), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='sent') # 'received', 'queued', 'sent' or 'failed'
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -72,6 +76,9 @@ class Conversation(db.Model):
     whatsapp_user_id = db.Column(db.String(50), nullable=False)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50), default='open') # Optional status field
+    last_message_body = db.Column(db.Text, nullable=True) # Denormalized snapshot of the last message
+    last_message_sender = db.Column(db.String(10), nullable=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -85,10 +92,11 @@ class Message(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False)
     tenant_id = db.Column(db.String(36), db.ForeignKey('tenants.id'), nullable=False) # Denormalized
-    message_sid = db.Column(db.String(50), unique=True, nullable=False) # Twilio message SID
+    message_sid = db.Column(db.String(50), unique=True, nullable=True) # Twilio message SID (NULL while queued)
     sender_type = db.Column(db.String(10), nullable=False) # 'user' or 'bot'
     body = db.Column(db.Text, nullable=True)
     media_url = db.Column(db.String(500), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='sent') # 'received', 'queued', 'sent' or 'failed'
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -4,6 +4,7 @@ from typing_extensions import override
 
 import httpx
 
+from . import _serializer
 from ._types import Method
 from .http_abstract import AbstractHTTP, AbstractResponse
 
@@ -61,7 +62,9 @@ class Response(AbstractResponse[httpx.Response]):
 
     @override
     async def json(self, **kwargs: Any) -> Any:
-        return json.loads(await self.original.aread(), **kwargs)
+        if kwargs:
+            return json.loads(await self.original.aread(), **kwargs)
+        return _serializer.loads(await self.original.aread())
 
     @override
     async def text(self, **kwargs: Any) -> str:
@@ -1,21 +1,26 @@
 from __future__ import annotations
 
+import os
+import re
 import json
+import uuid
 import decimal
 import inspect
 import logging
 import datetime
+import itertools
+import threading
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Any, Union, Mapping, Iterable, ForwardRef, cast
+from typing import TYPE_CHECKING, Any, Union, Mapping, Iterable, Iterator, NamedTuple, ForwardRef, cast
 from datetime import timezone
-from textwrap import indent
 from functools import singledispatch
+from collections import OrderedDict
 from typing_extensions import Literal, TypeGuard, override
 
 from pydantic import BaseModel
 from pydantic.fields import FieldInfo
 
-from . import fields
+from . import fields, _serializer
 from ._types import PrismaMethod
 from .errors import InvalidModelError, UnknownModelError, UnknownRelationalFieldError
 from ._compat import get_args, is_union, get_origin, model_fields, model_field_type
@@ -73,9 +78,13 @@ METHOD_FORMAT_MAPPING: dict[PrismaMethod, str] = {
     'find_unique_or_raise': 'findUnique{model}OrThrow',
 }
 
+RAW_METHODS: set[PrismaMethod] = {'query_raw', 'query_first', 'execute_raw'}
+
 MISSING = object()
 Operation = Literal['query', 'mutation']
 
+QUERY_CACHE_SIZE = int(os.environ.get('PRISMA_PY_QUERY_CACHE_SIZE', '512'))
+
 
 class QueryBuilder:
     method: PrismaMethod
@@ -145,7 +154,7 @@ class QueryBuilder:
         # Note: we ignore the `model` argument for raw queries as users may want to pass in a model
         # that isn't a `PrismaModel` because they've defined it manually & enforcing that
         # they subclass `PrismaModel` doesn't bring any real benefits.
-        if model is None or method in {'execute_raw', 'query_raw', 'query_first'}:
+        if model is None or method in RAW_METHODS:
             self.model = None
         else:
             if not _is_prisma_model_type(model) or not hasattr(model, '__prisma_model__'):
@@ -185,18 +194,50 @@ class QueryBuilder:
           }
         }
         """
-        query = self._create_root_node().render()
+        if self.method in RAW_METHODS or not query_cache.maxsize:
+            # raw queries are keyed on their SQL, which would make every one a cache miss
+            query = self._create_root_node(self.arguments, self.include).render()
+        else:
+            query = self._build_cached_query()
         log.debug('Generated query: \n%s', query)
         return query
 
-    def _create_root_node(self) -> 'RootNode':
+    def _build_cached_query(self) -> str:
+        """Build the GraphQL query from a cached template of the same shape
+
+        Queries that only differ in their argument values share a template, so
+        rendering the node tree only happens the first time a shape is seen.
+        """
+        values: list[Any] = []
+        try:
+            arguments = _signature(self.arguments, values)
+            include = _include_signature(self.include, values)
+        except TypeError:
+            # invalid include values, let the regular rendering raise the error
+            return self._create_root_node(self.arguments, self.include).render()
+
+        root_selection = None if self.root_selection is None else tuple(self.root_selection)
+        key = (self.method, self.model, arguments, include, root_selection)
+        template = query_cache.get(key)
+        if template is None:
+            slots = itertools.count()
+            query = self._create_root_node(
+                _from_signature(arguments, slots),
+                _include_from_signature(include, slots),
+            ).render()
+            template = QueryTemplate.compile(query)
+            query_cache.put(key, template)
+
+        return template.fill(values)
+
+    def _create_root_node(self, arguments: dict[str, Any], include: dict[str, Any] | None) -> 'RootNode':
         root = RootNode(builder=self)
-        root.add(ResultNode.create(self))
+        root.add(ResultNode.create(self, arguments=arguments))
         root.add(
             Selection.create(
                 self,
                 model=self.model,
-                include=self.include,
+                include=include,
                 root_selection=self.root_selection,
             )
         )
@@ -215,13 +256,7 @@ class QueryBuilder:
         if name not in self.prisma_models:
             raise UnknownModelError(name)
 
-        # by default we exclude every field that points to a PrismaModel as that indicates that it is a relational field
-        # we explicitly keep fields that point to anything else, even other pydantic.BaseModel types, as they can be used to deserialize JSON
-        return [
-            field
-            for field, info in model_fields(model).items()
-            if not _field_is_prisma_model(info, name=field, parent=model)
-        ]
+        return list(model_metadata(model).scalar_fields)
 
     def get_relational_model(self, current_model: type[PrismaModel], field: str) -> type[PrismaModel]:
         """Returns the model that the field is related to.
@@ -243,12 +278,11 @@ class QueryBuilder:
         if field not in mappings:
             raise UnknownRelationalFieldError(model=current_model.__name__, field=field)
 
-        try:
-            info = model_fields(current_model)[field]
-        except KeyError as exc:
-            raise UnknownRelationalFieldError(model=current_model.__name__, field=field) from exc
+        metadata = model_metadata(current_model)
+        if field not in metadata.fields:
+            raise UnknownRelationalFieldError(model=current_model.__name__, field=field)
 
-        model = _prisma_model_for_field(info, name=field, parent=current_model)
+        model = metadata.relational_models.get(field)
         if not model:
             raise RuntimeError(
                 f"The `{field}` field doesn't appear to be a Prisma Model type. "
@@ -279,6 +313,64 @@ class QueryBuilder:
         return transformed
 
 
+class ModelMetadata(NamedTuple):
+    scalar_fields: tuple[str, ...]
+    """The fields selected by default, i.e. every field that does not point to a PrismaModel"""
+
+    relational_models: dict[str, type[PrismaModel]]
+    """Mapping of relational field name to the model class it points to"""
+
+    fields: frozenset[str]
+    """The names of all the model's fields"""
+
+
+_model_metadata: dict[type[BaseModel], ModelMetadata] = {}
+
+
+def model_metadata(model: type[PrismaModel]) -> ModelMetadata:
+    """Returns the field metadata the query builder needs for the given model class.
+
+    The generated models carry it as class variables, other classes (partial types
+    or user subclasses that may declare different fields) are introspected once.
+    """
+    metadata = _model_metadata.get(model)
+    if metadata is not None:
+        return metadata
+
+    if '__prisma_scalar_fields__' in model.__dict__:
+        scalar_fields = model.__prisma_scalar_fields__
+        relational_models = model.__prisma_relational_models__
+        metadata = ModelMetadata(
+            scalar_fields=scalar_fields,
+            relational_models=relational_models,
+            fields=frozenset(scalar_fields).union(relational_models),
+        )
+    else:
+        metadata = _introspect_model(model)
+
+    _model_metadata[model] = metadata
+    return metadata
+
+
+def _introspect_model(model: type[PrismaModel]) -> ModelMetadata:
+    scalar_fields: list[str] = []
+    relational_models: dict[str, type[PrismaModel]] = {}
+    for field, info in model_fields(model).items():
+        # by default we exclude every field that points to a PrismaModel as that indicates that it is a relational field
+        # we explicitly keep fields that point to anything else, even other pydantic.BaseModel types, as they can be used to deserialize JSON
+        related = _prisma_model_for_field(info, name=field, parent=model)
+        if related is None:
+            scalar_fields.append(field)
+        else:
+            relational_models[field] = related
+
+    return ModelMetadata(
+        scalar_fields=tuple(scalar_fields),
+        relational_models=relational_models,
+        fields=frozenset(model_fields(model)),
+    )
+
+
 def _prisma_model_for_field(
     field: FieldInfo,
     *,
@@ -311,20 +403,23 @@ def _prisma_model_for_field(
     return None
 
 
-def _field_is_prisma_model(field: FieldInfo, *, name: str, parent: type[BaseModel]) -> bool:
-    """Whether or not the given field info represents a model at the database level.
-
-    This will return `True` for cases where the field represents a list of models or a single model.
-    """
-    return _prisma_model_for_field(field, name=name, parent=parent) is not None
-
-
 def _is_prisma_model_type(type_: type[BaseModel]) -> TypeGuard[type[PrismaModel]]:
     from .bases import _PrismaModel  # noqa: TID251
 
     return issubclass(type_, _PrismaModel)
 
 
+def _indent(text: str, prefix: str) -> str:
+    """Like `textwrap.indent()`, but only splits lines on `\\n`.
+
+    `str.splitlines()` also breaks on U+0085, U+2028 and U+2029, which serialized
+    string values keep unescaped, and would insert the prefix inside those values.
+    """
+    if not prefix:
+        return text
+    return '\n'.join(prefix + line if line.strip() else line for line in text.split('\n'))
+
+
 class AbstractNode(ABC):
     __slots__ = ()
 
@@ -410,7 +505,7 @@ class Node(AbstractNode):
                 content = child.render()
 
             if content:
-                strings.append(indent(content, self.indent))
+                strings.append(_indent(content, self.indent))
 
         departed = self.depart()
         if departed is not None:
@@ -492,10 +587,13 @@ class ResultNode(Node):
         <children>
     """
 
-    __slots__ = ()
+    arguments: dict[str, Any]
+
+    __slots__ = ('arguments',)
 
-    def __init__(self, indent: str = '', **kwargs: Any) -> None:
+    def __init__(self, arguments: dict[str, Any], indent: str = '', **kwargs: Any) -> None:
         super().__init__(indent=indent, **kwargs)
+        self.arguments = arguments
 
     @override
     def enter(self) -> str:
@@ -517,7 +615,7 @@ class ResultNode(Node):
         return [
             Arguments.create(
                 self.builder,
-                arguments=self.builder.arguments,
+                arguments=self.arguments,
             )
         ]
 
@@ -571,7 +669,7 @@ class Arguments(Node):
                 # here as prisma expects parameters to be passed as a json string
                 # value like "[\"John\",\"123\"]", and we encode twice to ensure
                 # that only the inner quotes are escaped
-                if self.builder.method in {'query_raw', 'query_first', 'execute_raw'}:
+                if self.builder.method in RAW_METHODS:
                     children.append(f'{arg}: {dumps(dumps(value))}')
                 else:
                     children.append(Key(arg, node=ListNode.create(self.builder, data=value)))
@@ -815,6 +913,185 @@ class Key(AbstractNode):
         return f'{self.key}{self.sep}'
 
 
+# Placeholders are serialized as "\u0000<index>\u0000", which user data can never render to
+# as json.dumps always escapes control characters.
+SLOT_PATTERN = re.compile(r'"\\u0000(\d+)\\u0000"')
+
+
+class Slot:
+    """Stands in for an argument value while a query template is rendered"""
+
+    index: int
+
+    __slots__ = ('index',)
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+
+
+class QueryTemplate(NamedTuple):
+    """A rendered query split around the positions of its argument values"""
+
+    pieces: tuple[str, ...]
+    """The query text between values, one more than there are slots"""
+
+    slots: tuple[int, ...]
+    """Index into the query's values for each position, in text order"""
+
+    @classmethod
+    def compile(cls, query: str) -> QueryTemplate:
+        parts = SLOT_PATTERN.split(query)
+        return cls(pieces=tuple(parts[0::2]), slots=tuple(int(index) for index in parts[1::2]))
+
+    def fill(self, values: list[Any]) -> str:
+        pieces = self.pieces
+        parts = [pieces[0]]
+        for position, slot in enumerate(self.slots, start=1):
+            parts.append(dumps(values[slot]))
+            parts.append(pieces[position])
+        return ''.join(parts)
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class QueryCache:
+    """LRU cache of query templates keyed on the shape of the query.
+
+    The key is the method, the model, the structure of the arguments and of the
+    include tree (dictionary keys, list lengths and which values are None) and the
+    root selection; argument values are not part of it.
+    """
+
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+
+    __slots__ = ('maxsize', 'hits', 'misses', 'evictions', '_templates', '_lock')
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._templates: OrderedDict[Any, QueryTemplate] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> QueryTemplate | None:
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._templates.move_to_end(key)
+            return template
+
+    def put(self, key: Any, template: QueryTemplate) -> None:
+        with self._lock:
+            self._templates[key] = template
+            if len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            maxsize=self.maxsize,
+            currsize=len(self._templates),
+        )
+
+
+query_cache = QueryCache()
+
+
+def _signature(value: Any, values: list[Any], in_list: bool = False) -> Any:
+    """Returns the structure of an argument value, appending its leaf values to `values`
+
+    This mirrors how the `Arguments`, `Data` and `ListNode` nodes render values:
+    dictionaries and iterables are structure, everything else is serialized with `dumps()`.
+    """
+    if isinstance(value, dict):
+        return ('{', tuple((key, _signature(item, values)) for key, item in value.items()))
+
+    if not in_list:
+        if value is None:
+            return None
+        if isinstance(value, ITERABLES):
+            return ('[', tuple(_signature(item, values, in_list=True) for item in value))
+
+    values.append(value)
+    return '?'
+
+
+def _from_signature(signature: Any, slots: Iterator[int]) -> Any:
+    """Rebuilds an argument value from its signature with a `Slot` in place of every leaf"""
+    if signature == '?':
+        return Slot(next(slots))
+
+    if signature is None:
+        return None
+
+    kind, items = signature
+    if kind == '{':
+        return {key: _from_signature(item, slots) for key, item in items}
+    return [_from_signature(item, slots) for item in items]
+
+
+def _include_signature(include: dict[str, Any] | None, values: list[Any]) -> Any:
+    if include is None:
+        return None
+
+    signature: list[Any] = []
+    for key, value in include.items():
+        if isinstance(value, bool):
+            signature.append((key, value))
+        elif isinstance(value, dict):
+            args = value.copy()
+            nested = args.pop('include', None)
+            signature.append((key, _signature(args, values), _include_signature(nested, values)))
+        else:
+            raise TypeError(f'Expected `bool` or `dict` include value but got {type(value)} instead.')
+
+    return tuple(signature)
+
+
+def _include_from_signature(signature: Any, slots: Iterator[int]) -> dict[str, Any] | None:
+    if signature is None:
+        return None
+
+    include: dict[str, Any] = {}
+    for key, *value in signature:
+        if len(value) == 1:
+            include[key] = value[0]
+        else:
+            args, nested = value
+            include[key] = _from_signature(args, slots)
+            if nested is not None:
+                include[key]['include'] = _include_from_signature(nested, slots)
+
+    return include
+
+
 @singledispatch
 def serializer(obj: Any) -> Serializable:
     """Single dispatch generic function for serializing objects to JSON"""
@@ -862,6 +1139,17 @@ def serialize_base64(obj: fields.Base64) -> str:
     return str(obj)
 
 
+@serializer.register(Slot)
+def serialize_slot(slot: Slot) -> str:
+    return f'\x00{slot.index}\x00'
+
+
+@serializer.register(uuid.UUID)
+def serialize_uuid(obj: uuid.UUID) -> str:
+    """Serialize a UUID to its canonical string, like orjson does natively"""
+    return str(obj)
+
+
 @serializer.register(decimal.Decimal)
 def serialize_decimal(obj: decimal.Decimal) -> str:
     """Serialize a Decimal object to a string"""
@@ -869,6 +1157,13 @@ def serialize_decimal(obj: decimal.Decimal) -> str:
 
 
 def dumps(obj: Any, **kwargs: Any) -> str:
+    """Serialize an object with the configured JSON backend, see `_serializer.py`.
+
+    Extra keyword arguments are standard library `json.dumps()` options and use it directly.
+    """
+    if not kwargs:
+        return _serializer.backend.dumps(obj, serializer)
+
     kwargs.setdefault('default', serializer)
     kwargs.setdefault('ensure_ascii', False)
     return json.dumps(obj, **kwargs)
@@ -1,11 +1,16 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Callable, overload
+from typing import Any, Tuple, Callable, Iterable, NamedTuple, overload
+from functools import lru_cache
+from collections import namedtuple
 from typing_extensions import Literal
 
+from pydantic import BaseModel
+
+from . import fields
 from ._types import BaseModelT
-from ._compat import model_parse
+from ._compat import PYDANTIC_V2, get_args, is_union, get_origin, model_parse, model_fields, model_field_type
 
 # from https://github.com/prisma/prisma/blob/7da6f030350931eff8574e805acb9c0de9087e8e/packages/client/src/runtime/utils/deserializeRawResults.ts
 PrismaType = Literal[
@@ -63,6 +68,9 @@ class RawQueryResult:
         self.rows = rows
 
 
+Converter = Callable[[Any], object]
+
+
 @overload
 def deserialize_raw_results(raw_result: dict[str, Any]) -> list[dict[str, Any]]: ...
 
@@ -88,107 +96,197 @@ def deserialize_raw_results(
         types=raw_result['types'],
         rows=raw_result['rows'],
     )
+    if not result.rows:
+        return []
+
     if model is not None:
-        return [_deserialize_prisma_object(obj, result=result, model=model, for_model=True) for obj in result.rows]
+        return _deserialize_models(result, model)
 
-    return [_deserialize_prisma_object(obj, result=result, for_model=False) for obj in result.rows]
+    columns = result.columns
+    return [dict(zip(columns, row)) for row in _deserialize_columns(result, _column_converters(result))]
 
 
-# NOTE: this very weird `for_model` API is simply here as a workaround for
-# https://github.com/RobertCraigie/prisma-client-py/issues/638
-#
-# This should hopefully be removed soon.
+def deserialize_raw_rows(raw_result: dict[str, Any]) -> list[Tuple[Any, ...]]:
+    """Deserialize raw query results into one named tuple per row, without pydantic.
 
+    Fields are named after the columns, invalid or duplicated names are replaced
+    with their position, e.g. `_1`.
+    """
+    result = RawQueryResult(
+        columns=raw_result['columns'],
+        types=raw_result['types'],
+        rows=raw_result['rows'],
+    )
+    if not result.rows:
+        return []
 
-@overload
-def _deserialize_prisma_object(
-    fields: list[object],
-    *,
-    result: RawQueryResult,
-    for_model: bool,
-) -> dict[str, Any]: ...
+    return list(map(_row_type(tuple(result.columns))._make, _deserialize_columns(result, _column_converters(result))))
 
 
-@overload
-def _deserialize_prisma_object(
-    fields: list[object],
-    *,
-    result: RawQueryResult,
-    for_model: bool,
-    model: type[BaseModelT],
-) -> BaseModelT: ...
+@lru_cache(maxsize=128)
+def _row_type(columns: tuple[str, ...]) -> type[Tuple[Any, ...]]:
+    return namedtuple('Row', columns, rename=True)  # type: ignore[return-value]
 
 
-def _deserialize_prisma_object(
-    fields: list[object],
-    *,
+def _column_converters(
     result: RawQueryResult,
-    for_model: bool,
-    model: type[BaseModelT] | None = None,
-) -> BaseModelT | dict[str, Any]:
-    # create a local reference to avoid performance penalty of global
-    # lookups on some python versions
-    _deserializers = DESERIALIZERS
-
-    new_obj: dict[str, Any] = {}
-    for i, field in enumerate(fields):
-        key = result.columns[i]
-        prisma_type = result.types[i]
-
-        if field is None:
-            new_obj[key] = None
-            continue
+    deserializers: dict[PrismaType, Converter] | None = None,
+) -> list[Converter | None]:
+    if deserializers is None:
+        deserializers = DESERIALIZERS
+
+    return [
+        _column_converter(key, prisma_type, deserializers) for key, prisma_type in zip(result.columns, result.types)
+    ]
+
 
-        if prisma_type.endswith('-array'):
-            if not isinstance(field, list):
-                raise TypeError(
-                    f'Expected array data for {key} column with internal type {prisma_type}',
-                )
-
-            item_type, _ = prisma_type.split('-')
-
-            new_obj[key] = [
-                _deserializers[item_type](value, for_model)
-                #
-                if item_type in _deserializers
-                else value
-                for value in field
-            ]
+def _deserialize_columns(
+    result: RawQueryResult,
+    converters: list[Converter | None],
+) -> Iterable[tuple[object, ...]]:
+    """Convert the results column by column, returns the converted rows"""
+    if not any(converters):
+        return map(tuple, result.rows)
+
+    columns: list[Iterable[object]] = []
+    for converter, column in zip(converters, zip(*result.rows)):
+        if converter is None:
+            columns.append(column)
         else:
-            value = field
+            columns.append([None if value is None else converter(value) for value in column])
 
-            new_obj[key] = _deserializers[prisma_type](value, for_model) if prisma_type in _deserializers else value
+    return zip(*columns)
 
-    if model is not None:
-        return model_parse(model, new_obj)
 
-    return new_obj
+def _column_converter(
+    key: str,
+    prisma_type: PrismaType,
+    deserializers: dict[PrismaType, Converter],
+) -> Converter | None:
+    """Resolve the converter for every non-null value of a column, `None` if values are kept as is"""
+    if not prisma_type.endswith('-array'):
+        return deserializers.get(prisma_type)
 
+    item_type, _ = prisma_type.split('-')
+    deserializer = deserializers.get(item_type)  # type: ignore[call-overload]
 
-def _deserialize_bigint(value: str, _for_model: bool) -> int:
+    def convert_array(value: object) -> object:
+        if not isinstance(value, list):
+            raise TypeError(
+                f'Expected array data for {key} column with internal type {prisma_type}',
+            )
+
+        if deserializer is None:
+            return value
+
+        return [None if item is None else deserializer(item) for item in value]
+
+    return convert_array
+
+
+class _JsonColumn(NamedTuple):
+    index: int
+    key: str
+    name: str
+
+
+def _deserialize_models(result: RawQueryResult, model: type[BaseModelT]) -> list[BaseModelT]:
+    # Pydantic only accepts Json fields as a string. Instead of re-serializing the values the
+    # database already decoded, json columns of exact, unvalidated `Json` fields are validated as
+    # `null` and set on the model afterwards; any other field gets the values encoded to a string.
+    json_fields = _json_fields(model)
+    json_columns = [
+        _JsonColumn(index, key, json_fields[key])
+        for index, (key, prisma_type) in enumerate(zip(result.columns, result.types))
+        if prisma_type == 'json' and key in json_fields
+    ]
+    converters = _column_converters(result, MODEL_DESERIALIZERS)
+    for column in json_columns:
+        converters[column.index] = None
+
+    columns = result.columns
+    models: list[BaseModelT] = []
+    for row in _deserialize_columns(result, converters):
+        obj = dict(zip(columns, row))
+        decoded: list[tuple[str, object]] = []
+        for column in json_columns:
+            value = row[column.index]
+            # strings have not been decoded by the database and are left to pydantic
+            if value is not None and not isinstance(value, str):
+                obj[column.key] = 'null'
+                decoded.append((column.name, value))
+
+        instance = model_parse(model, obj)
+        for name, value in decoded:
+            instance.__dict__[name] = value
+
+        models.append(instance)
+
+    return models
+
+
+@lru_cache(maxsize=None)
+def _json_fields(model: type[BaseModel]) -> dict[str, str]:
+    """Map the keys of the model's `fields.Json` and `Optional[fields.Json]` fields to their attribute names.
+
+    Fields that a validator could see are left out, as those validators would be given `None`
+    instead of the data: the fast path is skipped entirely for models with model / root
+    validators or a `model_post_init` hook, and per field for field validators.
+    """
+    json_fields: dict[str, str] = {}
+    if not PYDANTIC_V2:
+        return json_fields
+
+    decorators = model.__pydantic_decorators__
+    if decorators.model_validators or decorators.root_validators or model.__pydantic_post_init__:
+        return json_fields
+
+    validated = {
+        field
+        for decorator in (*decorators.field_validators.values(), *decorators.validators.values())
+        for field in decorator.info.fields
+    }
+    if '*' in validated:
+        return json_fields
+
+    for name, field in model_fields(model).items():
+        # `Annotated` validators end up in the field's metadata
+        if name in validated or field.metadata:
+            continue
+        annotation = model_field_type(field)
+        types = get_args(annotation) if is_union(get_origin(annotation)) else (annotation,)
+        types = tuple(typ for typ in types if typ is not type(None))
+        if types and all(typ is fields.Json for typ in types):
+            json_fields[field.alias or name] = name
+
+    return json_fields
+
+
+def _deserialize_bigint(value: str) -> int:
     return int(value)
 
 
-def _deserialize_decimal(value: str, _for_model: bool) -> float:
+def _deserialize_decimal(value: str) -> float:
     return float(value)
 
 
-def _deserialize_json(value: object, for_model: bool) -> object:
+def _serialize_json(value: object) -> object:
     # TODO: this may break if someone inserts just a string into the database
-    if not isinstance(value, str) and for_model:
-        # TODO: this is very bad
-        #
-        # Pydantic expects Json fields to be a `str`, we should implement
-        # an actual workaround for this validation instead of wasting compute
-        # on re-serializing the data.
+    if not isinstance(value, str):
+        # Pydantic expects Json fields to be a `str`
         return json.dumps(value)
 
     # This may or may not have already been deserialized by the database
     return value
 
 
-DESERIALIZERS: dict[PrismaType, Callable[[Any, bool], object]] = {
+DESERIALIZERS: dict[PrismaType, Converter] = {
     'bigint': _deserialize_bigint,
     'decimal': _deserialize_decimal,
-    'json': _deserialize_json,
+}
+
+# json values are encoded back to a string for the model fields that are not exactly `Json`
+MODEL_DESERIALIZERS: dict[PrismaType, Converter] = {
+    **DESERIALIZERS,
+    'json': _serialize_json,
 }
@@ -0,0 +1,154 @@
+"""JSON backends used to encode query engine payloads and decode its responses.
+
+The backend is picked once at import time from the `PRISMA_PY_JSON_BACKEND`
+environment variable: `auto` (the default) uses orjson if it is installed, then
+msgspec, then the standard library `json` module. It can be changed at runtime
+with `set_backend()`.
+
+Every backend produces the same payloads: datetimes, decimals and the `Json` /
+`Base64` wrappers are always handed to the `serializer` hooks in `_builder.py`
+(which also turns UUIDs into strings, as orjson does), and NaN or infinite
+floats (which orjson would write as `null`) are encoded by the standard library,
+so the engine still rejects them.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import math
+import logging
+from typing import Any, Callable
+
+log: logging.Logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+Default = Callable[[Any], Any]
+
+
+class JSONBackend:
+    """The standard library `json` module"""
+
+    name: str = 'json'
+
+    def dumps(self, obj: Any, default: Default) -> str:
+        return json.dumps(obj, default=default, ensure_ascii=False)
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonBackend(JSONBackend):
+    """orjson, with the types it would otherwise serialize itself passed to `default`"""
+
+    name = 'orjson'
+
+    def __init__(self) -> None:
+        assert orjson is not None
+        # datetimes are truncated to milliseconds and converted to UTC by `serialize_datetime`,
+        # dataclasses and non-string keys are handled like the standard library does
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj: Any, default: Default) -> str:
+        assert orjson is not None
+        # The query builder dumps one argument value at a time, so scalars (the common
+        # case) only need a type check; only containers are walked for NaN / Infinity.
+        if isinstance(obj, float):
+            if not math.isfinite(obj):
+                return super().dumps(obj, default)
+        elif isinstance(obj, (dict, list, tuple)) and _has_non_finite(obj):
+            return super().dumps(obj, default)
+        try:
+            return orjson.dumps(obj, default=default, option=self.options).decode('utf-8')
+        except orjson.JSONEncodeError:
+            # e.g. integers larger than 64 bits, let the standard library handle (or reject) them
+            return super().dumps(obj, default)
+
+    def loads(self, data: str | bytes) -> Any:
+        assert orjson is not None
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return super().loads(data)
+
+
+def _has_non_finite(obj: Any) -> bool:
+    """Whether `obj` contains a NaN or infinite float, at any depth"""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+class MsgspecBackend(JSONBackend):
+    """msgspec for decoding responses.
+
+    msgspec encodes datetimes natively without a way to hand them to `default`, so
+    payloads are still encoded with the standard library to keep their format.
+    """
+
+    name = 'msgspec'
+
+    def __init__(self) -> None:
+        assert msgspec is not None
+        self.decoder = msgspec.json.Decoder()
+
+    def loads(self, data: str | bytes) -> Any:
+        assert msgspec is not None
+        try:
+            return self.decoder.decode(data)
+        except msgspec.DecodeError:
+            return super().loads(data)
+
+
+BACKENDS: dict[str, Callable[[], JSONBackend]] = {
+    'json': JSONBackend,
+    'orjson': OrjsonBackend,
+    'msgspec': MsgspecBackend,
+}
+
+
+def make_backend(name: str) -> JSONBackend:
+    if name == 'auto':
+        if orjson is not None:
+            return OrjsonBackend()
+        if msgspec is not None:
+            return MsgspecBackend()
+        return JSONBackend()
+
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown JSON backend {name!r}, expected one of: auto, {", ".join(BACKENDS)}')
+    if name != 'json' and globals()[name] is None:
+        raise RuntimeError(f'The {name} JSON backend requires the `{name}` package to be installed')
+    return BACKENDS[name]()
+
+
+backend: JSONBackend = make_backend(os.environ.get('PRISMA_PY_JSON_BACKEND', 'auto'))
+
+
+def set_backend(name: str) -> JSONBackend:
+    """Switches the JSON backend, `name` is one of `auto`, `json`, `orjson` or `msgspec`"""
+    global backend
+    backend = make_backend(name)
+    log.debug('Using the %s JSON backend', backend.name)
+    return backend
+
+
+def loads(data: str | bytes) -> Any:
+    return backend.loads(data)
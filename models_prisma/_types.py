@@ -67,6 +67,8 @@ class HttpConfig(TypedDict, total=False):
     timeout: None | float | httpx.Timeout
     trust_env: bool
     max_redirects: int
+    unix_socket: bool
+    """Talk to the query engine over a Unix domain socket instead of a TCP port"""
 
 
 SortMode = Literal['default', 'insensitive']
@@ -73,6 +73,10 @@ class _PrismaModel(BaseModel):
     # TODO: ensure this is required by subclasses
     __prisma_model__: ClassVar[str]
 
+    # static field metadata read by the query builder, set on the generated models
+    __prisma_scalar_fields__: ClassVar[Tuple[str, ...]]
+    __prisma_relational_models__: ClassVar[Dict[str, Type['_PrismaModel']]]
+
 
 class BaseTenant(_PrismaModel):
     __prisma_model__: ClassVar[Literal['Tenant']] = 'Tenant'  # pyright: ignore[reportIncompatibleVariableOverride]
@@ -57,7 +57,7 @@ from ._builder import QueryBuilder, dumps
 from .generator.models import EngineType, OptionalValueFromEnvVar, BinaryPaths
 from ._compat import removeprefix, model_parse
 from ._constants import CREATE_MANY_SKIP_DUPLICATES_UNSUPPORTED, DEFAULT_CONNECT_TIMEOUT, DEFAULT_TX_MAX_WAIT, DEFAULT_TX_TIMEOUT
-from ._raw_query import deserialize_raw_results
+from ._raw_query import deserialize_raw_rows, deserialize_raw_results
 from ._metrics import Metrics
 from .metadata import PRISMA_MODELS, RELATIONAL_FIELD_MAPPINGS
 from ._transactions import AsyncTransactionManager, SyncTransactionManager
@@ -237,6 +237,25 @@ class Prisma(AsyncBasePrisma):
 
         return deserialize_raw_results(result)
 
+    async def query_raw_rows(
+        self,
+        query: LiteralString,
+        *args: Any,
+    ) -> List[Tuple[Any, ...]]:
+        """Execute a raw SQL query against the database, returning one named tuple per row.
+
+        Values are converted like in `query_raw()` but no model or dictionary is built, which
+        is cheaper for queries returning many rows.
+        """
+        resp = await self._execute(
+            method='query_raw',
+            arguments={
+                'query': query,
+                'parameters': args,
+            },
+        )
+        return deserialize_raw_rows(resp['data']['result'])
+
     def batch_(self) -> Batch:
         """Returns a context manager for grouping write queries into a single transaction."""
         return Batch(client=self)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-import json
+import os
 import logging
 from typing import Any, NoReturn
 from datetime import timedelta
@@ -9,6 +9,7 @@ from typing_extensions import override
 import httpx
 
 from . import utils, errors
+from .. import _serializer
 from ..utils import is_dict
 from .._types import Method
 from ._abstract import SyncAbstractEngine, AsyncAbstractEngine
@@ -18,22 +19,56 @@ from ..http_abstract import AbstractResponse
 
 log: logging.Logger = logging.getLogger(__name__)
 
+# The query engine is a local process, so every connection is worth keeping alive:
+# the keep-alive pool is as large as the connection limit.
+ENGINE_POOL_SIZE = int(os.environ.get('PRISMA_PY_ENGINE_POOL_SIZE', '100'))
+ENGINE_LIMITS = httpx.Limits(
+    max_connections=ENGINE_POOL_SIZE,
+    max_keepalive_connections=ENGINE_POOL_SIZE,
+    keepalive_expiry=60,
+)
+
+
+def _session_kwargs(kwargs: dict[str, Any]) -> dict[str, Any]:
+    """Fills in the engine's connection defaults for the options that were not given"""
+    kwargs.setdefault('limits', ENGINE_LIMITS)
+    if kwargs.get('http2'):
+        # the engine does not use TLS so HTTP/2 can't be negotiated, it has to be spoken from the start
+        kwargs.setdefault('http1', False)
+    return kwargs
+
 
 class BaseHTTPEngine:
     """Engine wrapper that communicates to the underlying engine over HTTP"""
 
     url: str | None
-    headers: dict[str, str]
+    unix_socket: bool
+    """Whether the engine should listen on a Unix domain socket instead of a TCP port"""
+
+    _headers: dict[str, str]
+    _json_headers: dict[str, str]
 
     def __init__(
         self,
         *,
         url: str | None,
         headers: dict[str, str] | None = None,
+        unix_socket: bool = False,
     ) -> None:
         super().__init__()
         self.url = url
         self.headers = headers if headers is not None else {}
+        self.unix_socket = unix_socket
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return self._headers
+
+    @headers.setter
+    def headers(self, value: dict[str, str]) -> None:
+        # built once so that requests without extra headers don't have to merge dictionaries
+        self._headers = value
+        self._json_headers = {**value, 'Accept': 'application/json'}
 
     def _build_request(
         self,
@@ -47,25 +82,19 @@ class BaseHTTPEngine:
         if self.url is None:
             raise errors.NotConnectedError('Not connected to the query engine')
 
-        kwargs = {
-            'headers': {
-                **self.headers,
-            }
-        }
-
-        if parse_response:
-            kwargs['headers']['Accept'] = 'application/json'
-
-        if headers is not None:
-            kwargs['headers'].update(headers)
+        request_headers = self._json_headers if parse_response else self._headers
+        if headers:
+            request_headers = {**request_headers, **headers}
 
+        kwargs: dict[str, Any] = {'headers': request_headers}
         if content is not None:
             kwargs['content'] = content
 
         url = self.url + path
-        log.debug('Constructed %s request to %s', method, url)
-        log.debug('Request headers: %s', kwargs['headers'])
-        log.debug('Request content: %s', content)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Constructed %s request to %s', method, url)
+            log.debug('Request headers: %s', request_headers)
+            log.debug('Request content: %s', content)
 
         return url, kwargs
 
@@ -77,7 +106,7 @@ class BaseHTTPEngine:
     ) -> Any:
         if isinstance(data, str):
             # workaround for https://github.com/prisma/prisma-engines/pull/4246
-            data = json.loads(data)
+            data = _serializer.loads(data)
 
         if not is_dict(data):
             raise TypeError(f'Expected deserialised engine response to be a dictionary, got {type(data)} - {data}')
@@ -108,10 +137,20 @@ class SyncHTTPEngine(BaseHTTPEngine, SyncAbstractEngine):
         self,
         url: str | None,
         headers: dict[str, str] | None = None,
+        unix_socket: bool = False,
         **kwargs: Any,
     ) -> None:
-        super().__init__(url=url, headers=headers)
-        self.session = SyncHTTP(**kwargs)
+        super().__init__(url=url, headers=headers, unix_socket=unix_socket)
+        self.session = SyncHTTP(**_session_kwargs(kwargs))
+
+    def _use_unix_socket(self, path: str) -> None:
+        kwargs = self.session.session_kwargs
+        kwargs['transport'] = httpx.HTTPTransport(
+            uds=path,
+            limits=kwargs['limits'],
+            http1=kwargs.get('http1', True),
+            http2=kwargs.get('http2', False),
+        )
 
     @override
     def close(
@@ -148,7 +187,9 @@ class SyncHTTPEngine(BaseHTTPEngine, SyncAbstractEngine):
         )
 
         response = self.session.request(method, url, **kwargs)
-        log.debug('%s %s returned status %s', method, url, response.status)
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug('%s %s returned status %s', method, url, response.status)
 
         if 300 > response.status >= 200:
             # In certain cases we just want to return the response content as-is.
@@ -157,11 +198,13 @@ class SyncHTTPEngine(BaseHTTPEngine, SyncAbstractEngine):
             # which is incompatible with JSON.
             if not parse_response:
                 text = response.text()
-                log.debug('%s %s returned text: %s', method, url, text)
+                if debug:
+                    log.debug('%s %s returned text: %s', method, url, text)
                 return text
 
             data = response.json()
-            log.debug('%s %s returned %s', method, url, data)
+            if debug:
+                log.debug('%s %s returned %s', method, url, data)
 
             return self._process_response_data(data=data, response=response)
 
@@ -175,10 +218,20 @@ class AsyncHTTPEngine(BaseHTTPEngine, AsyncAbstractEngine):
         self,
         url: str | None,
         headers: dict[str, str] | None = None,
+        unix_socket: bool = False,
         **kwargs: Any,
     ) -> None:
-        super().__init__(url=url, headers=headers)
-        self.session = AsyncHTTP(**kwargs)
+        super().__init__(url=url, headers=headers, unix_socket=unix_socket)
+        self.session = AsyncHTTP(**_session_kwargs(kwargs))
+
+    def _use_unix_socket(self, path: str) -> None:
+        kwargs = self.session.session_kwargs
+        kwargs['transport'] = httpx.AsyncHTTPTransport(
+            uds=path,
+            limits=kwargs['limits'],
+            http1=kwargs.get('http1', True),
+            http2=kwargs.get('http2', False),
+        )
 
     @override
     def close(self, *, timeout: timedelta | None = None) -> None:
@@ -215,7 +268,9 @@ class AsyncHTTPEngine(BaseHTTPEngine, AsyncAbstractEngine):
         )
 
         response = await self.session.request(method, url, **kwargs)
-        log.debug('%s %s returned status %s', method, url, response.status)
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug('%s %s returned status %s', method, url, response.status)
 
         if 300 > response.status >= 200:
             # In certain cases we just want to return the response content as-is.
@@ -224,11 +279,13 @@ class AsyncHTTPEngine(BaseHTTPEngine, AsyncAbstractEngine):
             # which is incompatible with JSON.
             if not parse_response:
                 text = await response.text()
-                log.debug('%s %s returned text: %s', method, url, text)
+                if debug:
+                    log.debug('%s %s returned text: %s', method, url, text)
                 return text
 
             data = await response.json()
-            log.debug('%s %s returned %s', method, url, data)
+            if debug:
+                log.debug('%s %s returned %s', method, url, data)
 
             return self._process_response_data(data=data, response=response)
 
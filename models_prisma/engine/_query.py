@@ -6,6 +6,8 @@ import json
 import time
 import atexit
 import signal
+import secrets
+import tempfile
 import asyncio
 import logging
 import subprocess
@@ -37,6 +39,8 @@ log: logging.Logger = logging.getLogger(__name__)
 class BaseQueryEngine:
     dml_path: Path
     url: str | None
+    unix_socket: bool
+    socket_path: str | None
     file: Path | None
     process: subprocess.Popen[bytes] | subprocess.Popen[str] | None
 
@@ -50,6 +54,11 @@ class BaseQueryEngine:
         self._log_queries = log_queries
         self.process = None
         self.file = None
+        self.socket_path = None
+
+    if TYPE_CHECKING:
+        # provided by the HTTP engine classes
+        def _use_unix_socket(self, path: str) -> None: ...
 
     def _ensure_file(self) -> Path:
         # circular import
@@ -63,10 +72,22 @@ class BaseQueryEngine:
         file: Path,
         datasources: list[DatasourceOverride] | None,
     ) -> tuple[str, subprocess.Popen[bytes] | subprocess.Popen[str]]:
-        port = utils.get_open_port()
-        log.debug('Running query engine on port %i', port)
-
-        self.url = f'http://localhost:{port}'
+        if self.unix_socket and platform.name() == 'windows':
+            log.warning('Unix domain sockets are not supported on Windows, connecting over TCP instead')
+            self.unix_socket = False
+
+        if self.unix_socket:
+            self.socket_path = os.path.join(tempfile.gettempdir(), f'prisma-query-engine-{secrets.token_hex(8)}.sock')
+            log.debug('Running query engine on socket %s', self.socket_path)
+            self._use_unix_socket(self.socket_path)
+            # the host is ignored by the transport but httpx still needs an absolute URL
+            self.url = 'http://localhost'
+            listen_args = ['--unix-path', self.socket_path]
+        else:
+            port = utils.get_open_port()
+            log.debug('Running query engine on port %i', port)
+            self.url = f'http://localhost:{port}'
+            listen_args = ['-p', str(port)]
 
         env = os.environ.copy()
         env.update(
@@ -89,8 +110,7 @@ class BaseQueryEngine:
 
         args: list[str] = [
             str(file.absolute()),
-            '-p',
-            str(port),
+            *listen_args,
             '--enable-metrics',
             '--enable-raw-queries',
         ]
@@ -137,6 +157,13 @@ class BaseQueryEngine:
 
         self.process = None
 
+        if self.socket_path is not None:
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+            self.socket_path = None
+
 
 class SyncQueryEngine(BaseQueryEngine, SyncHTTPEngine):
     file: Path | None
@@ -235,9 +262,7 @@ class SyncQueryEngine(BaseQueryEngine, SyncHTTPEngine):
         *,
         tx_id: TransactionId | None,
     ) -> Any:
-        headers: dict[str, str] = {}
-        if tx_id is not None:
-            headers['X-transaction-id'] = tx_id
+        headers = None if tx_id is None else {'X-transaction-id': tx_id}
 
         return self.request(
             'POST',
@@ -395,9 +420,7 @@ class AsyncQueryEngine(BaseQueryEngine, AsyncHTTPEngine):
         *,
         tx_id: TransactionId | None,
     ) -> Any:
-        headers: dict[str, str] = {}
-        if tx_id is not None:
-            headers['X-transaction-id'] = tx_id
+        headers = None if tx_id is None else {'X-transaction-id': tx_id}
 
         return await self.request(
             'POST',
@@ -507,3 +507,32 @@ from . import models, actions
 # required to support relationships between models
 model_rebuild(Tenant)
 model_rebuild(WhatsappMessage)
+
+# field metadata for the query builder so that it does not have to introspect the models
+Tenant.__prisma_scalar_fields__ = (
+    'id',
+    'name',
+    'username',
+    'password',
+    'twilioAccountSid',
+    'twilioAuthToken',
+)
+Tenant.__prisma_relational_models__ = {
+    'whatsappMessages': WhatsappMessage,
+}
+WhatsappMessage.__prisma_scalar_fields__ = (
+    'id',
+    'tenantId',
+    'messageSid',
+    'fromNumber',
+    'toNumber',
+    'contentSid',
+    'contentVariables',
+    'status',
+    'errorMessage',
+    'createdAt',
+    'updatedAt',
+)
+WhatsappMessage.__prisma_relational_models__ = {
+    'tenant': Tenant,
+}
@@ -0,0 +1,41 @@
+# pagination.py
+
+"""Opaque keyset cursors shared by the paginated list endpoints."""
+
+import base64
+import json
+from datetime import datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp.isoformat(), str(row_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the ``(timestamp, id)`` pair encoded in ``cursor``."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), row_id
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def encode_ranked_cursor(rank, timestamp, row_id):
+    raw = json.dumps([rank, timestamp.isoformat(), str(row_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_ranked_cursor(cursor):
+    """Returns the ``(rank, timestamp, id)`` triple encoded in ``cursor``."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        rank, timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(rank), datetime.fromisoformat(timestamp), row_id
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
@@ -0,0 +1,289 @@
+# partitions.py
+
+"""
+Maintenance of the monthly ``messages`` partitions; run it daily::
+
+    python partitions.py
+
+1. Creates the partitions for the next ``PARTITION_MONTHS_AHEAD`` months
+   (``ensure_message_partitions()``); there is no default partition, so an
+   insert past the last one fails.
+2. Applies each tenant's retention (``tenants.retention_days``, else
+   ``MESSAGE_RETENTION_DAYS``; 0 keeps everything), deleting expired
+   messages in batches of ``MESSAGE_RETENTION_BATCH_SIZE`` so no long lock
+   is held. Unsent jobs of deleted messages are failed with them.
+3. Archives the partitions older than ``MESSAGE_ARCHIVE_AFTER_MONTHS``:
+   each one is detached (``CONCURRENTLY``, without blocking writers),
+   exported to ``MESSAGE_ARCHIVE_DIR`` as gzip-compressed NDJSON (or Parquet
+   with ``--format parquet``, which needs pyarrow) and dropped once the row
+   count of the file matches, after subtracting its messages from
+   ``tenant_stats.total_messages``. A run that stops half-way is resumed by
+   the next one.
+"""
+
+import argparse
+import gzip
+import logging
+import os
+import re
+from datetime import date
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from message_history import COLUMNS, to_ndjson
+from send_queue import ORPHANED_ERROR
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS', 0))
+RETENTION_BATCH_SIZE = int(os.getenv('MESSAGE_RETENTION_BATCH_SIZE', 5000))
+ARCHIVE_AFTER_MONTHS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_MONTHS', 12))
+ARCHIVE_DIR = os.getenv('MESSAGE_ARCHIVE_DIR', 'archive')
+EXPORT_BATCH_SIZE = 5000
+
+PARTITION_NAME = re.compile(r'^messages_(\d{4})_(\d{2})$')
+TIMESTAMP_COLUMNS = {'timestamp', 'created_at', 'updated_at'}
+
+
+def connect():
+    return psycopg2.connect(os.getenv('DIRECT_URL'))
+
+
+def ensure_partitions(conn, months_ahead=MONTHS_AHEAD):
+    """Creates the missing partitions up to ``months_ahead`` months ahead; returns how many."""
+    with conn.cursor() as cur:
+        cur.execute('SELECT ensure_message_partitions(%s)', (months_ahead,))
+        created = cur.fetchone()[0]
+    conn.commit()
+    return created
+
+
+def apply_retention(conn, default_days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE):
+    """Deletes every tenant's messages older than its retention; returns the number deleted."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT id, NOW() - make_interval(days => COALESCE(retention_days, %s)) FROM tenants
+            WHERE COALESCE(retention_days, %s) > 0
+            """,
+            (default_days, default_days)
+        )
+        cutoffs = cur.fetchall()
+    conn.commit()
+
+    deleted = 0
+    for tenant_id, cutoff in cutoffs:
+        while True:
+            with conn.cursor() as cur:
+                # The outer timestamp condition lets Postgres prune to the old partitions.
+                # Unsent jobs of the deleted messages fail in the same statement.
+                cur.execute(
+                    """
+                    WITH deleted AS (
+                        DELETE FROM messages m
+                        USING (
+                            SELECT id, timestamp FROM messages
+                            WHERE tenant_id = %s AND timestamp < %s
+                            LIMIT %s
+                        ) expired
+                        WHERE m.id = expired.id AND m.timestamp = expired.timestamp AND m.timestamp < %s
+                        RETURNING m.id
+                    ), orphaned AS (
+                        UPDATE send_jobs j
+                        SET status = 'failed', locked_at = NULL, last_error = %s
+                        FROM deleted
+                        WHERE j.message_id = deleted.id AND j.status IN ('pending', 'processing')
+                    )
+                    SELECT count(*) FROM deleted
+                    """,
+                    (tenant_id, cutoff, batch_size, cutoff, ORPHANED_ERROR)
+                )
+                count = cur.fetchone()[0]
+            conn.commit()
+            deleted += count
+            if count < batch_size:
+                break
+        logger.info('Retention for tenant %s: messages before %s removed', tenant_id, cutoff)
+    return deleted
+
+
+def _month(name):
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _archive_before(after_months, today=None):
+    """First day of the oldest month kept in the database."""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - after_months
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def archivable_partitions(conn, after_months=ARCHIVE_AFTER_MONTHS):
+    """
+    Returns ``[(name, state)]`` for the partitions to archive, oldest first;
+    state is 'attached', 'detaching' (an interrupted DETACH) or 'detached'
+    (detached by a run that did not finish exporting).
+    """
+    if after_months <= 0:
+        return []
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname,
+                   CASE WHEN i.inhrelid IS NULL THEN 'detached'
+                        WHEN i.inhdetachpending THEN 'detaching'
+                        ELSE 'attached' END
+            FROM pg_class c
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'messages'::regclass
+            WHERE c.relkind = 'r' AND c.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+              AND c.relnamespace = 'public'::regnamespace
+            """
+        )
+        rows = cur.fetchall()
+    conn.commit()
+    keep_from = _archive_before(after_months)
+    old = [(name, state) for name, state in rows if _month(name) < keep_from]
+    return sorted(old, key=lambda row: row[0])
+
+
+def _detach(conn, name, state):
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            if state == 'attached':
+                cur.execute(sql.SQL('ALTER TABLE messages DETACH PARTITION {} CONCURRENTLY').format(sql.Identifier(name)))
+            elif state == 'detaching':
+                cur.execute(sql.SQL('ALTER TABLE messages DETACH PARTITION {} FINALIZE').format(sql.Identifier(name)))
+    finally:
+        conn.autocommit = False
+
+
+def _rows(conn, name):
+    """Yields the partition's rows in batches through a server-side cursor."""
+    query = sql.SQL('SELECT {} FROM {} ORDER BY tenant_id, timestamp, id').format(
+        sql.SQL(', ').join(sql.Identifier(column) for column in COLUMNS), sql.Identifier(name)
+    )
+    with conn.cursor(name=f'export_{name}', cursor_factory=RealDictCursor) as cur:
+        cur.itersize = EXPORT_BATCH_SIZE
+        cur.execute(query)
+        while True:
+            batch = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not batch:
+                return
+            yield batch
+
+
+def _export_ndjson(conn, name, path):
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for batch in _rows(conn, name):
+            f.writelines(to_ndjson(row, COLUMNS) for row in batch)
+            count += len(batch)
+    return count
+
+
+def _export_parquet(conn, name, path):
+    schema = pyarrow.schema([
+        (column, pyarrow.timestamp('us') if column in TIMESTAMP_COLUMNS else pyarrow.string())
+        for column in COLUMNS
+    ])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for batch in _rows(conn, name):
+            columns = {
+                column: [row[column] if column in TIMESTAMP_COLUMNS or row[column] is None else str(row[column])
+                         for row in batch]
+                for column in COLUMNS
+            }
+            writer.write_table(pyarrow.table(columns, schema=schema))
+            count += len(batch)
+    return count
+
+
+EXPORTERS = {'ndjson': ('.ndjson.gz', _export_ndjson), 'parquet': ('.parquet', _export_parquet)}
+
+
+def archive_partition(conn, name, state, directory=ARCHIVE_DIR, fmt='ndjson'):
+    """Detaches, exports and drops one partition; returns the path of the export."""
+    extension, export = EXPORTERS[fmt]
+    _detach(conn, name, state)
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + extension)
+    partial = path + '.partial'
+    exported = export(conn, name, partial)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL('SELECT count(*) FROM {}').format(sql.Identifier(name)))
+        total = cur.fetchone()[0]
+    if exported != total:
+        conn.rollback()
+        raise RuntimeError(f'{name}: exported {exported} of {total} rows, partition kept')
+    os.replace(partial, path)
+
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("""
+                UPDATE send_jobs j
+                SET status = 'failed', locked_at = NULL, last_error = %s
+                FROM {} m
+                WHERE j.message_id = m.id AND j.status IN ('pending', 'processing')
+            """).format(sql.Identifier(name)),
+            (ORPHANED_ERROR,)
+        )
+        # DROP TABLE fires no delete trigger: take the partition out of the dashboard totals here.
+        cur.execute(
+            sql.SQL("""
+                UPDATE tenant_stats s
+                SET total_messages = s.total_messages - d.removed, updated_at = NOW()
+                FROM (SELECT tenant_id, count(*) AS removed FROM {} GROUP BY 1) d
+                WHERE s.tenant_id = d.tenant_id
+            """).format(sql.Identifier(name))
+        )
+        cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(name)))
+    conn.commit()
+    logger.info('Archived %s (%s messages) to %s', name, total, path)
+    return path
+
+
+def run(months_ahead=MONTHS_AHEAD, retention=True, archive_after_months=ARCHIVE_AFTER_MONTHS,
+        directory=ARCHIVE_DIR, fmt='ndjson'):
+    conn = connect()
+    try:
+        summary = {'partitions_created': ensure_partitions(conn, months_ahead)}
+        if retention:
+            summary['messages_deleted'] = apply_retention(conn)
+        summary['archived'] = [
+            archive_partition(conn, name, state, directory, fmt)
+            for name, state in archivable_partitions(conn, archive_after_months)
+        ]
+        return summary
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Mantenimiento de las particiones de messages')
+    parser.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD, help='Meses futuros con partición creada')
+    parser.add_argument('--archive-after-months', type=int, default=ARCHIVE_AFTER_MONTHS,
+                        help='Meses que se quedan en la base de datos (0: no archivar)')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--format', choices=sorted(EXPORTERS), default='ndjson')
+    parser.add_argument('--skip-retention', action='store_true', help='No borra mensajes por retención')
+    args = parser.parse_args()
+    if args.format == 'parquet' and pyarrow is None:
+        parser.error('--format parquet necesita pyarrow (pip install pyarrow)')
+
+    summary = run(args.months_ahead, not args.skip_retention, args.archive_after_months, args.archive_dir, args.format)
+    logger.info('Partitions created: %s, messages deleted: %s, partitions archived: %s',
+                summary['partitions_created'], summary.get('messages_deleted', 0), len(summary['archived']))
@@ -0,0 +1,239 @@
+# rate_limits.py
+
+"""
+Tenant-keyed API limits and per-number outbound pacing on token buckets.
+
+API requests take a token from the caller's tenant bucket: the verified
+JWT identity (with the quota from its claims), or, on the routes that take
+``X-Tenant-ID`` as their credential (``tenant_header_auth`` on the view
+class), that header or else the default tenant those handlers fall back
+to. Every other caller (no or an invalid token, an unknown ID, a header on
+a route that does not act for it) is keyed by IP, so unauthenticated
+requests cannot drain a tenant's quota. A tenant's quota is
+``tenants.requests_per_minute`` (``RATE_LIMIT_PER_MINUTE`` when NULL) and
+the bucket holds one minute's worth, so short bursts are allowed.
+
+Sends take a token from the sender number's bucket, refilled at
+``tenants.messages_per_second`` (``SEND_RATE_PER_NUMBER``, the WhatsApp
+default of 80 MPS, when NULL). A send waits up to ``SEND_PACE_MAX_WAIT``
+seconds for a token and raises ``SendThrottled`` after that, instead of
+sending a message Twilio would answer with a 429.
+
+With ``RATE_LIMIT_STORE=postgres`` (the default) buckets live in the
+``rate_buckets`` table and every worker and node shares them; the refill
+and take happen in one ``take_tokens()`` call. ``memory`` keeps them per
+process. If the store fails, requests are let through.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+
+import auth_tokens
+import metrics
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+REQUESTS_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', 600))
+SEND_RATE_PER_NUMBER = float(os.getenv('SEND_RATE_PER_NUMBER', 80))
+SEND_PACE_MAX_WAIT = float(os.getenv('SEND_PACE_MAX_WAIT', 1))
+STORE = os.getenv('RATE_LIMIT_STORE', 'postgres')
+
+# Swagger UI and the spec are not tenant traffic.
+EXEMPT_ENDPOINTS = {'api_bp.doc', 'api_bp.root', 'api_bp.specs'}
+
+metrics.describe('rate_limit_requests_total', 'API requests checked against tenant limits by result')
+metrics.describe('rate_limit_errors_total', 'Token bucket store failures (requests are let through)')
+metrics.describe('send_pacing_wait_seconds', 'Time sends waited for a per-number token')
+metrics.describe('send_pacing_throttled_total', 'Sends deferred because the number was over its rate')
+
+Decision = namedtuple('Decision', 'allowed limit remaining retry_after')
+
+
+class SendThrottled(Exception):
+    """The sender number has no token available within ``SEND_PACE_MAX_WAIT``."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Ritmo de envío del número superado; reintentar en {retry_after:.2f}s')
+        self.retry_after = retry_after
+
+
+class PostgresBucketStore:
+    """Buckets in the ``rate_buckets`` table, shared by every process using the database."""
+
+    def take(self, key, rate, burst, cost=1):
+        """Returns (allowed, tokens_left, retry_after_seconds)."""
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT allowed, tokens, retry_after FROM take_tokens(%s, %s, %s, %s)',
+                            (key, rate, burst, cost))
+                row = cur.fetchone()
+            conn.commit()
+        return row
+
+
+class MemoryBucketStore:
+    """Per-process buckets: limits apply per worker, not per deployment."""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return True, tokens - cost, 0.0
+            self._buckets[key] = (tokens, now)
+            return False, tokens, (cost - tokens) / max(rate, 1e-9)
+
+
+store = MemoryBucketStore() if STORE == 'memory' else PostgresBucketStore()
+
+
+def _take(key, rate, burst):
+    try:
+        return store.take(key, rate, burst)
+    except Exception:
+        logger.exception('Rate limit store failed for %s', key)
+        metrics.inc('rate_limit_errors_total')
+        return True, burst, 0.0
+
+
+def check(key, per_minute):
+    """Takes one request token from bucket ``key``."""
+    allowed, tokens, retry_after = _take(key, per_minute / 60, per_minute)
+    metrics.inc('rate_limit_requests_total', result='allowed' if allowed else 'limited')
+    return Decision(allowed, per_minute, int(tokens), retry_after)
+
+
+def check_tenant(tenant, fallback_key=None):
+    """``check`` against the tenant's quota, or the default quota on ``fallback_key``."""
+    if tenant:
+        return check(f"tenant:{tenant['id']}", tenant.get('requests_per_minute') or REQUESTS_PER_MINUTE)
+    return check(fallback_key, REQUESTS_PER_MINUTE)
+
+
+def send_rate(tenant):
+    """
+    Messages per second allowed for the tenant's sender number. Tenants without
+    their own rate (NULL) use ``SEND_RATE_PER_NUMBER``; setting that to 0
+    disables pacing.
+    """
+    return (tenant or {}).get('messages_per_second') or SEND_RATE_PER_NUMBER
+
+
+def pace_send(from_number, rate, max_wait=SEND_PACE_MAX_WAIT):
+    """Blocks until ``from_number`` may send one message, or raises ``SendThrottled``."""
+    if not rate:
+        return
+    waited = 0.0
+    while True:
+        allowed, _, retry_after = _take(f'send:{from_number}', rate, max(rate, 1))
+        if allowed:
+            break
+        if waited + retry_after > max_wait:
+            metrics.inc('send_pacing_throttled_total')
+            raise SendThrottled(retry_after)
+        time.sleep(retry_after)
+        waited += retry_after
+    if waited:
+        metrics.observe('send_pacing_wait_seconds', waited)
+
+
+async def pace_send_async(from_number, rate, max_wait=SEND_PACE_MAX_WAIT):
+    """``pace_send`` for the event loop: the store call runs in a thread, waits do not block."""
+    if not rate:
+        return
+    waited = 0.0
+    while True:
+        allowed, _, retry_after = await asyncio.to_thread(_take, f'send:{from_number}', rate, max(rate, 1))
+        if allowed:
+            break
+        if waited + retry_after > max_wait:
+            metrics.inc('send_pacing_throttled_total')
+            raise SendThrottled(retry_after)
+        await asyncio.sleep(retry_after)
+        waited += retry_after
+    if waited:
+        metrics.observe('send_pacing_wait_seconds', waited)
+
+
+def _tenant_header_auth():
+    """Whether the matched route acts for the tenant in ``X-Tenant-ID`` (or the default one)."""
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(getattr(view, 'view_class', None), 'tenant_header_auth', False)
+
+
+def request_tenant(tenant_lookup, default_tenant):
+    """
+    Returns the tenant the current Flask request is authenticated for, or None.
+    ``tenant_lookup(id)`` and ``default_tenant()`` come from tenant_cache;
+    access tokens with tenant claims need neither.
+    """
+    tenant_id = None
+    if request.headers.get('Authorization'):
+        try:
+            verify_jwt_in_request(optional=True)
+            claims = get_jwt()
+        except Exception:
+            return None
+        tenant = auth_tokens.tenant_from_claims(claims)
+        if tenant:
+            return tenant
+        tenant_id = claims.get('sub')
+    if not tenant_id:
+        if not _tenant_header_auth():
+            return None
+        tenant_id = request.headers.get('X-Tenant-ID')
+        if not tenant_id:
+            return default_tenant()
+    try:
+        uuid.UUID(str(tenant_id))
+    except ValueError:
+        return None
+    return tenant_lookup(tenant_id)
+
+
+LIMIT_EXCEEDED = {"error": "Límite de peticiones excedido. Intenta de nuevo más tarde."}
+
+
+def limit_headers(decision):
+    headers = {'X-RateLimit-Limit': str(decision.limit), 'X-RateLimit-Remaining': str(decision.remaining)}
+    if not decision.allowed:
+        headers['Retry-After'] = str(max(1, round(decision.retry_after)))
+    return headers
+
+
+def init_app(app, blueprints, tenant_lookup, default_tenant):
+    """Applies tenant limits to every request routed to one of ``blueprints`` (by name)."""
+
+    @app.before_request
+    def enforce_tenant_limit():
+        if request.blueprint not in blueprints or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        if not current_app.config.get('RATELIMIT_ENABLED', True):
+            return None
+        tenant = request_tenant(tenant_lookup, default_tenant)
+        g.rate_limit = decision = check_tenant(tenant, fallback_key=f'ip:{request.remote_addr}')
+        if not decision.allowed:
+            return jsonify(LIMIT_EXCEEDED), 429
+        return None
+
+    @app.after_request
+    def add_rate_limit_headers(response):
+        decision = g.pop('rate_limit', None)
+        if decision is not None:
+            response.headers.update(limit_headers(decision))
+        return response
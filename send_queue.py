@@ -0,0 +1,329 @@
+# send_queue.py
+
+"""
+Outbound send queue backed by the ``send_jobs`` table.
+
+Jobs are created in the same statement that stores the pending message
+(see ``message_store.record_message``); worker threads claim jobs with ``FOR UPDATE SKIP LOCKED`` so any
+number of processes can drain the queue without an external broker.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from twilio.base.exceptions import TwilioRestException
+from psycopg2.extras import RealDictCursor
+
+import metrics
+import rate_limits
+import twilio_clients
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv('SEND_QUEUE_MAX_ATTEMPTS', 5))
+TENANT_CONCURRENCY = int(os.getenv('SEND_QUEUE_TENANT_CONCURRENCY', 4))
+BACKOFF_BASE = float(os.getenv('SEND_QUEUE_BACKOFF_BASE', 2))
+BACKOFF_CAP = float(os.getenv('SEND_QUEUE_BACKOFF_CAP', 300))
+POLL_INTERVAL = float(os.getenv('SEND_QUEUE_POLL_INTERVAL', 1))
+VISIBILITY_TIMEOUT = int(os.getenv('SEND_QUEUE_VISIBILITY_TIMEOUT', 300))
+
+metrics.describe('send_queue_jobs_total', 'Send jobs processed by outcome')
+metrics.describe('send_queue_job_seconds', 'Time spent processing a send job')
+
+
+def backoff_delay(attempts):
+    """Full-jitter exponential backoff, in seconds."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempts))
+
+
+# The message and tenant are LEFT JOINed: a job whose message was deleted (retention,
+# archived partition) is still claimed, and process_job fails it instead of retrying it forever.
+_CLAIM_JOINS = """
+    LEFT JOIN messages m ON m.id = c.message_id
+    LEFT JOIN tenants t ON t.id = c.tenant_id
+"""
+
+_CLAIM_RETURNING = """
+    RETURNING j.id, j.message_id, j.tenant_id, j.attempts, j.max_attempts,
+              m.id IS NOT NULL AND t.id IS NOT NULL AS found,
+              m.body, m.to_number, t.twilio_account_sid, t.twilio_auth_token, t.twilio_whatsapp_number,
+              t.messages_per_second
+"""
+
+ORPHANED_ERROR = 'Mensaje o tenant eliminado'
+
+
+# First key of the two-key advisory locks that serialize claims per tenant. The
+# two-key form never collides with the single-key locks taken in inbound.py.
+_TENANT_LOCK_CLASS = 1
+
+_RUNNABLE = """
+    ((c.status = 'pending' AND c.run_at <= NOW())
+     OR (c.status = 'processing' AND c.locked_at < NOW() - make_interval(secs => %(timeout)s)))
+"""
+
+# Jobs past the visibility timeout are claimable again, so they no longer hold a slot.
+_UNDER_TENANT_LIMIT = """
+    (
+        SELECT count(*) FROM send_jobs p
+        WHERE p.tenant_id = c.tenant_id AND p.status = 'processing'
+          AND p.locked_at >= NOW() - make_interval(secs => %(timeout)s)
+    ) < %(limit)s
+"""
+
+
+def claim_job(conn):
+    """
+    Claims the next runnable job, skipping rows locked by other workers and
+    tenants that already have ``TENANT_CONCURRENCY`` jobs in flight.
+
+    Jobs stuck in 'processing' longer than the visibility timeout (a worker
+    died mid-send) become claimable again. The message and tenant
+    credentials come back with the job, so sending needs no further reads.
+
+    The in-flight count is only exact while no other worker claims for the
+    same tenant, so the claim runs under a per-tenant advisory lock; the
+    first query just picks a tenant that looks like it has a free slot.
+    """
+    params = {'timeout': VISIBILITY_TIMEOUT, 'limit': TENANT_CONCURRENCY, 'skip': []}
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        while True:
+            cur.execute(
+                """
+                SELECT c.tenant_id FROM send_jobs c
+                WHERE """ + _RUNNABLE + """
+                  AND c.tenant_id <> ALL(%(skip)s::uuid[])
+                  AND """ + _UNDER_TENANT_LIMIT + """
+                ORDER BY c.run_at
+                LIMIT 1
+                """,
+                params
+            )
+            candidate = cur.fetchone()
+            if candidate is None:
+                conn.commit()
+                return None
+
+            # Held until commit. The UPDATE is a new statement, so its count sees
+            # every job claimed by the previous holder of the lock.
+            cur.execute(
+                "SELECT pg_advisory_xact_lock(%s, hashtext(%s::text))",
+                (_TENANT_LOCK_CLASS, candidate['tenant_id'])
+            )
+            cur.execute(
+                """
+                UPDATE send_jobs j
+                SET status = 'processing', locked_at = NOW(), attempts = j.attempts + 1
+                FROM (
+                    SELECT c.id, c.message_id, c.tenant_id FROM send_jobs c
+                    WHERE c.tenant_id = %(tenant_id)s
+                      AND """ + _RUNNABLE + """
+                      AND """ + _UNDER_TENANT_LIMIT + """
+                    ORDER BY c.run_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                ) c
+                """ + _CLAIM_JOINS + """
+                WHERE j.id = c.id
+                """ + _CLAIM_RETURNING,
+                {**params, 'tenant_id': candidate['tenant_id']}
+            )
+            job = cur.fetchone()
+            conn.commit()
+            if job is not None:
+                return job
+            # Another worker filled the tenant's slots first; try the next tenant.
+            params['skip'].append(candidate['tenant_id'])
+
+
+def claim_broadcast_jobs(conn, broadcast_id, limit):
+    """
+    Claims up to ``limit`` runnable jobs of one broadcast. The caller bounds
+    concurrency itself, so the per-tenant limit is not applied here.
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            UPDATE send_jobs j
+            SET status = 'processing', locked_at = NOW(), attempts = j.attempts + 1
+            FROM (
+                SELECT c.id, c.message_id, c.tenant_id FROM send_jobs c
+                WHERE c.broadcast_id = %(broadcast_id)s
+                  AND """ + _RUNNABLE + """
+                ORDER BY c.run_at
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ) c
+            """ + _CLAIM_JOINS + """
+            WHERE j.id = c.id
+            """ + _CLAIM_RETURNING,
+            {'broadcast_id': broadcast_id, 'timeout': VISIBILITY_TIMEOUT, 'limit': limit}
+        )
+        jobs = cur.fetchall()
+    conn.commit()
+    return jobs
+
+
+def _finish(conn, job, message_sid):
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE messages SET message_sid = %s, status = 'sent' WHERE id = %s",
+            (message_sid, job['message_id'])
+        )
+        cur.execute(
+            "UPDATE send_jobs SET status = 'done', locked_at = NULL, last_error = NULL WHERE id = %s",
+            (job['id'],)
+        )
+    conn.commit()
+
+
+def _fail(conn, job, error, retryable):
+    with conn.cursor() as cur:
+        if retryable and job['attempts'] < job['max_attempts']:
+            cur.execute(
+                """
+                UPDATE send_jobs
+                SET status = 'pending', locked_at = NULL, last_error = %s,
+                    run_at = NOW() + make_interval(secs => %s)
+                WHERE id = %s
+                """,
+                (error, backoff_delay(job['attempts']), job['id'])
+            )
+            outcome = 'retry'
+        else:
+            cur.execute(
+                "UPDATE send_jobs SET status = 'failed', locked_at = NULL, last_error = %s WHERE id = %s",
+                (error, job['id'])
+            )
+            cur.execute("UPDATE messages SET status = 'failed' WHERE id = %s", (job['message_id'],))
+            outcome = 'failed'
+    conn.commit()
+    return outcome
+
+
+def _defer(conn, job, delay):
+    """Puts a job back without spending an attempt (the number was over its send rate)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE send_jobs
+            SET status = 'pending', locked_at = NULL, attempts = attempts - 1,
+                run_at = NOW() + make_interval(secs => %s)
+            WHERE id = %s
+            """,
+            (delay, job['id'])
+        )
+    conn.commit()
+    return 'deferred'
+
+
+def process_job(job):
+    """
+    Sends a claimed job's message through Twilio and records the outcome.
+
+    No pooled connection is held while waiting on Twilio.
+    """
+    started = time.monotonic()
+    if not job['found']:
+        with db_connection() as conn:
+            outcome = _fail(conn, job, ORPHANED_ERROR, retryable=False)
+        metrics.inc('send_queue_jobs_total', outcome=outcome)
+        return outcome
+
+    throttled = None
+    try:
+        client = twilio_clients.get_client(job['tenant_id'], job['twilio_account_sid'], job['twilio_auth_token'])
+        message = twilio_clients.send_message(
+            client, job['twilio_whatsapp_number'], job['to_number'], job['body'],
+            send_rate=rate_limits.send_rate(job)
+        )
+        error = None
+    except rate_limits.SendThrottled as e:
+        throttled, error = e, str(e)
+    except TwilioRestException as e:
+        # 429 and 5xx are transient; any other 4xx will fail the same way again.
+        status = e.status or 0
+        error, retryable = f'Error de Twilio: {e.msg}', status == 429 or status >= 500
+    except Exception as e:
+        logger.exception('Send job %s failed', job['id'])
+        error, retryable = str(e), True
+
+    with db_connection() as conn:
+        if error is None:
+            _finish(conn, job, message.sid)
+            outcome = 'sent'
+        elif throttled is not None:
+            outcome = _defer(conn, job, throttled.retry_after)
+        else:
+            outcome = _fail(conn, job, error, retryable)
+
+    metrics.inc('send_queue_jobs_total', outcome=outcome)
+    metrics.observe('send_queue_job_seconds', time.monotonic() - started)
+    return outcome
+
+
+def get_status(message_id, tenant_id):
+    """Returns the delivery status of one of the tenant's messages, or None if unknown."""
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT m.id, m.status, m.message_sid, j.status AS job_status,
+                       j.attempts, j.last_error, j.run_at AS next_attempt_at
+                FROM messages m LEFT JOIN send_jobs j ON j.message_id = m.id
+                WHERE m.id = %s AND m.tenant_id = %s
+                """,
+                (message_id, tenant_id)
+            )
+            row = cur.fetchone()
+        conn.commit()
+    return row
+
+
+class SendWorkerPool:
+    """Pool of threads that drain ``send_jobs`` until stopped."""
+
+    def __init__(self, size=None):
+        self.size = size or int(os.getenv('SEND_QUEUE_WORKERS', 4))
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with db_connection() as conn:
+                    job = claim_job(conn)
+                if job is not None:
+                    process_job(job)
+            except Exception:
+                logger.exception('Send worker iteration failed')
+                job = None
+            if job is None:
+                self._stop.wait(POLL_INTERVAL)
+
+    def start(self):
+        for i in range(self.size):
+            thread = threading.Thread(target=self._run, name=f'send-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    pool = SendWorkerPool().start()
+    logger.info('Send queue workers started (%s threads)', pool.size)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
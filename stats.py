@@ -0,0 +1,138 @@
+# stats.py
+
+"""
+Dashboard statistics read from precomputed counters.
+
+``tenant_stats`` (totals) and ``tenant_daily_stats`` (per tenant and day)
+are maintained by statement-level triggers on ``messages`` and
+``conversations`` (see create_db.py), so the dashboard reads one row per
+tenant instead of counting the messages table. ``rebuild`` recomputes
+every counter from scratch for backfills or after manual data fixes.
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+
+from psycopg2.extras import RealDictCursor
+
+import metrics
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', 10))
+
+metrics.describe('stats_cache_total', 'Dashboard stats cache lookups by result')
+
+_TENANT_STATS_SQL = """
+    SELECT t.id AS tenant_id, t.name,
+           COALESCE(s.total_messages, 0) AS total_messages,
+           COALESCE(s.active_conversations, 0) AS active_conversations,
+           COALESCE(d.messages_in, 0) AS messages_in_today,
+           COALESCE(d.messages_out, 0) AS messages_out_today,
+           COALESCE(d.messages_in + d.messages_out, 0) AS messages_today,
+           COALESCE(d.conversations_started, 0) AS conversations_started_today
+    FROM tenants t
+    LEFT JOIN tenant_stats s ON s.tenant_id = t.id
+    LEFT JOIN tenant_daily_stats d ON d.tenant_id = t.id AND d.day = CURRENT_DATE
+    ORDER BY t.name
+"""
+
+_cache = None  # (expires_at, rows)
+_lock = threading.Lock()
+
+
+def get_tenant_stats():
+    """Returns one row of counters per tenant, cached for ``CACHE_TTL`` seconds."""
+    global _cache
+    cached = _cache
+    if cached is not None and cached[0] > time.monotonic():
+        metrics.inc('stats_cache_total', result='hit')
+        return cached[1]
+
+    with _lock:
+        # Another thread may have refreshed the cache while we waited.
+        if _cache is not None and _cache[0] > time.monotonic():
+            metrics.inc('stats_cache_total', result='hit')
+            return _cache[1]
+
+        metrics.inc('stats_cache_total', result='miss')
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(_TENANT_STATS_SQL)
+                rows = cur.fetchall()
+            conn.commit()
+        _cache = (time.monotonic() + CACHE_TTL, rows)
+    return rows
+
+
+def get_overview():
+    """Totals across tenants, in the shape the dashboard template expects."""
+    rows = get_tenant_stats()
+    return {
+        'total_tenants': len(rows),
+        'active_conversations': sum(row['active_conversations'] for row in rows),
+        'messages_today': sum(row['messages_today'] for row in rows),
+        'total_messages': sum(row['total_messages'] for row in rows),
+    }
+
+
+def invalidate():
+    global _cache
+    _cache = None
+
+
+def rebuild():
+    """Recomputes every counter from ``messages`` and ``conversations``."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            # Blocks writers for the duration so no insert is counted twice or missed.
+            cur.execute("LOCK TABLE messages, conversations IN SHARE MODE")
+            cur.execute("DELETE FROM tenant_daily_stats")
+            cur.execute("DELETE FROM tenant_stats")
+            cur.execute(
+                """
+                INSERT INTO tenant_daily_stats (tenant_id, day, messages_in, messages_out, conversations_started)
+                SELECT tenant_id, day, sum(messages_in), sum(messages_out), sum(conversations_started)
+                FROM (
+                    SELECT tenant_id, COALESCE(timestamp, created_at)::date AS day,
+                           count(*) FILTER (WHERE sender_type = 'user') AS messages_in,
+                           count(*) FILTER (WHERE sender_type = 'bot') AS messages_out,
+                           0 AS conversations_started
+                    FROM messages GROUP BY 1, 2
+                    UNION ALL
+                    SELECT tenant_id, created_at::date, 0, 0, count(*)
+                    FROM conversations GROUP BY 1, 2
+                ) counts
+                WHERE day IS NOT NULL
+                GROUP BY 1, 2
+                """
+            )
+            cur.execute(
+                """
+                INSERT INTO tenant_stats (tenant_id, total_messages, active_conversations)
+                SELECT t.id,
+                       (SELECT count(*) FROM messages m WHERE m.tenant_id = t.id),
+                       (SELECT count(*) FROM conversations c WHERE c.tenant_id = t.id AND c.status = 'active')
+                FROM tenants t
+                """
+            )
+        conn.commit()
+    invalidate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dashboard statistics maintenance')
+    parser.add_argument('--rebuild', action='store_true', help='recompute every counter from scratch')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.rebuild:
+        started = time.monotonic()
+        rebuild()
+        logger.info('Stats rebuilt in %.2fs', time.monotonic() - started)
+    for row in get_tenant_stats():
+        logger.info('%s: %s', row['name'], {k: v for k, v in row.items() if k not in ('tenant_id', 'name')})
@@ -0,0 +1,174 @@
+# status_updates.py
+
+"""
+Coalesced delivery-status updates from Twilio status callbacks.
+
+Callbacks are buffered in memory per ``message_sid`` (keeping only the
+most advanced status) and flushed every ``FLUSH_INTERVAL`` seconds as one
+``UPDATE ... FROM (VALUES ...)``. The update only moves a message forward
+in ``STATUS_ORDER``, so a late "sent" never overwrites "read".
+
+Callbacks can beat the sender recording the ``message_sid`` (the send
+queue stores it after Twilio answers); updates that match no row are kept
+for up to ``UNMATCHED_TTL`` seconds and retried on later flushes.
+Buffered updates are lost if the process dies before a flush.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+import metrics
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.getenv('STATUS_FLUSH_INTERVAL', 0.25))
+MAX_BUFFER = int(os.getenv('STATUS_MAX_BUFFER', 5000))
+UNMATCHED_TTL = float(os.getenv('STATUS_UNMATCHED_TTL', 30))
+
+# Later entries win; statuses on the same step (failed/undelivered) do not replace each other.
+STATUS_ORDER = {
+    'queued': 0, 'accepted': 1, 'scheduled': 1, 'sending': 2, 'sent': 3,
+    'failed': 4, 'undelivered': 4, 'delivered': 5, 'read': 6,
+}
+
+metrics.describe('status_callbacks_total', 'Twilio status callbacks received by status')
+metrics.describe('status_flush_batch_size', 'Distinct messages written per status flush')
+metrics.describe('status_flush_seconds', 'Time spent applying one status flush')
+metrics.describe('status_updates_total', 'Buffered status updates by flush outcome')
+
+_APPLY_SQL = """
+    UPDATE messages m
+    SET status = v.status
+    FROM (VALUES %s) AS v (message_sid, status, rank)
+    WHERE m.message_sid = v.message_sid
+      AND COALESCE(
+            CASE m.status {cases} END,
+            -1
+          ) < v.rank
+    RETURNING v.message_sid
+"""
+
+_RANK_CASES = ' '.join(f"WHEN '{status}' THEN {rank}" for status, rank in STATUS_ORDER.items())
+
+# Rows already at or past the buffered status are matched too, just not changed.
+_MATCHED_SQL = "SELECT message_sid FROM messages WHERE message_sid = ANY(%s)"
+
+
+class StatusCoalescer:
+    """Buffers status updates and applies them in batches from a background thread."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_buffer=MAX_BUFFER):
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._pending = {}  # message_sid -> (rank, status, first_seen)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, message_sid, status):
+        """Buffers one callback; unknown statuses are ignored. Returns whether it was buffered."""
+        rank = STATUS_ORDER.get(status)
+        if rank is None or not message_sid:
+            return False
+        metrics.inc('status_callbacks_total', status=status)
+        with self._lock:
+            current = self._pending.get(message_sid)
+            if current is None or current[0] < rank:
+                first_seen = current[2] if current else time.monotonic()
+                self._pending[message_sid] = (rank, status, first_seen)
+            full = len(self._pending) >= self.max_buffer
+        self._ensure_started()
+        if full:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """Applies everything buffered so far; returns the number of rows updated."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        started = time.monotonic()
+        sids = list(batch)
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    updated = execute_values(
+                        cur,
+                        _APPLY_SQL.format(cases=_RANK_CASES),
+                        [(sid, batch[sid][1], batch[sid][0]) for sid in sids],
+                        template='(%s, %s, %s)',
+                        page_size=len(sids),
+                        fetch=True
+                    )
+                    matched = {row[0] for row in updated}
+                    if len(matched) < len(sids):
+                        cur.execute(_MATCHED_SQL, ([sid for sid in sids if sid not in matched],))
+                        matched.update(row[0] for row in cur.fetchall())
+                conn.commit()
+        except Exception:
+            self._requeue(batch)
+            raise
+
+        now = time.monotonic()
+        retry = {sid: entry for sid, entry in batch.items()
+                 if sid not in matched and now - entry[2] < UNMATCHED_TTL}
+        self._requeue(retry)
+
+        metrics.observe('status_flush_batch_size', len(sids), buckets=(1, 5, 10, 50, 100, 500, 1000, 5000))
+        metrics.observe('status_flush_seconds', now - started)
+        metrics.inc('status_updates_total', len(updated), outcome='applied')
+        metrics.inc('status_updates_total', len(matched) - len(updated), outcome='stale')
+        metrics.inc('status_updates_total', len(retry), outcome='retried')
+        metrics.inc('status_updates_total', len(sids) - len(matched) - len(retry), outcome='dropped')
+        return len(updated)
+
+    def _requeue(self, entries):
+        with self._lock:
+            for sid, entry in entries.items():
+                current = self._pending.get(sid)
+                if current is None or current[0] < entry[0]:
+                    self._pending[sid] = entry
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Status flush failed')
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='status-coalescer', daemon=True)
+                    self._thread.start()
+
+    def _after_fork(self):
+        # Updates buffered by the parent are flushed by the parent.
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+coalescer = StatusCoalescer()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=coalescer._after_fork)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        coalescer.flush()
+    except Exception:
+        logger.exception('Final status flush failed')
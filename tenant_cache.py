@@ -0,0 +1,208 @@
+# tenant_cache.py
+
+"""
+In-process cache of tenant rows for the hot request paths.
+
+Tenants are cached by id, with secondary indexes by API key and WhatsApp
+number pointing at the same entry. Entries expire after ``TTL`` seconds;
+writes to ``tenants`` call ``notify_invalidation`` inside their transaction
+so every worker process drops the entry through Postgres ``LISTEN/NOTIFY``
+as soon as the change commits. The TTL only bounds staleness if a
+notification is lost (the listener also clears everything after a
+reconnect, since notifications sent while disconnected are not replayed).
+
+Cached rows are shared between threads and must be treated as read-only.
+"""
+
+import logging
+import os
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+import metrics
+import twilio_clients
+from db import query_db
+
+logger = logging.getLogger(__name__)
+
+TTL = float(os.getenv('TENANT_CACHE_TTL', 60))
+LISTEN = os.getenv('TENANT_CACHE_LISTEN', '1') == '1'
+CHANNEL = 'tenant_cache'
+
+metrics.describe('tenant_cache_total', 'Tenant cache lookups by key and result')
+metrics.describe('tenant_cache_invalidations_total', 'Tenant cache invalidations by source')
+
+_entries = {}     # tenant id -> (expires_at, row)
+_by_api_key = {}  # api key -> tenant id
+_by_number = {}   # twilio_whatsapp_number -> tenant id
+_default_id = None
+_generation = 0   # bumped by every invalidation
+_lock = threading.Lock()
+_listener = None
+
+
+def _store(row, generation, default=False):
+    """
+    Caches ``row`` unless an invalidation happened since ``generation`` was
+    read (before the SELECT), since the row may predate that change.
+    """
+    global _default_id
+    tenant_id = str(row['id'])
+    with _lock:
+        if generation != _generation:
+            return False
+        if default:
+            _default_id = tenant_id
+        _entries[tenant_id] = (time.monotonic() + TTL, row)
+        if row.get('api_key'):
+            _by_api_key[row['api_key']] = tenant_id
+        if row.get('twilio_whatsapp_number'):
+            _by_number[row['twilio_whatsapp_number']] = tenant_id
+    return True
+
+
+def _cached(tenant_id):
+    entry = _entries.get(tenant_id) if tenant_id else None
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def _lookup(key, tenant_id, column, value):
+    _ensure_listener()
+    row = _cached(tenant_id)
+    # A secondary index may still point at a tenant whose key has since changed.
+    if row is not None and (column == 'id' or row.get(column) == value):
+        metrics.inc('tenant_cache_total', key=key, result='hit')
+        return row
+
+    metrics.inc('tenant_cache_total', key=key, result='miss')
+    generation = _generation
+    row = query_db(f'SELECT * FROM tenants WHERE {column} = %s', [value], one=True)
+    if row:
+        _store(row, generation)
+    return row
+
+
+def get_by_id(tenant_id):
+    """Returns the tenant row for ``tenant_id`` (a valid UUID), or None."""
+    return _lookup('id', str(tenant_id), 'id', str(tenant_id))
+
+
+def get_by_api_key(api_key):
+    return _lookup('api_key', _by_api_key.get(api_key), 'api_key', api_key)
+
+
+def get_by_whatsapp_number(number):
+    return _lookup('whatsapp_number', _by_number.get(number), 'twilio_whatsapp_number', number)
+
+
+def get_default():
+    """Returns the oldest tenant, used when a request does not name one."""
+    _ensure_listener()
+    row = _cached(_default_id)
+    if row is not None:
+        metrics.inc('tenant_cache_total', key='default', result='hit')
+        return row
+
+    metrics.inc('tenant_cache_total', key='default', result='miss')
+    generation = _generation
+    row = query_db('SELECT * FROM tenants ORDER BY created_at, id LIMIT 1', one=True)
+    if not row:
+        return None
+    _store(row, generation, default=True)
+    return row
+
+
+def invalidate(tenant_id=None, source='local'):
+    """Drops one tenant (or every tenant) from this process's caches."""
+    global _default_id, _generation
+    with _lock:
+        _generation += 1
+        if tenant_id is None:
+            _entries.clear()
+            _by_api_key.clear()
+            _by_number.clear()
+        else:
+            tenant_id = str(tenant_id)
+            _entries.pop(tenant_id, None)
+            for index in (_by_api_key, _by_number):
+                for key in [key for key, value in index.items() if value == tenant_id]:
+                    del index[key]
+        # Creating or deleting any tenant can change which one is the default.
+        _default_id = None
+    if tenant_id is not None:
+        twilio_clients.invalidate(tenant_id)
+    metrics.inc('tenant_cache_invalidations_total', source=source)
+
+
+def notify_invalidation(cur, tenant_id):
+    """
+    Queues a cross-process invalidation on the caller's transaction; Postgres
+    delivers it to every listener only if and when the transaction commits.
+    """
+    cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, str(tenant_id)))
+
+
+class _Listener(threading.Thread):
+    """Daemon thread holding a dedicated LISTEN connection outside the pool."""
+
+    def __init__(self, dsn):
+        super().__init__(name='tenant-cache-listener', daemon=True)
+        self.dsn = dsn
+        self.delay = 1
+
+    def _listen(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {CHANNEL}')
+        self.delay = 1
+        # Anything sent before LISTEN took effect was missed.
+        invalidate(source='reconnect')
+        try:
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    invalidate(notify.payload or None, source='notify')
+        finally:
+            conn.close()
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Tenant cache listener disconnected, retrying in %ss', self.delay)
+                time.sleep(self.delay)
+                self.delay = min(self.delay * 2, 60)
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is None and LISTEN:
+        with _lock:
+            if _listener is None:
+                _listener = _Listener(os.getenv('DIRECT_URL'))
+                _listener.start()
+
+
+def _after_fork():
+    # The listener thread does not survive fork; the child starts its own on first use.
+    global _listener, _default_id
+    _listener = None
+    _entries.clear()
+    _by_api_key.clear()
+    _by_number.clear()
+    _default_id = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
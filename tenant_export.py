@@ -0,0 +1,267 @@
+# tenant_export.py
+
+"""
+Streaming export of a tenant's messages or conversations, for compliance.
+
+Rows are read in ``(timestamp, id)`` order through a named server-side
+cursor and written as gzip-compressed NDJSON or CSV. Every
+``EXPORT_CHUNK_ROWS`` rows close one gzip member; a file of concatenated
+members is a valid gzip file, so memory stays at one chunk however large
+the export. Ranges are ``[since, until)`` on the timestamp and can be resumed
+after the last exported row with ``after``/``after_id``.
+
+An export reads through its own connection (``DIRECT_URL``, outside the
+pool), since a slow download keeps it open for as long as it lasts. At most
+``EXPORT_MAX_CONCURRENT`` HTTP exports run at a time per process
+(``acquire_slot``/``release_slot``).
+
+The CLI writes to a file and resumes by itself after an interruption::
+
+    python tenant_export.py <tenant_id> messages --format csv -o messages.csv.gz
+
+It records the position after every chunk in ``<output>.progress``; a new
+run with the same output truncates the file to the last complete chunk and
+continues from there. Without ``--until`` the range ends when the first run
+started, so a resumed export does not pick up newer rows.
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+import conversations
+import message_history
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 5000))
+COMPRESS_LEVEL = int(os.getenv('EXPORT_COMPRESS_LEVEL', 6))
+MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', 2))
+FORMATS = ('ndjson', 'csv')
+
+# resource -> (columns, table, ordering timestamp column)
+RESOURCES = {
+    'messages': (message_history.COLUMNS, 'messages', 'timestamp'),
+    'conversations': (conversations.COLUMNS, 'conversations', 'created_at'),
+}
+
+metrics.describe('tenant_export_bytes_total', 'Compressed bytes written by tenant exports')
+metrics.describe('tenant_export_bytes_per_second', 'Compressed throughput of finished tenant exports')
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+
+def acquire_slot():
+    """Takes one of the ``EXPORT_MAX_CONCURRENT`` export slots without waiting; False if none is free."""
+    return _slots.acquire(blocking=False)
+
+
+def release_slot():
+    _slots.release()
+
+
+def connect():
+    return psycopg2.connect(os.getenv('DIRECT_URL'))
+
+
+def build_query(tenant_id, resource, since=None, until=None, after=None, after_id=None):
+    columns, table, key = RESOURCES[resource]
+    selected = list(dict.fromkeys(list(columns) + [key, 'id']))
+    conditions = [sql.SQL('tenant_id = %s')]
+    args = [tenant_id]
+    if since:
+        conditions.append(sql.SQL('{} >= %s').format(sql.Identifier(key)))
+        args.append(since)
+    if until:
+        conditions.append(sql.SQL('{} < %s').format(sql.Identifier(key)))
+        args.append(until)
+    if after and after_id:
+        conditions.append(sql.SQL('({}, id) > (%s, %s)').format(sql.Identifier(key)))
+        args.extend([after, after_id])
+    elif after:
+        conditions.append(sql.SQL('{} > %s').format(sql.Identifier(key)))
+        args.append(after)
+    query = sql.SQL('SELECT {columns} FROM {table} WHERE {conditions} ORDER BY {key}, id').format(
+        columns=sql.SQL(', ').join(sql.Identifier(column) for column in selected),
+        table=sql.Identifier(table),
+        conditions=sql.SQL(' AND ').join(conditions),
+        key=sql.Identifier(key),
+    )
+    return query, args
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _encode(rows, columns, fmt, header):
+    if fmt == 'ndjson':
+        return ''.join(message_history.to_ndjson(row, columns) for row in rows).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows([_csv_value(row[column]) for column in columns] for row in rows)
+    return buffer.getvalue().encode()
+
+
+def export_chunks(tenant_id, resource, fmt='ndjson', since=None, until=None, after=None, after_id=None,
+                  header=True):
+    """
+    Yields ``(gzip_member, (last_timestamp, last_id))`` per chunk of rows. A CSV
+    header goes in the first member when ``header`` is set.
+    """
+    columns, _, key = RESOURCES[resource]
+    query, args = build_query(tenant_id, resource, since, until, after, after_id)
+    conn = connect()
+    try:
+        with conn.cursor(name=f'tenant_export_{resource}', cursor_factory=RealDictCursor) as cur:
+            cur.itersize = CHUNK_ROWS
+            cur.execute(query, args)
+            first = True
+            while True:
+                rows = cur.fetchmany(CHUNK_ROWS)
+                if not rows:
+                    break
+                data = _encode(rows, columns, fmt, header and first)
+                first = False
+                member = gzip.compress(data, COMPRESS_LEVEL)
+                metrics.inc('tenant_export_bytes_total', len(member), resource=resource)
+                yield member, (rows[-1][key], rows[-1]['id'])
+        conn.commit()
+    finally:
+        conn.close()
+    if first and header and fmt == 'csv':
+        yield gzip.compress(_encode([], columns, fmt, True), COMPRESS_LEVEL), None
+
+
+class Throughput:
+    """Bytes and rate of one export."""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def add(self, size):
+        self.bytes += size
+
+    @property
+    def rate(self):
+        return self.bytes / max(time.monotonic() - self.started, 1e-9)
+
+    def finish(self, tenant_id):
+        metrics.observe('tenant_export_bytes_per_second', self.rate,
+                        buckets=(1e5, 1e6, 5e6, 1e7, 5e7, 1e8), resource=self.resource)
+        logger.info('Export of %s for tenant %s: %d bytes at %.0f B/s', self.resource, tenant_id, self.bytes, self.rate)
+
+
+def stream(tenant_id, resource, fmt='ndjson', **bounds):
+    """The compressed bytes of an export, for a streamed HTTP response."""
+    throughput = Throughput(resource)
+    for member, _ in export_chunks(tenant_id, resource, fmt, **bounds):
+        throughput.add(len(member))
+        yield member
+    throughput.finish(tenant_id)
+
+
+def _load_progress(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_progress(path, progress):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(progress, f)
+    os.replace(path + '.tmp', path)
+
+
+def _now():
+    """The database's current time, in the zone the (naive) timestamps are stored in."""
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT LOCALTIMESTAMP')
+            return cur.fetchone()[0].isoformat()
+    finally:
+        conn.close()
+
+
+def export_to_file(tenant_id, resource, output, fmt='ndjson', since=None, until=None, report=None):
+    """
+    Writes an export to ``output``, resuming a previous interrupted run of the
+    same export. ``report(bytes_written, bytes_per_second)`` is called after every chunk.
+    """
+    progress_path = output + '.progress'
+    progress = _load_progress(progress_path)
+    if progress:
+        since, until = progress['since'], progress['until']
+        after, after_id, offset = progress['after'], progress['after_id'], progress['offset']
+        logger.info('Resuming %s after %s (%s bytes written)', output, after, offset)
+    else:
+        after, after_id, offset = None, None, 0
+        if not until:
+            until = _now()
+
+    throughput = Throughput(resource)
+    with open(output, 'ab') as f:
+        # Drops a chunk that was being written when the previous run stopped.
+        f.truncate(offset)
+        for member, last in export_chunks(tenant_id, resource, fmt, since, until, after, after_id,
+                                          header=offset == 0):
+            f.write(member)
+            f.flush()
+            os.fsync(f.fileno())
+            offset += len(member)
+            throughput.add(len(member))
+            if last:
+                after, after_id = last[0].isoformat(), str(last[1])
+            _save_progress(progress_path, {
+                'since': since, 'until': until, 'after': after, 'after_id': after_id, 'offset': offset,
+            })
+            if report:
+                report(offset, throughput.rate)
+    throughput.finish(tenant_id)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return offset
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Exporta los mensajes o conversaciones de un tenant (gzip)')
+    parser.add_argument('tenant_id')
+    parser.add_argument('resource', choices=sorted(RESOURCES))
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--since', help='Desde esta fecha (ISO 8601, inclusive)')
+    parser.add_argument('--until', help='Hasta esta fecha (ISO 8601, exclusiva); por defecto, cuando empezó la exportación')
+    parser.add_argument('-o', '--output', help='Archivo de salida (por defecto <resource>-<tenant>.<format>.gz)')
+    args = parser.parse_args()
+
+    output = args.output or f'{args.resource}-{args.tenant_id}.{args.format}.gz'
+
+    def report(written, rate):
+        print(f'\r{written / 1e6:.1f} MB  {rate / 1e6:.2f} MB/s', end='', file=sys.stderr, flush=True)
+
+    total = export_to_file(args.tenant_id, args.resource, output, args.format, args.since, args.until, report)
+    print(f'\n{output}: {total} bytes', file=sys.stderr)
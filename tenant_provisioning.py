@@ -0,0 +1,266 @@
+# tenant_provisioning.py
+
+"""
+Bulk creation of tenants, for resellers onboarding many sub-accounts.
+
+Rows are validated and their passwords hashed in a pool of
+``PROVISION_WORKERS`` processes (hashing is CPU-bound and holds the GIL),
+then inserted ``PROVISION_CHUNK_SIZE`` at a time with one multi-row
+``INSERT ... ON CONFLICT DO NOTHING`` per chunk, each chunk in its own
+transaction. Every input row gets an outcome: ``created`` (with its ID and
+API key), ``conflict`` (number or username already taken), ``invalid`` or
+``failed`` (the chunk's transaction was rolled back).
+
+From the command line::
+
+    python tenant_provisioning.py tenants.csv > resultado.json
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+from psycopg2.extras import execute_values
+from werkzeug.security import generate_password_hash
+
+import instrumentation
+import metrics
+import tenant_cache
+from broadcast import E164_RE
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv('PROVISION_CHUNK_SIZE', 500))
+WORKERS = int(os.getenv('PROVISION_WORKERS', os.cpu_count() or 1))
+# Rows accepted per HTTP request (the CLI has no limit).
+MAX_ROWS = int(os.getenv('PROVISION_MAX_ROWS', 5000))
+
+REQUIRED = ('name', 'twilio_account_sid', 'twilio_auth_token', 'twilio_whatsapp_number')
+COLUMNS = ('id', 'name', 'username', 'password', 'twilio_account_sid', 'twilio_auth_token',
+           'twilio_whatsapp_number', 'api_key', 'tier', 'requests_per_minute', 'messages_per_second',
+           'retention_days')
+
+metrics.describe('tenant_provisioning_total', 'Bulk-provisioned tenant rows by outcome')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def rows_from_json(items):
+    yield from items
+
+
+def rows_from_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def rows_from_csv(stream):
+    for row in csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline='')):
+        # Empty CSV cells mean "not set", like a missing JSON key.
+        yield {key: value for key, value in row.items() if value not in ('', None)}
+
+
+def positive_number(value, cast, name):
+    """Casts an optional per-tenant limit, raising ``ValueError`` unless it is > 0."""
+    if value is None:
+        return None
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' debe ser un número")
+    if number <= 0:
+        raise ValueError(f"'{name}' debe ser mayor que 0")
+    return number
+
+
+def prepare(row):
+    """
+    Validates one input row and hashes its password. Returns
+    ``('ok', values)`` with the insert values in ``COLUMNS`` order, or
+    ``('invalid', error)``. Runs in the worker processes.
+    """
+    if not isinstance(row, dict):
+        return 'invalid', 'La fila no es un objeto JSON'
+    missing = [field for field in REQUIRED if not row.get(field)]
+    if missing:
+        return 'invalid', 'Faltan campos obligatorios: ' + ', '.join(missing)
+    number = str(row['twilio_whatsapp_number']).strip()
+    if not E164_RE.match(number.replace('whatsapp:', '')):
+        return 'invalid', 'Número de WhatsApp inválido (formato E.164, p. ej. whatsapp:+17869461491)'
+    username, password = row.get('username'), row.get('password')
+    if bool(username) != bool(password):
+        return 'invalid', "'username' y 'password' van juntos"
+    try:
+        requests_per_minute = positive_number(row.get('requests_per_minute'), int, 'requests_per_minute')
+        messages_per_second = positive_number(row.get('messages_per_second'), float, 'messages_per_second')
+        retention_days = positive_number(row.get('retention_days'), int, 'retention_days')
+    except ValueError as e:
+        return 'invalid', str(e)
+
+    tenant_id = str(uuid.uuid4())
+    return 'ok', (
+        tenant_id, row['name'], username, generate_password_hash(password) if password else None,
+        row['twilio_account_sid'], row['twilio_auth_token'], number, tenant_id,
+        row.get('tier') or instrumentation.DEFAULT_TIER, requests_per_minute, messages_per_second, retention_days,
+    )
+
+
+def _executor():
+    """The shared process pool, created on first use (None with a single worker)."""
+    global _pool
+    if WORKERS <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the parent has pool connections and threads.
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _prepare_all(rows):
+    executor = _executor()
+    if executor is None:
+        return [prepare(row) for row in rows]
+    return list(executor.map(prepare, rows, chunksize=max(1, len(rows) // (WORKERS * 4))))
+
+
+def _insert_chunk(cur, values):
+    """Inserts a chunk; returns the IDs inserted and the conflicting numbers and usernames."""
+    inserted = execute_values(
+        cur,
+        f"INSERT INTO tenants ({', '.join(COLUMNS)}) VALUES %s ON CONFLICT DO NOTHING RETURNING id",
+        values,
+        page_size=len(values),
+        fetch=True
+    )
+    inserted = {str(row[0]) for row in inserted}
+    skipped = [value for value in values if value[0] not in inserted]
+    numbers, usernames = set(), set()
+    if skipped:
+        cur.execute(
+            """
+            SELECT twilio_whatsapp_number, username FROM tenants
+            WHERE (twilio_whatsapp_number = ANY(%s) OR username = ANY(%s)) AND NOT (id = ANY(%s::uuid[]))
+            """,
+            ([value[6] for value in skipped], [value[2] for value in skipped if value[2]], list(inserted))
+        )
+        for number, username in cur.fetchall():
+            numbers.add(number)
+            usernames.add(username)
+    if inserted:
+        cur.execute(
+            "SELECT pg_notify(%s, id::text) FROM unnest(%s::uuid[]) AS id",
+            (tenant_cache.CHANNEL, list(inserted))
+        )
+    return inserted, numbers, usernames
+
+
+def _provision_chunk(conn, chunk, results):
+    prepared = _prepare_all([row for _, row in chunk])
+    values, pending = [], []
+    seen_numbers, seen_usernames = set(), set()
+    for (index, _), (status, value) in zip(chunk, prepared):
+        if status != 'ok':
+            results.append({'index': index, 'status': 'invalid', 'error': value})
+        else:
+            values.append(value)
+            pending.append(index)
+
+    if not values:
+        return
+    try:
+        with conn.cursor() as cur:
+            inserted, numbers, usernames = _insert_chunk(cur, values)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.exception('Bulk tenant chunk failed')
+        results.extend({'index': index, 'status': 'failed', 'error': f'Error de base de datos: {e}'}
+                       for index in pending)
+        return
+
+    for index, value in zip(pending, values):
+        tenant_id, username, number = value[0], value[2], value[6]
+        if tenant_id in inserted:
+            results.append({'index': index, 'status': 'created', 'tenant_id': tenant_id, 'api_key': value[7]})
+            seen_numbers.add(number)
+            if username:
+                seen_usernames.add(username)
+        elif number in numbers or number in seen_numbers:
+            results.append({'index': index, 'status': 'conflict', 'error': 'El número de WhatsApp ya existe'})
+        elif username in usernames or username in seen_usernames:
+            results.append({'index': index, 'status': 'conflict', 'error': 'El nombre de usuario ya existe'})
+        else:
+            results.append({'index': index, 'status': 'conflict', 'error': 'El tenant ya existe'})
+    if inserted:
+        # New ids cannot be cached yet, so one invalidation is enough to reset the cached
+        # default tenant; other processes get the NOTIFY sent with the insert.
+        tenant_cache.invalidate(next(iter(inserted)))
+
+
+def provision(rows, chunk_size=CHUNK_SIZE):
+    """
+    Creates the tenants in ``rows`` (an iterable of dicts with the fields of
+    POST /tenants, plus optional username, password and retention_days).
+    Returns the outcome counts and one result per row, in input order.
+    """
+    results = []
+    chunk = []
+    with db_connection() as conn:
+        for index, row in enumerate(rows):
+            chunk.append((index, row))
+            if len(chunk) >= chunk_size:
+                _provision_chunk(conn, chunk, results)
+                chunk = []
+        if chunk:
+            _provision_chunk(conn, chunk, results)
+
+    summary = {status: 0 for status in ('created', 'conflict', 'invalid', 'failed')}
+    for result in results:
+        summary[result['status']] += 1
+    for status, count in summary.items():
+        metrics.inc('tenant_provisioning_total', count, outcome=status)
+    summary['total'] = len(results)
+    summary['results'] = sorted(results, key=lambda result: result['index'])
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Crea tenants en bloque desde un archivo CSV, NDJSON o JSON')
+    parser.add_argument('file', help="Archivo con una fila por tenant ('-' para la entrada estándar, en NDJSON)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Tenants por transacción')
+    args = parser.parse_args()
+
+    if args.file == '-':
+        summary = provision(rows_from_ndjson(sys.stdin), args.chunk_size)
+    else:
+        with open(args.file, 'rb') as f:
+            if args.file.endswith('.csv'):
+                summary = provision(rows_from_csv(f), args.chunk_size)
+            elif args.file.endswith('.json'):
+                summary = provision(rows_from_json(json.load(f)), args.chunk_size)
+            else:
+                summary = provision(rows_from_ndjson(io.TextIOWrapper(f, encoding='utf-8')), args.chunk_size)
+    json.dump(summary, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write('\n')
+    print(', '.join(f'{status}: {summary[status]}' for status in ('created', 'conflict', 'invalid', 'failed')),
+          file=sys.stderr)
+    sys.exit(1 if summary['failed'] else 0)
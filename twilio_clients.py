@@ -0,0 +1,161 @@
+# twilio_clients.py
+
+"""
+Per-tenant cache of Twilio REST clients sharing one keep-alive HTTP session.
+
+Clients are keyed by tenant id and a fingerprint of the credentials, so a
+credential change never reuses a stale client even before the explicit
+invalidation from the tenant endpoints reaches this process.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from aiohttp import ClientSession, TCPConnector
+from requests.adapters import HTTPAdapter
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+import instrumentation
+import metrics
+import rate_limits
+
+CACHE_SIZE = int(os.getenv('TWILIO_CLIENT_CACHE_SIZE', 256))
+POOL_SIZE = int(os.getenv('TWILIO_HTTP_POOL_SIZE', 20))
+# Connections the ASGI app may open to Twilio at once (see asgi.py).
+ASYNC_POOL_SIZE = int(os.getenv('TWILIO_ASYNC_POOL_SIZE', 200))
+HTTP_TIMEOUT = float(os.getenv('TWILIO_HTTP_TIMEOUT', 10))
+# Points every Twilio API call at another host, e.g. the stand-in server in bench/fake_twilio.py.
+API_BASE_URL = os.getenv('TWILIO_API_BASE_URL')
+# Public URL of /webhook/twilio/status; when unset Twilio sends no delivery callbacks.
+STATUS_CALLBACK_URL = os.getenv('TWILIO_STATUS_CALLBACK_URL')
+
+_TWILIO_HOST_RE = re.compile(r'^https://[a-z0-9.-]+\.twilio\.com')
+
+metrics.describe('twilio_client_cache_total', 'Twilio client cache lookups by result')
+
+
+class SharedTwilioHttpClient(TwilioHttpClient):
+    """TwilioHttpClient with a bounded keep-alive pool and an optional base URL override."""
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=HTTP_TIMEOUT, base_url=API_BASE_URL):
+        super().__init__(pool_connections=True, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url:
+            url = _TWILIO_HOST_RE.sub(self.base_url, url, count=1)
+        with instrumentation.span('twilio'):
+            return super().request(method, url, *args, **kwargs)
+
+
+class SharedAsyncTwilioHttpClient(AsyncTwilioHttpClient):
+    """aiohttp-based counterpart of SharedTwilioHttpClient; create it inside the event loop."""
+
+    def __init__(self, pool_size=ASYNC_POOL_SIZE, timeout=HTTP_TIMEOUT, base_url=API_BASE_URL):
+        super().__init__(pool_connections=False, timeout=timeout)
+        self.session = ClientSession(connector=TCPConnector(limit=pool_size))
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    async def request(self, method, url, *args, **kwargs):
+        if self.base_url:
+            url = _TWILIO_HOST_RE.sub(self.base_url, url, count=1)
+        return await super().request(method, url, *args, **kwargs)
+
+
+_http_client = None
+_async_http_client = None
+_clients = OrderedDict()  # (tenant_id, fingerprint) -> Client
+_async_clients = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_http_client():
+    """Returns the process-wide HTTP client, creating it on first use."""
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = SharedTwilioHttpClient()
+    return _http_client
+
+
+def credential_fingerprint(account_sid, auth_token):
+    return hashlib.sha256(f'{account_sid}:{auth_token}'.encode()).hexdigest()[:16]
+
+
+def get_async_http_client():
+    """Returns the process-wide async HTTP client; call from within the event loop."""
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = SharedAsyncTwilioHttpClient()
+    return _async_http_client
+
+
+async def close_async_http_client():
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.close()
+        _async_http_client = None
+
+
+def _cached_client(cache, tenant_id, account_sid, auth_token, http_client_factory):
+    key = (str(tenant_id), credential_fingerprint(account_sid, auth_token))
+    with _lock:
+        client = cache.get(key)
+        if client is not None:
+            cache.move_to_end(key)
+            metrics.inc('twilio_client_cache_total', result='hit')
+            return client
+
+    metrics.inc('twilio_client_cache_total', result='miss')
+    client = Client(account_sid, auth_token, http_client=http_client_factory())
+    with _lock:
+        cache[key] = client
+        cache.move_to_end(key)
+        while len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+    return client
+
+
+def get_client(tenant_id, account_sid, auth_token):
+    """Returns a cached Twilio client for the tenant's current credentials."""
+    return _cached_client(_clients, tenant_id, account_sid, auth_token, get_http_client)
+
+
+def get_async_client(tenant_id, account_sid, auth_token):
+    """Like ``get_client``, for the ``*_async`` methods; call from within the event loop."""
+    return _cached_client(_async_clients, tenant_id, account_sid, auth_token, get_async_http_client)
+
+
+def send_message(client, from_, to, body, send_rate=None):
+    """
+    Creates an outbound message, asking for status callbacks when configured.
+    Paced to ``send_rate`` messages per second per sender number (see
+    rate_limits.py); raises ``rate_limits.SendThrottled`` when over it.
+    """
+    rate_limits.pace_send(from_, rate_limits.SEND_RATE_PER_NUMBER if send_rate is None else send_rate)
+    kwargs = {'status_callback': STATUS_CALLBACK_URL} if STATUS_CALLBACK_URL else {}
+    return client.messages.create(from_=from_, to=to, body=body, **kwargs)
+
+
+async def send_message_async(client, from_, to, body, send_rate=None):
+    await rate_limits.pace_send_async(from_, rate_limits.SEND_RATE_PER_NUMBER if send_rate is None else send_rate)
+    kwargs = {'status_callback': STATUS_CALLBACK_URL} if STATUS_CALLBACK_URL else {}
+    return await client.messages.create_async(from_=from_, to=to, body=body, **kwargs)
+
+
+def invalidate(tenant_id):
+    """Drops every cached client for the tenant."""
+    tenant_id = str(tenant_id)
+    with _lock:
+        for cache in (_clients, _async_clients):
+            for key in [key for key in cache if key[0] == tenant_id]:
+                del cache[key]